@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+加解密的微基准测试，比较逐个加密（每次都运算密钥、新建加密对象）、
+缓存密钥后的逐个加密和批量加密，每个值的平均耗时
+
+在项目根目录下执行：
+
+    python app/bench_cipher.py [条数]
+"""
+
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Crypto.Cipher import AES
+from gmssl import sm4
+
+import cipherutils
+import gmutils
+
+KEY = '28637AAC596048ABB6C265B608E523FEvectooor'
+SM4_KEY = '1234567890123456'
+
+def aes_uncached(aes, values):
+    # 缓存之前的做法：每个值都运算一次密钥，新建一个AES对象
+    result = []
+    for v in values:
+        cipher = AES.new(cipherutils._derive_key.__wrapped__(KEY), AES.MODE_ECB)
+        result.append(base64.b64encode(cipher.encrypt(aes._pkcs5_padding(v).encode())).decode())
+    return result
+
+def sm4_gmssl(values):
+    # 缓存之前的做法：每个值都新建CryptSM4并做密钥扩展
+    result = []
+    for v in values:
+        cryptor = sm4.CryptSM4()
+        cryptor.set_key(SM4_KEY.encode(), sm4.SM4_ENCRYPT)
+        result.append(base64.b64encode(cryptor.crypt_ecb(v.encode())).decode())
+    return result
+
+def timeit(func, count):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) / count * 1e6
+
+def main(count=100000):
+    values = ['{:011d}'.format(13800000000 + i) for i in range(count)]
+    aes = cipherutils.AESUtils()
+    sm4_cipher = gmutils.Sm4Cipher(SM4_KEY)
+    # gmssl太慢，只测一部分
+    sm4_count = min(count, 5000)
+
+    cases = [
+        ('aes uncached encrypt', lambda: aes_uncached(aes, values), count),
+        ('aes cached encrypt', lambda: [aes.encrypt(v, KEY) for v in values], count),
+        ('aes encrypt_many', lambda: aes.encrypt_many(values, KEY), count),
+        ('sm4 gmssl encrypt', lambda: sm4_gmssl(values[:sm4_count]), sm4_count),
+        ('sm4 cached encrypt', lambda: [gmutils.sm4_encrypt(SM4_KEY, v) for v in values[:sm4_count]], sm4_count),
+        ('sm4 encrypt_many', lambda: sm4_cipher.encrypt_many(values), count),
+    ]
+
+    print('values: {}, sm4 native: {}'.format(count, gmutils.NATIVE_SM4))
+    print('{:<22} {:>12}'.format('case', 'us/value'))
+    results = {}
+    for name, func, n in cases:
+        results[name], cost = timeit(func, n)
+        print('{:<22} {:>12.2f}'.format(name, cost))
+
+    # 几种方式的结果必须一致
+    assert results['aes uncached encrypt'] == results['aes cached encrypt'] == results['aes encrypt_many']
+    assert results['sm4 gmssl encrypt'] == results['sm4 cached encrypt'] == results['sm4 encrypt_many'][:sm4_count]
+
+
+if __name__ == '__main__':
+
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+FTP传输吞吐量测试，在本机启动一个FTP服务器，比较不同块大小下载和上传的MB/s
+
+需要 pip install pyftpdlib，在项目根目录下执行：
+
+    python app/bench_ftp.py [文件大小MB] [重复次数]
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+import umsftp
+
+BLOCK_SIZES = [2048, 8192, 65536, 262144, 1048576, 4194304]
+
+def start_server(root):
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', root, perm='elradfmwMT')
+    handler = type('BenchHandler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+    return server
+
+def best_of(repeat, func):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(size_mb=64, repeat=3):
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    root = tempfile.mkdtemp()
+    local_dir = tempfile.mkdtemp()
+    server = start_server(root)
+    try:
+        size = size_mb * 1048576
+        with open(os.path.join(root, 'bench.bin'), 'wb') as f:
+            f.write(os.urandom(size))
+        local = os.path.join(local_dir, 'bench.bin')
+
+        ftp_config = {'host': '127.0.0.1', 'port': server.address[1],
+                      'username': 'bench', 'password': 'bench'}
+        print('file size: {}MB, best of {}'.format(size_mb, repeat))
+        print('{:>10} {:>14} {:>14}'.format('block', 'download MB/s', 'upload MB/s'))
+        with umsftp.FtpSession(ftp_config) as session:
+            for block_size in BLOCK_SIZES:
+                ftp = session.ftp
+                down = best_of(repeat, lambda: umsftp.download(
+                    ftp, local, '/bench.bin', quit=False, block_size=block_size))
+                up = best_of(repeat, lambda: umsftp.upload(
+                    ftp, local, '/upload.bin', quit=False, block_size=block_size))
+                print('{:>10} {:>14.1f} {:>14.1f}'.format(block_size, size_mb / down, size_mb / up))
+    finally:
+        server.close_all()
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(local_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -5,12 +5,29 @@
 
 from Crypto.Cipher import AES
 import base64
+import functools
 import hashlib
+import itertools
+import os
 
 from umsexception import UmsException
 
 ENCODING = 'utf-8'
 
+# bytes接口的密文编码格式，和gmutils的取值一致，None表示不编码
+ENCODING_B64 = 0
+ENCODING_HEX = 1
+
+# 流式加密支持的算法和模式
+ALGORITHM_AES = 'aes'
+ALGORITHM_SM4 = 'sm4'
+STREAM_CBC = 'cbc'
+STREAM_CTR = 'ctr'
+# 文件加解密每次读取的字节数，需要是16的倍数
+STREAM_BLOCK_SIZE = 1048576
+# 缓存多少个密钥的运算结果和ECB加密对象
+KEY_CACHE_SIZE = 128
+
 def byte2hexstr(byte):
     return byte.hex().upper()
 
@@ -19,9 +36,58 @@ def pkcs5_padding(value, BS):
 
     意思就是长度必须是BS的倍数，如果不是，则进行填充。
     例如，如果长度是12，BS=16，需要补 4 个 0x04
+
+    注意这里按字符计算长度，含有中文等多字节字符时不正确，请使用pkcs7_padding
     """
     return value + (BS - len(value) % BS) * chr(BS - len(value) % BS)
 
+def pkcs7_padding(data, BS=16):
+    """按字节计算的PKCS7填充，data为bytes/bytearray/memoryview
+
+    Returns:
+        bytes
+    """
+    n = BS - len(data) % BS
+    return b''.join((data, bytes((n,)) * n))
+
+def pkcs7_unpadding(data, BS=16):
+    """去掉PKCS7填充，填充不正确（通常是密钥错误）时抛出异常
+    """
+    n = data[-1] if len(data) else 0
+    if n < 1 or n > BS or data[-n:] != bytes((n,)) * n:
+        raise UmsException("padding error, wrong key or broken cipher text")
+    return data[:-n]
+
+def _encode(data, encoding):
+    if encoding is None:
+        return data
+    if encoding == ENCODING_HEX:
+        return data.hex()
+    return base64.b64encode(data).decode(ENCODING)
+
+def _decode(data, encoding):
+    if encoding is None:
+        return data
+    if encoding == ENCODING_HEX:
+        return bytes.fromhex(data)
+    return base64.b64decode(data)
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _derive_key(key):
+    digest = hashlib.sha256()
+    digest.update(key.encode(ENCODING))
+    sha256 = digest.digest()
+
+    key = hashlib.sha1(sha256).digest()
+    key = hashlib.sha1(key).digest()
+
+    return key[:16]
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _ecb_cipher(key):
+    # ECB没有状态，同一个对象可以反复加解密
+    return AES.new(_derive_key(key), AES.MODE_ECB)
+
 class AESUtils(object):
     """AES加解密，但是这里的key进行过运算，所以key可以是任意长度
     """
@@ -47,19 +113,18 @@ class AESUtils(object):
         ```
 
         """
-        if str == type(key):
-            key = key.encode(ENCODING)
-        else:
+        if str != type(key):
             raise UmsException("key must be a string")
 
-        digest = hashlib.sha256()
-        digest.update(key)
-        sha256 = digest.digest()
+        # 运算结果按key缓存，同一个key只算一次
+        return _derive_key(key)
 
-        key = hashlib.sha1(sha256).digest()
-        key = hashlib.sha1(key).digest()
-
-        return key[:16]
+    def _cipher(self, key):
+        if str != type(key):
+            raise UmsException("key must be a string")
+        if self.mode == AES.MODE_ECB:
+            return _ecb_cipher(key)
+        return AES.new(self._sha1png_key(key), self.mode)
 
     def encrypt(self, data, key):
         """AES加密
@@ -71,16 +136,7 @@ class AESUtils(object):
         Returns:
             base64加密的字符串
         """
-        if str == type(key):
-            # key = key.encode(ENCODING)
-            key = self._sha1png_key(key)
-        else:
-            raise UmsException("key must be a string")
-
-        aes = AES.new(key, self.mode)
-        cipherbytes = aes.encrypt(self._pkcs5_padding(data).encode(ENCODING))
-        # b64encode返回的是bytes类型，通过decode转为string类型
-        return base64.b64encode(cipherbytes).decode(ENCODING)
+        return self.encrypt_bytes(data.encode(ENCODING), key, ENCODING_B64)
 
     def decrypt(self, data, key):
         """AES解密
@@ -92,18 +148,268 @@ class AESUtils(object):
         Returns:
             解密成功后的明文
         """
+        # 先按字节去掉填充再转为string类型
+        return self.decrypt_bytes(data, key, ENCODING_B64).decode(ENCODING)
+
+    def encrypt_bytes(self, data, key, encoding=None):
+        """AES加密二进制数据，按字节做PKCS7填充
+
+        整块的部分直接从data加密到输出缓冲区，只有最后一块需要拼上填充，不复制整个明文
+
+        Args:
+            @param data     : 明文，bytes/bytearray/memoryview
+            @param key      : 加密密钥，str类型
+            @param encoding : 密文的编码，None返回bytearray，ENCODING_B64/ENCODING_HEX返回str
+
+        Returns:
+            bytearray或编码后的str
+        """
+        aes = self._cipher(key)
+        view = memoryview(data).cast('B')
+        n = len(view) - len(view) % AES.block_size
+        out = bytearray(n + AES.block_size)
+        if n:
+            aes.encrypt(view[:n], output=memoryview(out)[:n])
+        aes.encrypt(pkcs7_padding(view[n:], AES.block_size), output=memoryview(out)[n:])
+        return _encode(out, encoding)
+
+    def decrypt_bytes(self, data, key, encoding=None):
+        """AES解密二进制数据，和encrypt_bytes相反
+
+        Args:
+            @param data     : 密文，encoding为None时是bytes/bytearray/memoryview，否则是编码后的str
+            @param key      : 解密密钥，str类型
+            @param encoding : 密文的编码，None/ENCODING_B64/ENCODING_HEX
+
+        Returns:
+            bytearray，明文
+        """
+        aes = self._cipher(key)
+        view = memoryview(_decode(data, encoding)).cast('B')
+        if not len(view) or len(view) % AES.block_size:
+            raise UmsException("cipher text length need multiple of 16")
+        out = bytearray(len(view))
+        aes.decrypt(view, output=out)
+        n = len(out) - len(pkcs7_unpadding(memoryview(out), AES.block_size))
+        # 原地截断，不复制
+        del out[-n:]
+        return out
+
+    def _check_batch(self, key):
+        # 多个值拼在一起一次加解密，只有ECB模式每一块是独立的
+        if self.mode != AES.MODE_ECB:
+            raise UmsException("encrypt_many/decrypt_many only support ECB mode")
+        return self._cipher(key)
+
+    def encrypt_many(self, values, key):
+        """批量AES加密，所有值填充后拼接起来只调用一次AES，再按长度切开
+
+        Args:
+            @param values : 要加密的字符串，list或迭代器
+            @param key    : 加密密钥，str类型
+
+        Returns:
+            list，和values一一对应的base64密文，和逐个调用encrypt的结果一致
+        """
+        aes = self._check_batch(key)
+        padded = [pkcs7_padding(v.encode(ENCODING), AES.block_size) for v in values]
+        cipherbytes = aes.encrypt(b''.join(padded))
+        result = []
+        pos = 0
+        for v in padded:
+            result.append(base64.b64encode(cipherbytes[pos:pos + len(v)]).decode(ENCODING))
+            pos += len(v)
+        return result
+
+    def decrypt_many(self, values, key):
+        """批量AES解密，和encrypt_many相反
+
+        Args:
+            @param values : base64编码的密文，list或迭代器
+            @param key    : 解密密钥，str类型
+
+        Returns:
+            list，和values一一对应的明文
+        """
+        aes = self._check_batch(key)
+        blocks = [base64.b64decode(v) for v in values]
+        plainbytes = aes.decrypt(b''.join(blocks))
+        result = []
+        pos = 0
+        for v in blocks:
+            result.append(pkcs7_unpadding(plainbytes[pos:pos + len(v)], AES.block_size).decode(ENCODING))
+            pos += len(v)
+        return result
+
+def _stream_update(algorithm, key, mode, iv, decrypt):
+    """返回流式加解密的update函数，多次调用之间保持CBC链接状态或CTR计数器
+    """
+    if algorithm not in (ALGORITHM_AES, ALGORITHM_SM4):
+        raise UmsException("error algorithm, need aes or sm4")
+    if mode not in (STREAM_CBC, STREAM_CTR):
+        raise UmsException("error mode, need cbc or ctr")
+
+    if algorithm == ALGORITHM_AES:
+        # str类型的key和AESUtils一样经过SHA1PRNG运算，bytes类型的key直接使用
         if str == type(key):
-            # key = key.encode(ENCODING)
-            key = self._sha1png_key(key)
-        else:
-            raise UmsException("key must be a string")
+            key = AESUtils()._sha1png_key(key)
+        if mode == STREAM_CTR:
+            return AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=iv).encrypt
+        aes = AES.new(key, AES.MODE_CBC, iv=iv)
+        return aes.decrypt if decrypt else aes.encrypt
+
+    from gmutils import Sm4Stream
+    if str == type(key):
+        key = key.encode(ENCODING)[:16]
+    return Sm4Stream(key, iv, ctr=mode == STREAM_CTR, decrypt=decrypt).update
+
+def _digest_hasher(digest):
+    if digest is None or not isinstance(digest, str):
+        return digest
+    if digest.lower() == 'sm3':
+        from gmutils import SM3
+        return SM3()
+    return hashlib.new(digest)
+
+def encrypt_stream(chunks, key, mode=STREAM_CBC, iv=None, algorithm=ALGORITHM_AES, hasher=None):
+    """流式加密，返回一个生成器，逐块返回密文，内存占用只和块的大小有关
+
+    CBC模式只在最后一块做PKCS7填充，CTR模式不填充，密文和明文一样长。
+    iv为None时随机生成，并作为密文的前16个字节输出，解密时iv同样传None即可。
+
+    Args:
+        @param chunks    : 明文，bytes/memoryview的迭代器，每块最好是16的倍数
+        @param key       : 密钥，AES的str类型key和AESUtils一样经过运算，bytes类型直接使用；
+                           SM4为16个字符的str或16字节的bytes
+        @param mode      : STREAM_CBC或STREAM_CTR
+        @param iv        : CBC的初始向量或CTR的初始计数器，16字节的bytes
+        @param algorithm : ALGORITHM_AES或ALGORITHM_SM4
+        @param hasher    : 可选，hashlib风格的对象，例如gmutils.SM3()，同时计算输出的密文的摘要
 
-        aes = AES.new(key, self.mode)
-        # 解密后返回的是bytes，通过decode转为string类型
-        paddingtext = aes.decrypt(base64.b64decode(data)).decode(ENCODING)
-        # ord和chr是配对函数：ord('a')=97 chr(97)='a'
-        # 解密出来的明文也是pkcs5padding，这里是反向padding
-        return paddingtext[:-ord(paddingtext[-1])]
+    Returns:
+        generator，元素为bytes
+    """
+    header = b''
+    if iv is None:
+        iv = header = os.urandom(16)
+    update = _stream_update(algorithm, key, mode, iv, False)
+
+    def output(data):
+        if hasher is not None:
+            hasher.update(data)
+        return data
+
+    if header:
+        yield output(header)
+    rest = b''
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+        n = len(chunk) - len(chunk) % 16
+        rest = bytes(chunk[n:])
+        if n:
+            yield output(update(chunk[:n] if n != len(chunk) else chunk))
+    if mode == STREAM_CBC:
+        rest = pkcs7_padding(rest)
+    if rest:
+        yield output(update(rest))
+
+def _hashed(chunks, hasher):
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def decrypt_stream(chunks, key, mode=STREAM_CBC, iv=None, algorithm=ALGORITHM_AES, hasher=None):
+    """流式解密，参数同encrypt_stream，hasher计算的是输入的密文的摘要
+
+    Returns:
+        generator，元素为bytes
+    """
+    chunks = iter(chunks)
+    if hasher is not None:
+        chunks = _hashed(chunks, hasher)
+    rest = b''
+    if iv is None:
+        # 密文的前16个字节是iv，读iv时多读的部分放回去，和后面的块一样处理
+        while len(rest) < 16:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise UmsException("cipher text too short")
+            rest += chunk
+        iv = rest[:16]
+        chunks = itertools.chain([rest[16:]], chunks)
+        rest = b''
+    update = _stream_update(algorithm, key, mode, iv, True)
+
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+        n = len(chunk) - len(chunk) % 16
+        if mode == STREAM_CBC and n and n == len(chunk):
+            # CBC留下最后一块，结束时去掉填充
+            n -= 16
+        rest = bytes(chunk[n:])
+        if n:
+            yield update(chunk[:n])
+
+    if mode == STREAM_CBC:
+        if len(rest) != 16:
+            raise UmsException("cipher text length need multiple of 16")
+        yield pkcs7_unpadding(update(rest))
+    elif rest:
+        yield update(rest)
+
+def _read_blocks(f, block_size):
+    # 复用同一块缓冲区，返回的memoryview在读取下一块之前有效
+    buf = bytearray(block_size - block_size % 16 or 16)
+    view = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        yield view[:n]
+
+def _crypt_file(stream, src, dst, key, mode, iv, algorithm, digest, block_size):
+    hasher = _digest_hasher(digest)
+    tmp = dst + '.tmp'
+    with open(src, 'rb', buffering=0) as fin:
+        try:
+            with open(tmp, 'wb') as fout:
+                for data in stream(_read_blocks(fin, block_size), key, mode, iv, algorithm, hasher):
+                    fout.write(data)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    os.replace(tmp, dst)
+    return hasher.hexdigest() if hasher is not None else None
+
+def encrypt_file(src, dst, key, mode=STREAM_CBC, iv=None, algorithm=ALGORITHM_AES, digest=None,
+                 block_size=STREAM_BLOCK_SIZE):
+    """加密文件，按block_size分块处理，内存占用和文件大小无关
+
+    Args:
+        @param src        : 明文文件
+        @param dst        : 密文文件，先写入dst.tmp，成功后改名
+        @param key        : 密钥，同encrypt_stream
+        @param mode       : STREAM_CBC或STREAM_CTR
+        @param iv         : 初始向量，None则随机生成并写在密文文件的开头
+        @param algorithm  : ALGORITHM_AES或ALGORITHM_SM4
+        @param digest     : 可选，密文文件的摘要算法，'sm3'或hashlib支持的名字，例如'sha256'
+        @param block_size : 每次读取的字节数
+
+    Returns:
+        密文文件摘要的hex，digest为None时返回None
+    """
+    return _crypt_file(encrypt_stream, src, dst, key, mode, iv, algorithm, digest, block_size)
+
+def decrypt_file(src, dst, key, mode=STREAM_CBC, iv=None, algorithm=ALGORITHM_AES, digest=None,
+                 block_size=STREAM_BLOCK_SIZE):
+    """解密文件，参数同encrypt_file，digest计算的是密文文件的摘要，可以和加密时的结果比对
+
+    Returns:
+        密文文件摘要的hex，digest为None时返回None
+    """
+    return _crypt_file(decrypt_stream, src, dst, key, mode, iv, algorithm, digest, block_size)
 
 if __name__ == '__main__':
 
@@ -5,7 +5,22 @@
 # @date: 2022-03-20
 
 import base64
-from gmssl import sm3, sm4, func
+import concurrent.futures
+import functools
+import hashlib
+import struct
+from gmssl import sm4
+
+from cipherutils import pkcs7_padding, pkcs7_unpadding
+from umsexception import UmsException
+
+# cryptography（OpenSSL）支持SM4时，Sm4Cipher默认使用它
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    Cipher(algorithms.SM4(b'\x00' * 16), modes.ECB()).encryptor()
+    NATIVE_SM4 = True
+except Exception:
+    NATIVE_SM4 = False
 
 DEFAULT_CHARSET = "utf-8"
 
@@ -17,6 +32,153 @@ ENCODING_B58 = 2
 SM4_ECB = 0
 SM4_CBC = 1
 
+# 读文件计算摘要时每次读取的字节数
+FILE_BLOCK_SIZE = 1048576
+
+# OpenSSL 1.1.1以上的hashlib支持SM3，比纯Python实现快两个数量级
+try:
+    hashlib.new('sm3')
+    HASHLIB_SM3 = True
+except ValueError:
+    HASHLIB_SM3 = False
+
+_SM3_IV = (0x7380166f, 0x4914b2b9, 0x172442d7, 0xda8a0600,
+           0xa96f30bc, 0x163138aa, 0xe38dee4d, 0xb0fb0e4e)
+_MASK = 0xffffffff
+
+def _rotl(x, n):
+    n %= 32
+    return ((x << n) | (x >> (32 - n))) & _MASK
+
+# 每一轮的常量T_j循环左移j位，预先算好
+_SM3_T = [_rotl(0x79cc4519 if j < 16 else 0x7a879d8a, j) for j in range(64)]
+
+def _sm3_compress(v, data, pos):
+    """SM3压缩函数，处理data[pos:pos+64]这一个分组
+    """
+    w = list(struct.unpack_from('>16I', data, pos))
+    for j in range(16, 68):
+        x = w[j - 16] ^ w[j - 9] ^ (((w[j - 3] << 15) | (w[j - 3] >> 17)) & _MASK)
+        x ^= (((x << 15) | (x >> 17)) ^ ((x << 23) | (x >> 9))) & _MASK
+        w.append(x ^ (((w[j - 13] << 7) | (w[j - 13] >> 25)) & _MASK) ^ w[j - 6])
+
+    a, b, c, d, e, f, g, h = v
+    for j in range(64):
+        a12 = ((a << 12) | (a >> 20)) & _MASK
+        ss1 = (a12 + e + _SM3_T[j]) & _MASK
+        ss1 = ((ss1 << 7) | (ss1 >> 25)) & _MASK
+        if j < 16:
+            ff = a ^ b ^ c
+            gg = e ^ f ^ g
+        else:
+            ff = (a & b) | (a & c) | (b & c)
+            gg = (e & f) | (~e & g)
+        tt1 = (ff + d + (ss1 ^ a12) + (w[j] ^ w[j + 4])) & _MASK
+        tt2 = (gg + h + ss1 + w[j]) & _MASK
+        d = c
+        c = ((b << 9) | (b >> 23)) & _MASK
+        b = a
+        a = tt1
+        h = g
+        g = ((f << 19) | (f >> 13)) & _MASK
+        f = e
+        e = tt2 ^ (((tt2 << 9) | (tt2 >> 23)) ^ ((tt2 << 17) | (tt2 >> 15))) & _MASK
+
+    return (v[0] ^ a, v[1] ^ b, v[2] ^ c, v[3] ^ d, v[4] ^ e, v[5] ^ f, v[6] ^ g, v[7] ^ h)
+
+
+class SM3(object):
+    """增量计算的SM3摘要，用法和hashlib一致
+
+        h = SM3()
+        h.update(b'...')
+        h.update(b'...')
+        h.hexdigest()
+
+    hashlib支持SM3时使用hashlib，否则使用纯Python实现，两者结果一致
+    """
+
+    name = 'sm3'
+    digest_size = 32
+    block_size = 64
+
+    def __init__(self, data = None):
+        self._hash = hashlib.new('sm3') if HASHLIB_SM3 else None
+        self._v = _SM3_IV
+        self._buf = bytearray()
+        self._count = 0
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        """追加数据
+        Args:
+            @data       : bytes、bytearray、memoryview，str按utf-8编码
+        """
+        if isinstance(data, str):
+            data = data.encode(DEFAULT_CHARSET)
+        if self._hash is not None:
+            self._hash.update(data)
+            return
+
+        data = memoryview(data).cast('B')
+        n = len(data)
+        self._count += n
+        pos = 0
+        if self._buf:
+            pos = 64 - len(self._buf)
+            self._buf += data[:pos]
+            if len(self._buf) < 64:
+                return
+            self._v = _sm3_compress(self._v, self._buf, 0)
+            self._buf = bytearray()
+
+        v = self._v
+        while pos + 64 <= n:
+            v = _sm3_compress(v, data, pos)
+            pos += 64
+        self._v = v
+        self._buf += data[pos:]
+
+    def digest(self):
+        if self._hash is not None:
+            return self._hash.digest()
+
+        # 填充：0x80，若干个0，64位的消息长度（比特数）
+        tail = bytes(self._buf) + b'\x80' + b'\x00' * ((55 - len(self._buf)) % 64)
+        tail += struct.pack('>Q', self._count * 8)
+        v = self._v
+        for pos in range(0, len(tail), 64):
+            v = _sm3_compress(v, tail, pos)
+        return struct.pack('>8I', *v)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def copy(self):
+        other = SM3.__new__(SM3)
+        other._hash = self._hash.copy() if self._hash is not None else None
+        other._v = self._v
+        other._buf = bytearray(self._buf)
+        other._count = self._count
+        return other
+
+
+def _encode(data, encoding):
+    # encoding为None时直接返回二进制
+    if encoding is None:
+        return data
+    if encoding == ENCODING_HEX:
+        return data.hex()
+    # BASE64编码
+    return base64.b64encode(data).decode()
+
+def _decode(text, encoding):
+    if encoding is None:
+        return text
+    if encoding == ENCODING_HEX:
+        return bytes.fromhex(text)
+    return base64.b64decode(text)
 
 def sm3_sign(data, encoding = ENCODING_B64):
     """SM3摘要算法
@@ -27,11 +189,39 @@ def sm3_sign(data, encoding = ENCODING_B64):
         Base64或Hex编码的签名结果
     """
 
-    signature_hex = sm3.sm3_hash(func.bytes_to_list(data.encode(DEFAULT_CHARSET)))
-    if encoding == ENCODING_HEX:
-        return signature_hex
-    # BASE64编码
-    return base64.b64encode(bytes.fromhex(signature_hex)).decode()
+    return _encode(SM3(data.encode(DEFAULT_CHARSET)).digest(), encoding)
+
+def sm3_hash(data, encoding = None):
+    """SM3摘要，二进制版本
+    Args:
+        @data       : bytes/bytearray/memoryview
+        @encoding   : None返回32字节的bytes，ENCODING_B64/ENCODING_HEX返回编码后的str
+    Returns:
+        摘要
+    """
+
+    return _encode(SM3(data).digest(), encoding)
+
+def sm3_file(path, encoding = ENCODING_B64, block_size = FILE_BLOCK_SIZE):
+    """计算文件的SM3摘要，按块读取，内存占用和文件大小无关
+    Args:
+        @path       : 文件路径
+        @encoding   : 摘要结果的编码格式，ENCODING_B64：Base64；ENCODING_HEX：Hex
+        @block_size : 每次读取的字节数
+    Returns:
+        Base64或Hex编码的摘要，和同样内容的sm3_sign结果一致
+    """
+
+    h = SM3()
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return _encode(h.digest(), encoding)
 
 def sm3_verify(data, sign, encoding = ENCODING_B64):
     """SM3签名验证
@@ -43,13 +233,289 @@ def sm3_verify(data, sign, encoding = ENCODING_B64):
         True：成功，False：失败
     """
 
-    signature_hex = sm3.sm3_hash(func.bytes_to_list(data.encode(DEFAULT_CHARSET)))
-    if encoding == ENCODING_HEX:
-        return signature_hex == sign
-    # BASE64编码
-    return sign == base64.b64encode(bytes.fromhex(signature_hex)).decode()
+    return sign == sm3_sign(data, encoding)
+
+
+
+def _sm4_l(b):
+    return b ^ _rotl(b, 2) ^ _rotl(b, 10) ^ _rotl(b, 18) ^ _rotl(b, 24)
+
+# 合成置换T = L(S盒(x))，L是线性的，按字节拆成4张表，每轮4次查表
+_SM4_T = [[_sm4_l(sm4.SM4_BOXES_TABLE[i] << shift) for i in range(256)] for shift in (24, 16, 8, 0)]
 
+def _sm4_round_keys(key):
+    k = [x ^ fk for x, fk in zip(struct.unpack('>4I', key), sm4.SM4_FK)]
+    for i in range(32):
+        x = k[i + 1] ^ k[i + 2] ^ k[i + 3] ^ sm4.SM4_CK[i]
+        b = ((sm4.SM4_BOXES_TABLE[x >> 24] << 24) | (sm4.SM4_BOXES_TABLE[(x >> 16) & 0xff] << 16)
+             | (sm4.SM4_BOXES_TABLE[(x >> 8) & 0xff] << 8) | sm4.SM4_BOXES_TABLE[x & 0xff])
+        k.append(k[i] ^ b ^ _rotl(b, 13) ^ _rotl(b, 23))
+    return k[4:]
 
+def _sm4_crypt(rk, data, iv = None, decrypt = False, out = None):
+    """纯Python的SM4，data长度为16的倍数，iv为None时是ECB，否则是CBC
+
+    out为可写的缓冲区时结果直接写入out，否则返回bytes
+    """
+    t0, t1, t2, t3 = _SM4_T
+    words = struct.unpack('>{}I'.format(len(data) // 4), data)
+    result = []
+    if iv is not None:
+        p0, p1, p2, p3 = struct.unpack('>4I', iv)
+    for i in range(0, len(words), 4):
+        x0, x1, x2, x3 = c0, c1, c2, c3 = words[i:i + 4]
+        if iv is not None and not decrypt:
+            x0 ^= p0
+            x1 ^= p1
+            x2 ^= p2
+            x3 ^= p3
+        for r in rk:
+            t = x1 ^ x2 ^ x3 ^ r
+            x0, x1, x2, x3 = x1, x2, x3, x0 ^ t0[t >> 24] ^ t1[(t >> 16) & 0xff] ^ t2[(t >> 8) & 0xff] ^ t3[t & 0xff]
+        if iv is None:
+            result += (x3, x2, x1, x0)
+        elif decrypt:
+            result += (x3 ^ p0, x2 ^ p1, x1 ^ p2, x0 ^ p3)
+            p0, p1, p2, p3 = c0, c1, c2, c3
+        else:
+            result += (x3, x2, x1, x0)
+            p0, p1, p2, p3 = x3, x2, x1, x0
+    if out is not None:
+        struct.pack_into('>{}I'.format(len(result)), out, 0, *result)
+        return out
+    return struct.pack('>{}I'.format(len(result)), *result)
+
+_CTR_MASK = (1 << 128) - 1
+
+
+class Sm4Cipher(object):
+    """SM4加解密，密钥扩展只在构造时做一次，可以反复使用
+
+        cipher = Sm4Cipher(key)
+        values = cipher.encrypt_many(texts)
+
+    结果和sm4_encrypt/sm4_decrypt完全一致。安装了cryptography且OpenSSL支持SM4时使用OpenSSL，
+    否则使用查表实现的纯Python版本，比gmssl快数倍。
+    """
+
+    def __init__(self, key, mode = SM4_ECB, iv = "0000000000000000", encoding = ENCODING_B64, native = None):
+        """构造函数
+        Args:
+            @key        : 密钥，16个字符的str或16字节的bytes
+            @mode       : 加密的模式，SM4_ECB/SM4_CBC
+            @iv         : CBC模式的初始向量，str或bytes
+            @encoding   : 密文的编码格式，ENCODING_B64：Base64；ENCODING_HEX：Hex
+            @native     : 是否使用cryptography，None为有则使用
+        """
+        if mode not in (SM4_ECB, SM4_CBC):
+            raise UmsException("error mode, need SM4_ECB or SM4_CBC")
+        # 和gmssl一致，只取前16个字节
+        key_bytes = (key.encode(DEFAULT_CHARSET) if isinstance(key, str) else bytes(key))[:16]
+        iv_bytes = (iv.encode(DEFAULT_CHARSET) if isinstance(iv, str) else bytes(iv))[:16]
+        if len(key_bytes) != 16 or (mode == SM4_CBC and len(iv_bytes) != 16):
+            raise UmsException("sm4 key and iv need 16 bytes")
+
+        self.key = key
+        self.mode = mode
+        self.iv = iv
+        self.encoding = encoding
+        self.native = NATIVE_SM4 if native is None else native and NATIVE_SM4
+        self._iv = iv_bytes if mode == SM4_CBC else None
+        if self.native:
+            self._cipher = Cipher(algorithms.SM4(key_bytes),
+                                  modes.CBC(iv_bytes) if mode == SM4_CBC else modes.ECB())
+        else:
+            self._rk = _sm4_round_keys(key_bytes)
+            self._rk_dec = self._rk[::-1]
+
+    def _crypt(self, data, decrypt):
+        if self.native:
+            ctx = self._cipher.decryptor() if decrypt else self._cipher.encryptor()
+            return ctx.update(data) + ctx.finalize()
+        return _sm4_crypt(self._rk_dec if decrypt else self._rk, data, self._iv, decrypt)
+
+    def _encrypt_all(self, values):
+        """加密一批bytes，ECB模式下拼成一次调用再切开，减少每个值的调用开销
+        """
+        padded = [pkcs7_padding(v) for v in values]
+        if self.mode == SM4_CBC:
+            return [self._crypt(v, False) for v in padded]
+        data = self._crypt(b''.join(padded), False)
+        result = []
+        pos = 0
+        for v in padded:
+            result.append(data[pos:pos + len(v)])
+            pos += len(v)
+        return result
+
+    def _decrypt_all(self, values):
+        for v in values:
+            if len(v) % 16:
+                raise UmsException("sm4 cipher text length need multiple of 16")
+        if self.mode == SM4_CBC:
+            return [pkcs7_unpadding(self._crypt(v, True)) for v in values]
+        data = self._crypt(b''.join(values), True)
+        result = []
+        pos = 0
+        for v in values:
+            result.append(pkcs7_unpadding(data[pos:pos + len(v)]))
+            pos += len(v)
+        return result
+
+    def encrypt(self, text):
+        """加密，同sm4_encrypt
+        """
+        return _encode(self._encrypt_all([text.encode(DEFAULT_CHARSET)])[0], self.encoding)
+
+    def decrypt(self, text):
+        """解密，同sm4_decrypt
+        """
+        return self._decrypt_all([_decode(text, self.encoding)])[0].decode(DEFAULT_CHARSET)
+
+    def encrypt_bytes(self, data, encoding = None):
+        """加密二进制数据，按字节做PKCS7填充，和cipherutils.AESUtils.encrypt_bytes一致
+
+        整块的部分直接从data加密到输出缓冲区，只有最后一块需要拼上填充，不复制整个明文
+        Args:
+            @data       : bytes/bytearray/memoryview
+            @encoding   : None返回bytearray，ENCODING_B64/ENCODING_HEX返回编码后的str
+        Returns:
+            bytearray或编码后的str
+        """
+        view = memoryview(data).cast('B')
+        n = len(view) - len(view) % 16
+        tail = pkcs7_padding(view[n:])
+        # cryptography的update_into要求输出缓冲区比输入多留15个字节
+        out = bytearray(n + 31)
+        if self.native:
+            ctx = self._cipher.encryptor()
+            ctx.update_into(view[:n], out)
+            ctx.update_into(tail, memoryview(out)[n:])
+            ctx.finalize()
+        else:
+            _sm4_crypt(self._rk, view[:n], self._iv, out = memoryview(out)[:n])
+            # CBC的最后一块和前面的密文链接
+            iv = out[n - 16:n] if n and self._iv is not None else self._iv
+            _sm4_crypt(self._rk, tail, iv, out = memoryview(out)[n:n + 16])
+        del out[n + 16:]
+        return _encode(out, encoding)
+
+    def decrypt_bytes(self, data, encoding = None):
+        """解密二进制数据，和encrypt_bytes相反
+        Args:
+            @data       : encoding为None时是bytes/bytearray/memoryview，否则是编码后的str
+            @encoding   : data的编码格式，None/ENCODING_B64/ENCODING_HEX
+        Returns:
+            明文，bytearray
+        """
+        view = memoryview(_decode(data, encoding)).cast('B')
+        n = len(view)
+        if not n or n % 16:
+            raise UmsException("sm4 cipher text length need multiple of 16")
+        out = bytearray(n + 15)
+        if self.native:
+            ctx = self._cipher.decryptor()
+            ctx.update_into(view, out)
+            ctx.finalize()
+        else:
+            _sm4_crypt(self._rk_dec, view, self._iv, True, out = memoryview(out)[:n])
+        del out[n:]
+        # 原地截断，不复制
+        del out[len(pkcs7_unpadding(memoryview(out))):]
+        return out
+
+    def _many(self, values, decrypt, processes, chunk_size):
+        values = list(values)
+        if processes and processes > 1 and len(values) > chunk_size:
+            chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+            args = (self.key, self.mode, self.iv, self.encoding, decrypt)
+            result = []
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                for part in executor.map(_sm4_chunk, [args + (chunk,) for chunk in chunks]):
+                    result.extend(part)
+            return result
+
+        if decrypt:
+            data = self._decrypt_all([_decode(v, self.encoding) for v in values])
+            return [v.decode(DEFAULT_CHARSET) for v in data]
+        data = self._encrypt_all([v.encode(DEFAULT_CHARSET) for v in values])
+        return [_encode(v, self.encoding) for v in data]
+
+    def encrypt_many(self, texts, processes = 0, chunk_size = 10000):
+        """批量加密
+        Args:
+            @texts      : 要加密的数据，list或迭代器，元素为str
+            @processes  : 进程数，大于1时按chunk_size分片在进程池中并行处理
+            @chunk_size : 每个进程每次处理的条数
+        Returns:
+            list，和texts一一对应的密文
+        """
+        return self._many(texts, False, processes, chunk_size)
+
+    def decrypt_many(self, texts, processes = 0, chunk_size = 10000):
+        """批量解密，参数同encrypt_many
+        Returns:
+            list，和texts一一对应的明文
+        """
+        return self._many(texts, True, processes, chunk_size)
+
+
+class Sm4Stream(object):
+    """SM4流式加解密，不做填充，多次update之间保持CBC的链接状态或CTR的计数器
+
+    每次update的数据长度需要是16的倍数，CTR模式的最后一次除外。
+    文件加密使用cipherutils.encrypt_file/encrypt_stream，它们负责分块和填充。
+    """
+
+    def __init__(self, key, iv, ctr = False, decrypt = False, native = None):
+        """构造函数
+        Args:
+            @key        : 密钥，16字节的bytes
+            @iv         : CBC的初始向量或CTR的初始计数器，16字节的bytes
+            @ctr        : True为CTR模式，False为CBC模式
+            @decrypt    : 是否解密
+            @native     : 是否使用cryptography，None为有则使用
+        """
+        if len(key) != 16 or len(iv) != 16:
+            raise UmsException("sm4 key and iv need 16 bytes")
+        self.ctr = ctr
+        self.decrypt = decrypt and not ctr
+        self.native = NATIVE_SM4 if native is None else native and NATIVE_SM4
+        if self.native:
+            cipher = Cipher(algorithms.SM4(bytes(key)), modes.CTR(bytes(iv)) if ctr else modes.CBC(bytes(iv)))
+            self._ctx = cipher.decryptor() if self.decrypt else cipher.encryptor()
+            return
+        rk = _sm4_round_keys(bytes(key))
+        # CTR模式加解密都是用加密的轮密钥生成密钥流
+        self._rk = rk[::-1] if self.decrypt else rk
+        self._iv = bytes(iv)
+        self._counter = int.from_bytes(iv, 'big')
+
+    def update(self, data):
+        if self.native:
+            return self._ctx.update(data)
+        if not self.ctr:
+            out = _sm4_crypt(self._rk, data, self._iv, self.decrypt)
+            if data:
+                self._iv = bytes(data[-16:]) if self.decrypt else out[-16:]
+            return out
+
+        n = len(data)
+        blocks = (n + 15) // 16
+        counters = b''.join([((self._counter + i) & _CTR_MASK).to_bytes(16, 'big') for i in range(blocks)])
+        self._counter += blocks
+        stream = _sm4_crypt(self._rk, counters)[:n]
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(n, 'big')
+
+
+@functools.lru_cache(maxsize=32)
+def _sm4_cipher(key, mode, iv, encoding):
+    return Sm4Cipher(key, mode, iv, encoding)
+
+def _sm4_chunk(args):
+    # 在子进程中运行，同一个进程内的Sm4Cipher会被缓存复用
+    key, mode, iv, encoding, decrypt, chunk = args
+    return _sm4_cipher(key, mode, iv, encoding)._many(chunk, decrypt, 0, len(chunk))
 
 def sm4_encrypt(key, text, mode = SM4_ECB, iv = "0000000000000000", encoding = ENCODING_B64):
     """SM3摘要算法
@@ -62,21 +528,8 @@ def sm4_encrypt(key, text, mode = SM4_ECB, iv = "0000000000000000", encoding = E
         Base64或Hex编码的加密结果
     """
 
-
-    sm4_cryptor = sm4.CryptSM4()
-    sm4_cryptor.set_key(key.encode(DEFAULT_CHARSET), sm4.SM4_ENCRYPT)
-   
-    if mode == SM4_ECB:
-        encrypt_bytes = sm4_cryptor.crypt_ecb(text.encode(DEFAULT_CHARSET))
-    
-    if mode == SM4_CBC:
-        encrypt_bytes = sm4_cryptor.crypt_cbc(iv.encode(DEFAULT_CHARSET), text.encode(DEFAULT_CHARSET))
-
-    if encoding == ENCODING_HEX:
-        return encrypt_bytes.hex()
-        
-    # BASE64编码
-    return base64.b64encode(encrypt_bytes).decode()
+    # 相同的密钥复用同一个Sm4Cipher，不用每次都做密钥扩展
+    return _sm4_cipher(key, mode, iv, encoding).encrypt(text)
 
 
 
@@ -92,26 +545,35 @@ def sm4_decrypt(key, text, mode = SM4_ECB, iv = "0000000000000000", encoding = E
         Base64或Hex编码的加密结果
     """
 
+    return _sm4_cipher(key, mode, iv, encoding).decrypt(text)
+
+def sm4_encrypt_bytes(key, data, mode = SM4_ECB, iv = "0000000000000000", encoding = None):
+    """SM4加密，二进制版本
+    Args:
+        @key        : 密钥，16个字符的str或16字节的bytes
+        @data       : 要加密的数据，bytes/bytearray/memoryview
+        @mode       : 加密的模式，ECB/CBC
+        @iv         : CBC模式的初始向量
+        @encoding   : None返回bytearray，ENCODING_B64/ENCODING_HEX返回编码后的str
+    Returns:
+        bytearray或编码后的str
+    """
+
+    return _sm4_cipher(key, mode, iv, ENCODING_B64).encrypt_bytes(data, encoding)
+
+def sm4_decrypt_bytes(key, data, mode = SM4_ECB, iv = "0000000000000000", encoding = None):
+    """SM4解密，二进制版本
+    Args:
+        @key        : 密钥，16个字符的str或16字节的bytes
+        @data       : 密文，encoding为None时是bytes/bytearray/memoryview，否则是编码后的str
+        @mode       : 加密的模式，ECB/CBC
+        @iv         : CBC模式的初始向量
+        @encoding   : data的编码格式，None/ENCODING_B64/ENCODING_HEX
+    Returns:
+        明文，bytearray
+    """
 
-    sm4_cryptor = sm4.CryptSM4()
-    sm4_cryptor.set_key(key.encode(DEFAULT_CHARSET), sm4.SM4_DECRYPT)
-   
-    if mode == SM4_ECB:
-        if encoding == ENCODING_B64:
-            decrypt_bytes = sm4_cryptor.crypt_ecb(base64.b64decode(text))
-            return decrypt_bytes.decode(DEFAULT_CHARSET)
-        if encoding == ENCODING_HEX:
-            decrypt_bytes = sm4_cryptor.crypt_ecb(bytes.fromhex(text))
-            return decrypt_bytes.decode(DEFAULT_CHARSET)
-    
-    if mode == SM4_CBC:
-        iv_bytes = iv.encode(DEFAULT_CHARSET)
-        if encoding == ENCODING_B64:
-            decrypt_bytes = sm4_cryptor.crypt_cbc(iv_bytes, base64.b64decode(text))
-            return decrypt_bytes.decode(DEFAULT_CHARSET)
-        if encoding == ENCODING_HEX:
-            decrypt_bytes = sm4_cryptor.crypt_cbc(iv_bytes, bytes.fromhex(text))
-            return decrypt_bytes.decode(DEFAULT_CHARSET)
+    return _sm4_cipher(key, mode, iv, ENCODING_B64).decrypt_bytes(data, encoding)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+# 测试直接导入项目根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCursor(object):
+    """记录执行的SQL，查询结果由FakeConnection.rows决定
+    """
+
+    def __init__(self, conn, **kwargs):
+        self.conn = conn
+        self.kwargs = kwargs
+        self.rowcount = 0
+        self.lastrowid = None
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.conn.fail()
+        self.conn.log.append((sql, params))
+        self._rows = list(self.conn.rows(sql, params))
+        self.rowcount = len(self._rows)
+        columns = list(self._rows[0]) if self._rows else self.conn.columns
+        self.description = [(name, self.conn.types.get(name)) for name in columns] or None
+        if not self.kwargs.get('dictionary'):
+            self._rows = [tuple(row.values()) for row in self._rows]
+
+    def executemany(self, sql, params):
+        self.conn.fail()
+        params = list(params)
+        self.conn.log.append((sql, params))
+        self.rowcount = len(params)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.log = []
+        self.cursors = []
+        # 查询结果为空时description中的列名
+        self.columns = []
+        # 列名 -> FieldType，findColumns按类型选择数组
+        self.types = {}
+        self.unread_result = False
+        self.in_transaction = False
+        self.broken = False
+        self.closed = False
+        # 依次在接下来的执行中抛出的异常
+        self.errors = []
+        self.server_info = '8.0.36'
+
+    def rows(self, sql, params):
+        return []
+
+    def fail(self):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def cursor(self, **kwargs):
+        cursor = FakeCursor(self, **kwargs)
+        self.cursors.append(cursor)
+        return cursor
+
+    def get_server_info(self):
+        return self.server_info
+
+    def get_server_version(self):
+        return tuple(int(v) for v in self.server_info.split('-')[0].split('.'))
+
+    def ping(self, reconnect=False):
+        if self.broken:
+            raise RuntimeError('connection lost')
+
+    def close(self):
+        self.closed = True
+
+    def start_transaction(self):
+        self.log.append(('START TRANSACTION', None))
+
+    def commit(self):
+        self.log.append(('COMMIT', None))
+
+    def rollback(self):
+        self.log.append(('ROLLBACK', None))
+
+
+@pytest.fixture
+def fake_mysql(monkeypatch):
+    """用FakeConnection代替mysql.connector.connect，返回已建立的连接列表
+    """
+    import umsdb
+    conns = []
+
+    def connect(**kwargs):
+        conn = FakeConnection(**kwargs)
+        conns.append(conn)
+        return conn
+    monkeypatch.setattr(umsdb.mysql.connector, 'connect', connect)
+    return conns
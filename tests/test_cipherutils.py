@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base64
+import os
+
+import pytest
+from Crypto.Cipher import AES
+
+import cipherutils
+from cipherutils import (ALGORITHM_AES, ALGORITHM_SM4, STREAM_CBC, STREAM_CTR,
+                         decrypt_file, decrypt_stream, encrypt_file, encrypt_stream)
+
+AES_KEY = '28637AAC596048ABB6C265B608E523FEvectooor'
+SM4_KEY = '1234567890123456'
+BLOCK = 64
+SIZES = [0, 15, 16, 17, BLOCK - 1, BLOCK, BLOCK + 1, 3 * BLOCK + 5]
+IV = bytes(range(16))
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)] or [b'']
+
+@pytest.mark.parametrize('algorithm,key', [(ALGORITHM_AES, AES_KEY), (ALGORITHM_SM4, SM4_KEY)])
+@pytest.mark.parametrize('mode', [STREAM_CBC, STREAM_CTR])
+@pytest.mark.parametrize('iv', [None, IV])
+@pytest.mark.parametrize('size', SIZES)
+def test_stream_roundtrip(algorithm, key, mode, iv, size):
+    data = os.urandom(size)
+    cipher = b''.join(encrypt_stream(split(data, 7), key, mode, iv, algorithm))
+    header = 16 if iv is None else 0
+    if mode == STREAM_CTR:
+        assert len(cipher) == header + size
+    else:
+        assert len(cipher) == header + (size // 16 + 1) * 16
+
+    # 整个密文一块、以及和加密时不同的分块，都要能解密
+    assert b''.join(decrypt_stream([cipher], key, mode, iv, algorithm)) == data
+    assert b''.join(decrypt_stream(split(cipher, BLOCK), key, mode, iv, algorithm)) == data
+    assert b''.join(decrypt_stream(split(cipher, 5), key, mode, iv, algorithm)) == data
+
+@pytest.mark.parametrize('algorithm,key', [(ALGORITHM_AES, AES_KEY), (ALGORITHM_SM4, SM4_KEY)])
+@pytest.mark.parametrize('mode', [STREAM_CBC, STREAM_CTR])
+@pytest.mark.parametrize('iv', [None, IV])
+@pytest.mark.parametrize('size', SIZES)
+def test_file_roundtrip(tmp_path, algorithm, key, mode, iv, size):
+    src, enc, dec = [str(tmp_path / name) for name in ('plain', 'cipher', 'out')]
+    data = os.urandom(size)
+    with open(src, 'wb') as f:
+        f.write(data)
+    digest = encrypt_file(src, enc, key, mode, iv, algorithm, digest='sha256', block_size=BLOCK)
+    assert decrypt_file(enc, dec, key, mode, iv, algorithm, digest='sha256', block_size=BLOCK) == digest
+    with open(dec, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(dec + '.tmp')
+
+def test_decrypt_stream_default_block():
+    # 密文比一次读取的块小，iv和全部密文在同一块中
+    cipher = b''.join(encrypt_stream([b'x' * 40], 'k'))
+    assert b''.join(decrypt_stream([cipher], 'k')) == b'x' * 40
+
+def test_decrypt_stream_too_short():
+    with pytest.raises(cipherutils.UmsException):
+        list(decrypt_stream([b'short'], AES_KEY))
+
+TEXTS = ['', 'a', '0123456789abcde', '0123456789abcdef', '13800000000', 'x' * 100]
+
+def test_aes_encrypt_many():
+    aes = cipherutils.AESUtils()
+    encrypted = aes.encrypt_many(iter(TEXTS), AES_KEY)
+    assert encrypted == [aes.encrypt(t, AES_KEY) for t in TEXTS]
+    assert aes.decrypt_many(encrypted, AES_KEY) == TEXTS
+    assert aes.encrypt_many([], AES_KEY) == []
+
+def test_aes_cached_key_matches_uncached():
+    aes = cipherutils.AESUtils()
+    for key in (AES_KEY, 'another key'):
+        cipher = AES.new(cipherutils._derive_key.__wrapped__(key), AES.MODE_ECB)
+        for text in TEXTS:
+            expect = cipher.encrypt(aes._pkcs5_padding(text).encode())
+            assert aes.encrypt(text, key) == base64.b64encode(expect).decode()
+    assert cipherutils._ecb_cipher(AES_KEY) is cipherutils._ecb_cipher(AES_KEY)
+
+def test_aes_many_only_ecb():
+    aes = cipherutils.AESUtils(AES.MODE_CBC)
+    with pytest.raises(cipherutils.UmsException):
+        aes.encrypt_many(['a'], AES_KEY)
+    with pytest.raises(cipherutils.UmsException):
+        aes.decrypt_many([], AES_KEY)
+
+@pytest.mark.parametrize('size', range(0, 34))
+def test_pkcs7_padding(size):
+    data = os.urandom(size)
+    padded = cipherutils.pkcs7_padding(memoryview(data))
+    assert len(padded) % 16 == 0 and len(padded) > size
+    assert cipherutils.pkcs7_unpadding(padded) == data
+
+@pytest.mark.parametrize('data', [b'', b'abc\x00', b'abc\x11', b'a' * 14 + b'\x01\x02', b'a' * 13 + b'\x03\x02\x03'])
+def test_pkcs7_unpadding_rejects(data):
+    with pytest.raises(cipherutils.UmsException):
+        cipherutils.pkcs7_unpadding(data)
+
+def test_aes_multibyte_text():
+    # 按字符计算长度的pkcs5_padding在这里会出错
+    aes = cipherutils.AESUtils()
+    for text in ('中文', '中文和English混合', '😀' * 5, 'é' * 16):
+        cipher = aes.encrypt(text, AES_KEY)
+        assert len(base64.b64decode(cipher)) == (len(text.encode()) // 16 + 1) * 16
+        assert aes.decrypt(cipher, AES_KEY) == text
+
+@pytest.mark.parametrize('encoding', [None, cipherutils.ENCODING_B64, cipherutils.ENCODING_HEX])
+def test_aes_bytes(encoding):
+    aes = cipherutils.AESUtils()
+    for size in (0, 1, 15, 16, 17, 100):
+        data = os.urandom(size)
+        cipher = aes.encrypt_bytes(bytearray(data), AES_KEY, encoding)
+        assert aes.decrypt_bytes(cipher, AES_KEY, encoding) == data
+    assert aes.encrypt_bytes('中文'.encode(), AES_KEY, cipherutils.ENCODING_B64) == aes.encrypt('中文', AES_KEY)
+
+def test_aes_decrypt_wrong_key():
+    aes = cipherutils.AESUtils()
+    cipher = aes.encrypt_bytes(b'x' * 20, AES_KEY)
+    with pytest.raises(cipherutils.UmsException):
+        aes.decrypt_bytes(cipher[:-1], AES_KEY)
+    with pytest.raises(cipherutils.UmsException):
+        aes.decrypt_bytes(cipher, 'wrong key')
+
+def test_bytes_api_types():
+    import gmutils
+    aes = cipherutils.AESUtils()
+    for out in (aes.encrypt_bytes(b'abc', AES_KEY), gmutils.sm4_encrypt_bytes(SM4_KEY, b'abc')):
+        assert type(out) is bytearray
+    assert type(aes.decrypt_bytes(aes.encrypt_bytes(b'abc', AES_KEY), AES_KEY)) is bytearray
+    assert type(gmutils.sm4_decrypt_bytes(SM4_KEY, gmutils.sm4_encrypt_bytes(SM4_KEY, b'abc'))) is bytearray
+    # 两个模块共用同一套PKCS7填充
+    assert gmutils.pkcs7_padding is cipherutils.pkcs7_padding
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import gmutils
+from gmutils import ENCODING_B64, ENCODING_HEX, SM3, sm3_file, sm3_hash, sm3_sign, sm3_verify
+
+SM3_VECTORS = [
+    (b'abc', '66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0'),
+    (b'abcd' * 16, 'debe9ff92275b8a138604889c18e5a4d6fdb70e5387e5765293dcba39c0c5732'),
+]
+
+@pytest.fixture(params=['hashlib', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'hashlib' and not gmutils.HASHLIB_SM3:
+        pytest.skip('hashlib without sm3')
+    if request.param == 'python':
+        monkeypatch.setattr(gmutils, 'HASHLIB_SM3', False)
+    return request.param
+
+@pytest.mark.parametrize('data,expect', SM3_VECTORS)
+def test_sm3_vectors(backend, data, expect):
+    assert SM3(data).hexdigest() == expect
+    assert sm3_hash(data, ENCODING_HEX) == expect
+    assert sm3_sign(data.decode(), ENCODING_HEX) == expect
+
+def test_sm3_incremental(backend):
+    data = os.urandom(1000)
+    expect = SM3(data).digest()
+    for step in (1, 3, 63, 64, 65, 200):
+        h = SM3()
+        for i in range(0, len(data), step):
+            h.update(memoryview(data)[i:i + step])
+        assert h.digest() == expect
+
+    h = SM3(data[:500])
+    other = h.copy()
+    h.update(data[500:])
+    assert h.digest() == expect
+    assert other.digest() == SM3(data[:500]).digest()
+
+def test_sm3_backends_agree(monkeypatch):
+    data = os.urandom(300)
+    native = SM3(data).digest()
+    monkeypatch.setattr(gmutils, 'HASHLIB_SM3', False)
+    assert SM3(data).digest() == native
+
+def test_sm3_file(backend, tmp_path):
+    data = os.urandom(10000)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    assert sm3_file(str(path), ENCODING_B64, block_size=1000) == sm3_hash(data, ENCODING_B64)
+    assert sm3_file(str(path), ENCODING_HEX, block_size=333) == SM3(data).hexdigest()
+
+def test_sm3_verify():
+    sign = sm3_sign('123456789')
+    assert sm3_verify('123456789', sign)
+    assert not sm3_verify('12345678', sign)
+
+SM4_KEY = '1234567890123456'
+SM4_IV = 'abcdefghijklmnop'
+TEXTS = ['', 'a', '0123456789abcde', '0123456789abcdef', '中文和English混合', '13800000000' * 5]
+
+def gmssl_encrypt(key, text, mode, iv):
+    from gmssl import sm4
+    cryptor = sm4.CryptSM4()
+    cryptor.set_key(key.encode(), sm4.SM4_ENCRYPT)
+    if mode == gmutils.SM4_CBC:
+        return cryptor.crypt_cbc(iv.encode(), text.encode())
+    return cryptor.crypt_ecb(text.encode())
+
+def test_sm4_standard_vector():
+    key = bytes.fromhex('0123456789abcdeffedcba9876543210')
+    rk = gmutils._sm4_round_keys(key)
+    cipher = gmutils._sm4_crypt(rk, key)
+    assert cipher.hex() == '681edf34d206965e86b3e94f536e4246'
+    assert gmutils._sm4_crypt(rk[::-1], cipher, decrypt=True) == key
+
+@pytest.mark.parametrize('mode', [gmutils.SM4_ECB, gmutils.SM4_CBC])
+def test_sm4_cipher_matches_gmssl(mode):
+    cipher = gmutils.Sm4Cipher(SM4_KEY, mode, SM4_IV, ENCODING_HEX)
+    for text in TEXTS:
+        expect = gmssl_encrypt(SM4_KEY, text, mode, SM4_IV).hex()
+        assert cipher.encrypt(text) == expect
+        assert gmutils.sm4_encrypt(SM4_KEY, text, mode, SM4_IV, ENCODING_HEX) == expect
+        assert cipher.decrypt(expect) == text
+
+@pytest.mark.parametrize('mode', [gmutils.SM4_ECB, gmutils.SM4_CBC])
+def test_sm4_encrypt_many(mode):
+    cipher = gmutils.Sm4Cipher(SM4_KEY, mode, SM4_IV)
+    texts = TEXTS * 3
+    encrypted = cipher.encrypt_many(iter(texts))
+    assert encrypted == [cipher.encrypt(t) for t in texts]
+    assert cipher.decrypt_many(encrypted) == texts
+    assert cipher.encrypt_many(texts, processes=2, chunk_size=4) == encrypted
+    assert cipher.decrypt_many(encrypted, processes=2, chunk_size=4) == texts
+
+def test_sm4_cipher_errors():
+    with pytest.raises(gmutils.UmsException):
+        gmutils.Sm4Cipher('short')
+    with pytest.raises(gmutils.UmsException):
+        gmutils.Sm4Cipher(SM4_KEY, mode=2)
+    with pytest.raises(gmutils.UmsException):
+        gmutils.Sm4Cipher(SM4_KEY, encoding=ENCODING_HEX).decrypt_many(['00' * 15])
+
+@pytest.mark.parametrize('mode', [gmutils.SM4_ECB, gmutils.SM4_CBC])
+@pytest.mark.parametrize('encoding', [None, ENCODING_B64, ENCODING_HEX])
+def test_sm4_bytes(mode, encoding):
+    for size in (0, 1, 15, 16, 17, 100):
+        data = os.urandom(size)
+        cipher = gmutils.sm4_encrypt_bytes(SM4_KEY, memoryview(data), mode, SM4_IV, encoding)
+        assert gmutils.sm4_decrypt_bytes(SM4_KEY, cipher, mode, SM4_IV, encoding) == data
+    text = '中文和English混合'
+    assert (gmutils.sm4_encrypt_bytes(SM4_KEY, text.encode(), mode, SM4_IV, ENCODING_B64)
+            == gmutils.sm4_encrypt(SM4_KEY, text, mode, SM4_IV))
+
+SM4_INPUTS = [b'', b'a', b'x' * 15, b'x' * 16, b'x' * 17, bytes(range(256)) * 3 + b'tail']
+
+@pytest.fixture
+def native_sm4():
+    pytest.importorskip('cryptography')
+    if not gmutils.NATIVE_SM4:
+        pytest.skip('OpenSSL without sm4')
+
+@pytest.mark.parametrize('mode', [gmutils.SM4_ECB, gmutils.SM4_CBC])
+def test_sm4_native_matches_python(native_sm4, mode):
+    native = gmutils.Sm4Cipher(SM4_KEY, mode, SM4_IV, native=True)
+    pure = gmutils.Sm4Cipher(SM4_KEY, mode, SM4_IV, native=False)
+    assert native.native and not pure.native
+    for data in SM4_INPUTS:
+        cipher = native.encrypt_bytes(data)
+        assert cipher == pure.encrypt_bytes(data)
+        assert pure.decrypt_bytes(cipher) == native.decrypt_bytes(cipher) == data
+    assert native.encrypt_many(TEXTS) == pure.encrypt_many(TEXTS)
+
+@pytest.mark.parametrize('ctr', [False, True])
+def test_sm4_stream_native_matches_python(native_sm4, ctr):
+    key, iv = SM4_KEY.encode(), SM4_IV.encode()
+    data = os.urandom(16 * 40 + (5 if ctr else 0))
+    native = gmutils.Sm4Stream(key, iv, ctr, native=True)
+    pure = gmutils.Sm4Stream(key, iv, ctr, native=False)
+    pieces = [data[:160], data[160:480], data[480:]]
+    assert b''.join(native.update(p) for p in pieces) == b''.join(pure.update(p) for p in pieces)
+
+@pytest.mark.parametrize('mode', [gmutils.SM4_ECB, gmutils.SM4_CBC])
+def test_sm4_bytes_match_batch(mode):
+    cipher = gmutils.Sm4Cipher(SM4_KEY, mode, SM4_IV, ENCODING_HEX)
+    texts = ['x' * size for size in (0, 1, 15, 16, 17, 47, 48, 100)]
+    for text, expect in zip(texts, cipher.encrypt_many(texts)):
+        out = cipher.encrypt_bytes(text.encode())
+        # 和cipherutils.AESUtils一样返回bytearray
+        assert type(out) is bytearray and out.hex() == expect
+        plain = cipher.decrypt_bytes(out)
+        assert type(plain) is bytearray and plain == text.encode()
+
+def test_sm4_decrypt_checks_padding():
+    cipher = gmutils.Sm4Cipher(SM4_KEY)
+    data = cipher.encrypt_bytes(b'x' * 20)
+    with pytest.raises(gmutils.UmsException):
+        gmutils.Sm4Cipher('6543210987654321').decrypt_bytes(data)
+    with pytest.raises(gmutils.UmsException):
+        cipher.decrypt_bytes(b'')
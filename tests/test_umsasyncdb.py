@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+
+import umsasyncdb
+from umsasyncdb import AsyncUmsDB
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def executemany(self, sql, params):
+        if self.conn.fail:
+            raise RuntimeError('fail')
+        self.conn.log.append('insert')
+        self.rowcount = len(params)
+
+
+class FakeConn(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.log = []
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    async def begin(self):
+        self.log.append('begin')
+
+    async def commit(self):
+        self.log.append('commit')
+
+    async def rollback(self):
+        self.log.append('rollback')
+
+
+class FakePool(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        @contextlib.asynccontextmanager
+        async def acquire():
+            yield self.conn
+        return acquire()
+
+
+def run(conn, coro):
+    db = AsyncUmsDB.from_pool(FakePool(conn))
+    return asyncio.run(coro(db))
+
+def test_insert_batch_ex_one_transaction():
+    conn = FakeConn()
+    rows = [{'id': i} for i in range(5)]
+    assert run(conn, lambda db: db.insertBatchEx('t', rows, chunk_size=2)) == 5
+    assert conn.log == ['begin', 'insert', 'insert', 'insert', 'commit']
+
+def test_insert_batch_commit_each_chunk():
+    conn = FakeConn()
+    assert run(conn, lambda db: db.insertBatch('t', ['id'], [[1], [2], [3]], chunk_size=2)) == 3
+    assert conn.log == ['insert', 'commit', 'insert', 'commit']
+
+def test_insert_batch_rollback():
+    conn = FakeConn(fail=True)
+    try:
+        run(conn, lambda db: db.insertBatchEx('t', [{'id': 1}]))
+    except RuntimeError:
+        pass
+    assert conn.log == ['begin', 'rollback']
+
+def test_insert_batch_in_transaction():
+    conn = FakeConn()
+
+    async def work(db):
+        async with db.transaction() as tx:
+            await tx.insertBatchEx('t', [{'id': 1}])
+    run(conn, work)
+    assert conn.log == ['begin', 'insert', 'commit']
+
+def test_pool_autocommit(monkeypatch):
+    kwargs = {}
+
+    class FakeAiomysql(object):
+        DictCursor = None
+
+        @staticmethod
+        async def create_pool(**kw):
+            kwargs.update(kw)
+            return object()
+
+    monkeypatch.setattr(umsasyncdb, 'aiomysql', FakeAiomysql)
+    db = AsyncUmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    asyncio.run(db.connect())
+    assert kwargs['autocommit'] is True
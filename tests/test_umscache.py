@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from umscache import QueryCache
+from umsdb import UmsDB
+
+def test_put_after_invalidate_is_dropped():
+    cache = QueryCache()
+    version = cache.version('t')
+    cache.invalidate('t')
+    cache.put('t', 'SELECT 1', [{'a': 1}], version=version)
+    assert cache.get('t', 'SELECT 1') is None
+    cache.put('t', 'SELECT 1', [{'a': 1}], version=cache.version('t'))
+    assert cache.get('t', 'SELECT 1') == [{'a': 1}]
+
+def make_db(fake_mysql, cache):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', cache=cache)
+    db.connect()
+    conn = fake_mysql[-1]
+    # 每次查询返回不同的结果，命中缓存时结果不变
+    conn.rows = lambda sql, params: [{'n': len(conn.log), 'NUM': len(conn.log)}] if sql.startswith('SELECT') else []
+    return db
+
+def test_invalidate_after_commit(fake_mysql):
+    cache = QueryCache()
+    reader = make_db(fake_mysql, cache)
+    writer = make_db(fake_mysql, cache)
+    writer.startTrans()
+    writer.insertBatch('t', ['a'], [[1]], auto_commit=False)
+
+    # 提交之前其他连接读到的旧数据，提交后不能再命中
+    before = reader.findList('t')
+    assert reader.findList('t') == before
+    writer.commit()
+    assert reader.findList('t') != before
+
+def test_invalidate_after_rollback(fake_mysql):
+    cache = QueryCache()
+    db = make_db(fake_mysql, cache)
+    first = db.findList('t')
+    db.startTrans()
+    db.insertBatch('t', ['a'], [[1]], auto_commit=False)
+    # 事务中读到的是未提交的数据，不读也不写缓存
+    dirty = db.findList('t')
+    assert dirty != first
+    assert db.findList('t') != dirty
+    db.rollback()
+    assert cache.get('t', db.getSQL()) is None
+    assert db.findList('t') == db.findList('t')
+
+def test_autocommit_write_invalidates(fake_mysql):
+    cache = QueryCache()
+    db = make_db(fake_mysql, cache)
+    first = db.count('t')
+    assert db.count('t') == first
+    db.update('t', 'id=1', {'a': 2})
+    assert db.count('t') != first
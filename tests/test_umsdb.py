@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import array
+import collections
+import logging
+import time
+
+import mysql.connector
+import pytest
+from mysql.connector import errorcode
+from mysql.connector.constants import FieldType
+
+from umscache import QueryCache
+from umsdb import RetryPolicy, UmsDB, UmsDBPool, _chunked, _is_read, _load_escape, _load_unescape
+from umsexception import UmsException
+
+def prepared_cursors(conn):
+    return [c for c in conn.cursors if c.kwargs.get('prepared')]
+
+def make_pool(fake_mysql, **kwargs):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=1, **kwargs)
+    return pool
+
+def test_from_pool_options(fake_mysql):
+    cache = QueryCache()
+    pool = make_pool(fake_mysql, slow_query_ms=100, log_params_rows=2, cache=cache,
+                     prepared=True, stmt_cache_size=8)
+    with pool.connection() as db:
+        assert db.slow_query_ms == 100
+        assert db.log_params_rows == 2
+        assert db.cache is cache
+        assert db.prepared is True
+        assert db.stmt_cache_size == 8
+    pool.close()
+
+def test_prepared_statements_survive_checkout(fake_mysql):
+    pool = make_pool(fake_mysql, prepared=True)
+    for i in range(3):
+        with pool.connection() as db:
+            db.insert('t', {'a': i})
+            db.update('t', 'id=%s', {'a': i}, where_params=(i,))
+    assert len(fake_mysql) == 1
+    # 同一个连接多次借出，每条语句只预编译一次
+    assert len(prepared_cursors(fake_mysql[0])) == 2
+    pool.close()
+
+def test_update_where_params(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', prepared=True)
+    db.connect()
+    db.update('t', 'id=%s', {'a': 1, 'b': 2}, where_params=(5,))
+    sql = db.getSQL()
+    assert sql == 'UPDATE t SET `a`=%s,`b`=%s WHERE id=%s'
+    assert fake_mysql[0].log[-2] == (sql, (1, 2, 5))
+    db.update('t', 'id=%s', {'a': 3, 'b': 4}, where_params=(6,))
+    assert db.getSQL() is sql
+    assert len(db._stmtCache) == 1
+
+    # 没有where_params时where是字面量，不预编译
+    db.update('t', 'id=7', {'a': 1})
+    assert fake_mysql[0].log[-2] == ('UPDATE t SET `a`=%(a)s WHERE id=7', {'a': 1})
+    assert len(db._stmtCache) == 1
+
+def test_insert_batch_prepares_full_chunks_only(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', prepared=True)
+    db.connect()
+    db.insertBatch('t', ['a'], [[i] for i in range(7)], chunk_size=3)
+    db.insertBatch('t', ['a'], [[i] for i in range(5)], chunk_size=3)
+    assert list(db._stmtCache) == ['INSERT INTO t (`a`) VALUES (%s),(%s),(%s)']
+    # 最后不满一片的走普通的executemany
+    assert ('INSERT INTO t (`a`) VALUES (%s)', [[6]]) in fake_mysql[0].log
+
+def test_scan_binds_params_on_every_page(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    pages = [[{'id': 1}, {'id': 2}], [{'id': 3}], []]
+    conn.rows = lambda sql, params: pages.pop(0) if sql.startswith('SELECT') else []
+    rows = list(db.scan('t', where="name LIKE %s", batch=2, where_params=('a%',)))
+    assert [r['id'] for r in rows] == [1, 2, 3]
+    queries = [item for item in conn.log if item[0].startswith('SELECT')]
+    assert queries[0] == ("SELECT * FROM t WHERE (name LIKE %s) ORDER BY `id` LIMIT 2", ('a%',))
+    assert queries[1] == ("SELECT * FROM t WHERE (name LIKE %s) AND `id` > %s ORDER BY `id` LIMIT 2",
+                          ('a%', 2))
+
+def scan_table(monkeypatch, fake_mysql, size=100):
+    """所有连接共用一张id为1..size的表
+    """
+    def rows(conn, sql, params):
+        if sql.startswith('SELECT MIN'):
+            return [{'lo': 1, 'hi': size}]
+        if not sql.startswith('SELECT'):
+            return []
+        params = list(params)
+        lo = params.pop(0) if '`id` > %s' in sql else 0
+        hi = params.pop(0) if '`id` <= %s' in sql else size
+        limit = int(sql.rsplit('LIMIT', 1)[1])
+        return [{'id': i} for i in range(lo + 1, min(hi, size) + 1)][:limit]
+    monkeypatch.setattr(type(fake_mysql[0]), 'rows', rows)
+
+def test_parallel_scan_merge(fake_mysql, monkeypatch):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    scan_table(monkeypatch, fake_mysql)
+    ids = [r['id'] for r in db.parallelScan('t', batch=7, workers=4)]
+    assert sorted(ids) == list(range(1, 101))
+    # 临时创建的连接池在遍历结束后关闭
+    assert len(fake_mysql) == 5 and all(c.closed for c in fake_mysql[1:])
+
+def test_parallel_scan_callback(fake_mysql, monkeypatch):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    scan_table(monkeypatch, fake_mysql)
+    seen = collections.defaultdict(list)
+    assert db.parallelScan('t', batch=7, workers=3,
+                           callback=lambda no, rows: seen[no].extend(r['id'] for r in rows)) == 100
+    assert sorted(seen) == [0, 1, 2]
+    assert sorted(sum(seen.values(), [])) == list(range(1, 101))
+    # 每个分段内按key递增
+    assert all(ids == sorted(ids) for ids in seen.values())
+
+def test_parallel_scan_early_close(fake_mysql, monkeypatch):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    scan_table(monkeypatch, fake_mysql, size=10000)
+    it = db.parallelScan('t', batch=1, workers=4)
+    assert next(it)['id'] >= 1
+    start = time.time()
+    it.close()
+    assert time.time() - start < 5
+    assert all(c.closed for c in fake_mysql[1:])
+
+def test_parallel_scan_caps_workers_to_pool(fake_mysql, monkeypatch):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=3, wait_timeout=0.5)
+    with pool.connection() as db:
+        scan_table(monkeypatch, fake_mysql)
+        ids = [r['id'] for r in db.parallelScan('t', batch=7, workers=8)]
+        assert sorted(ids) == list(range(1, 101))
+        # 当前连接占一个，最多再借两个
+        assert len(fake_mysql) == 3
+        # 池中没有多余的连接时临时创建连接池
+        small = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=1)
+        with small.connection() as other:
+            assert other.parallelScan('t', batch=50, workers=2, callback=lambda no, rows: None) == 100
+        small.close()
+    pool.close()
+
+def test_update_batch_progress_counts_skipped_chunks(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    calls = []
+    rows = [{'id': 1}, {'id': 2}, {'id': 3, 'a': 'x'}, {'id': 4}, {'id': 5}]
+    db.updateBatch('t', 'id', rows, chunk_size=2, progress=lambda *args: calls.append(args))
+    # 第一片没有需要更新的列，也要计入
+    assert calls == [(1, 2), (2, 4), (3, 5)]
+    updates = [sql for sql, params in fake_mysql[0].log if sql.startswith('UPDATE')]
+    assert len(updates) == 1
+
+def test_upsert_batch_progress(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    calls = []
+    db.upsertBatch('t', [{'id': i, 'a': i} for i in range(5)], ['id'], chunk_size=2,
+                   progress=lambda *args: calls.append(args))
+    assert calls == [(1, 2, 2), (2, 4, 4), (3, 5, 5)]
+
+def test_pool_reuses_connections(fake_mysql):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=1, max_size=2)
+    for i in range(3):
+        with pool.connection() as db:
+            db.findList('t')
+    assert len(fake_mysql) == 1
+    pool.close()
+    assert fake_mysql[0].closed
+
+def test_pool_timeout(fake_mysql):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=1, wait_timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(UmsException):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+def test_pool_replaces_broken_connection(fake_mysql):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=1, max_size=1)
+    fake_mysql[0].broken = True
+    conn = pool.acquire()
+    assert conn is fake_mysql[1]
+    assert fake_mysql[0].closed
+
+def test_pool_release_rolls_back(fake_mysql):
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=1)
+    conn = pool.acquire()
+    conn.in_transaction = True
+    pool.release(conn)
+    assert conn.log[-1] == ('ROLLBACK', None)
+
+def test_find_iter(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    conn.rows = lambda sql, params: [{'id': i} for i in range(5)]
+    assert [r['id'] for r in db.findIter('t', size=2)] == [0, 1, 2, 3, 4]
+    assert [len(c) for c in db.findIter('t', size=2, chunked=True)] == [2, 2, 1]
+    # 流式查询使用独立的非缓冲游标
+    assert conn.cursors[-1].kwargs == {'dictionary': True, 'buffered': False}
+
+def test_chunked():
+    assert list(_chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(_chunked([], 2)) == []
+    rows = [['x' * 10]] * 5
+    # 每行估算15字节，30字节一片
+    assert [len(c) for c in _chunked(rows, 100, 30)] == [2, 2, 1]
+    # 单行超过chunk_bytes时也要单独成片
+    assert [len(c) for c in _chunked([['x' * 100]] * 2, 100, 30)] == [1, 1]
+
+def test_insert_batch_commit_every_and_progress(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    calls = []
+    total = db.insertBatch('t', ['a'], ([i] for i in range(5)), chunk_size=2, commit_every=2,
+                           progress=lambda *args: calls.append(args))
+    assert total == 5
+    assert calls == [(1, 2, 0), (2, 4, 4), (3, 5, 4), (3, 5, 5)]
+    kinds = [sql.split()[0] for sql, params in fake_mysql[0].log[1:]]
+    assert kinds == ['INSERT', 'INSERT', 'COMMIT', 'INSERT', 'COMMIT']
+
+def test_insert_batch_replays_uncommitted_chunks(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    del conn.log[:]
+    inserts = []
+    fail = conn.fail
+
+    def fail_second_insert():
+        inserts.append(1)
+        if len(inserts) == 2:
+            raise mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK)
+        fail()
+    conn.fail = fail_second_insert
+
+    assert db.insertBatch('t', ['a'], [[1], [2], [3]], chunk_size=1, commit_every=3) == 3
+    # 死锁后回滚，第一片重新执行
+    log = [(sql.split()[0], params) for sql, params in conn.log]
+    assert log == [('INSERT', [[1]]), ('ROLLBACK', None), ('INSERT', [[1]]), ('INSERT', [[2]]),
+                   ('INSERT', [[3]]), ('COMMIT', None)]
+
+def test_insert_batch_does_not_replay_callers_writes(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    del conn.log[:]
+    db.insertBatchEx('t_a', [{'a': 1}])
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    # 回滚会丢掉t_a中未提交的数据，不重试，由调用方处理
+    with pytest.raises(mysql.connector.Error):
+        db.insertBatch('t_b', ['b'], [[1], [2]], chunk_size=1)
+    assert [sql.split()[2] for sql, params in conn.log] == ['t_a']
+
+def test_update_batch_does_not_replay_callers_writes(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    del conn.log[:]
+    db.insertBatchEx('t_a', [{'a': 1}])
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    with pytest.raises(mysql.connector.Error):
+        db.updateBatch('t_b', 'id', [{'id': 1, 'b': 2}])
+    # 之前是 INSERT t_a -> ROLLBACK -> UPDATE t_b -> COMMIT，t_a的数据被悄悄丢掉
+    assert [sql.split()[0] for sql, params in conn.log] == ['INSERT']
+
+def test_update_batch_retries_own_transaction(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    del conn.log[:]
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    db.updateBatch('t', 'id', [{'id': 1, 'b': 2}])
+    assert [sql.split()[0] for sql, params in conn.log] == ['ROLLBACK', 'UPDATE', 'COMMIT']
+
+def test_load_escape_roundtrip():
+    values = ['a\tb\nc\\d\r', None, 'N', '\\N', b'\x00\x01', 3, True, '中文']
+    line = b'\t'.join([_load_escape(v) for v in values])
+    assert b'\n' not in line
+    back = [_load_unescape(v) for v in line.split(b'\t')]
+    assert back == ['a\tb\nc\\d\r', None, 'N', '\\N', '\x00\x01', '3', '1', '中文']
+
+def test_bulk_load_fallback(fake_mysql, tmp_path):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', allow_local_infile=True)
+    db.connect()
+    conn = fake_mysql[0]
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_CLIENT_LOCAL_FILES_DISABLED))
+    rows = [[1, 'a\tb'], [2, None]]
+    assert db.bulkLoad('t', rows, ['id', 'name'], tmp_dir=str(tmp_path)) == 2
+    # 不允许LOCAL INFILE时退回insertBatch，数据从临时文件还原
+    assert conn.log[-2] == ('INSERT INTO t (`id`,`name`) VALUES (%s,%s)', [['1', 'a\tb'], ['2', None]])
+    assert not list(tmp_path.iterdir())
+
+def test_update_case_sql():
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    merged = collections.OrderedDict([(1, {'id': 1, 'a': 'x'}), (2, {'id': 2, 'a': 'y', 'b': 3})])
+    sql, params = db._updateCaseSQL('t', 'id', merged)
+    assert sql == ("UPDATE t SET `a` = CASE `id` WHEN %s THEN %s WHEN %s THEN %s ELSE `a` END, "
+                   "`b` = CASE `id` WHEN %s THEN %s ELSE `b` END WHERE `id` IN (%s,%s)")
+    assert params == (1, 'x', 2, 'y', 2, 3, 1, 2)
+    assert db._updateCaseSQL('t', 'id', {1: {'id': 1}}) == (None, None)
+
+@pytest.mark.parametrize('server_info,update', [
+    ('8.0.36', 'AS `new` ON DUPLICATE KEY UPDATE `a`=`new`.`a`'),
+    ('8.0.18', 'ON DUPLICATE KEY UPDATE `a`=VALUES(`a`)'),
+    ('5.7.44-log', 'ON DUPLICATE KEY UPDATE `a`=VALUES(`a`)'),
+    ('10.11.6-MariaDB', 'ON DUPLICATE KEY UPDATE `a`=VALUES(`a`)'),
+])
+def test_upsert_batch_sql(fake_mysql, server_info, update):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    fake_mysql[0].server_info = server_info
+    db.upsertBatch('t', [{'id': 1, 'a': 2, 'b': 3}], ['id'], update_cols=['a'])
+    assert fake_mysql[0].log[-2] == (
+        'INSERT INTO t (`id`,`a`,`b`) VALUES (%s,%s,%s) ' + update, [[1, 2, 3]])
+
+def test_dump_params_truncates_batches():
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', log_params_rows=2)
+    assert db._dumpParams([[1], [2], [3]]) == '[[1], [2]] ... total 3 rows'
+    assert db._dumpParams({'a': '中'}) == '{"a": "中"}'
+
+def test_slow_query_warning(fake_mysql, caplog):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', slow_query_ms=0)
+    db.connect()
+    with caplog.at_level(logging.WARNING):
+        db.findList('t')
+    assert 'slow sql' in caplog.text
+
+def test_memo_sql():
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    sql = db._insertSQL('t', ['a', 'b'], 2)
+    assert sql == 'INSERT INTO t (`a`,`b`) VALUES (%s,%s),(%s,%s)'
+    # 同样形状的SQL只拼接一次
+    assert db._insertSQL('t', ['a', 'b'], 2) is sql
+    assert db._buildInsert('t', {'a': 1, 'b': None}, True) == (
+        'INSERT INTO t (`a`) VALUES (%(a)s)', {'a': 1})
+    assert db._buildPreparedInsert('t', {'a': 1, 'b': 2}) == (
+        'INSERT INTO t (`a`,`b`) VALUES (%s,%s)', (1, 2))
+
+def test_find_columns(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    conn.types = {'id': FieldType.LONGLONG, 'score': FieldType.DOUBLE, 'n': FieldType.LONG}
+    conn.rows = lambda sql, params: [{'id': i, 'score': i / 2, 'n': None if i == 2 else i, 'name': str(i)}
+                                     for i in range(4)]
+    result = db.findColumns('t', size=3)
+    assert isinstance(result['id'], array.array) and result['id'].typecode == 'q'
+    assert list(result['id']) == [0, 1, 2, 3]
+    assert list(result['score']) == [0.0, 0.5, 1.0, 1.5]
+    # 含有NULL的数值列退回list
+    assert result['n'] == [0, 1, None, 3]
+    assert result['name'] == ['0', '1', '2', '3']
+
+    names, rows = db.findColumns('t', fetch_format='tuples')
+    assert names == ['id', 'score', 'n', 'name']
+    assert rows[1] == (1, 0.5, 1, '1')
+
+def test_retry_policy():
+    policy = RetryPolicy(retries=3, base_delay=0.1, max_delay=0.3, jitter=0.5)
+    assert policy.retryable(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    assert policy.retryable(mysql.connector.Error(errno=errorcode.CR_SERVER_LOST))
+    assert not policy.retryable(mysql.connector.Error(errno=errorcode.ER_DUP_ENTRY))
+    assert not policy.retryable(ValueError())
+    for attempt, delay in [(1, 0.1), (2, 0.2), (3, 0.3), (10, 0.3)]:
+        assert delay * 0.5 <= policy.delay(attempt) <= delay
+
+def test_is_read():
+    assert _is_read(' (select 1)')
+    assert _is_read('SHOW TABLES')
+    assert not _is_read('INSERT INTO t VALUES (1)')
+    assert not _is_read('SELECTED')
+
+def test_execute_retries_read_after_reconnect(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    fake_mysql[0].errors.append(mysql.connector.Error(errno=errorcode.CR_SERVER_LOST))
+    fake_mysql[0].broken = True
+    db.findList('t')
+    # 连接断开后重连，在新的连接上重新执行
+    assert len(fake_mysql) == 2
+    assert fake_mysql[1].log[-1][0].startswith('SELECT')
+
+def test_execute_does_not_retry_in_transaction(fake_mysql):
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    db.startTrans()
+    fake_mysql[0].errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    with pytest.raises(mysql.connector.Error):
+        db.findList('t')
+    assert len(fake_mysql) == 1
+
+def test_batch_does_not_retry_in_transaction(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    db.startTrans()
+    del conn.log[:]
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    # 和executeSQL一样，事务中的批量写入出错直接抛出，不回滚重放
+    with pytest.raises(mysql.connector.Error):
+        db.upsertBatch('t', [{'id': 1, 'a': 2}], ['id'])
+    assert conn.log == []
+
+def test_execute_retries_single_write(fake_mysql, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test')
+    db.connect()
+    conn = fake_mysql[0]
+    conn.errors.append(mysql.connector.Error(errno=errorcode.ER_LOCK_DEADLOCK))
+    db.insert('t', {'a': 1})
+    # 单条写语句本身就是整个事务，回滚后可以重新执行
+    assert [item[0].split()[0] for item in conn.log[1:]] == ['ROLLBACK', 'INSERT', 'COMMIT']
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+
+from umsexport import export_tables
+from umsimport import _parse_block
+
+DB_CONFIG = {'host': '127.0.0.1', 'port': 3306, 'username': 'root', 'password': '', 'database': 'test'}
+
+TABLES = {
+    't_user': [{'id': 1, 'name': '张三', 'memo': 'a,"b"\nc', 'data': b'\x00\x01'},
+               {'id': 2, 'name': 'li', 'memo': None, 'data': b''}],
+    't_empty': [],
+}
+
+def serve(fake_mysql, monkeypatch):
+    import umsdb
+    connect = umsdb.mysql.connector.connect
+
+    def serve_tables(**kwargs):
+        conn = connect(**kwargs)
+        conn.columns = ['id', 'name']
+        conn.rows = lambda sql, params: [dict(r) for r in TABLES.get(sql.split()[3], [])]
+        return conn
+    monkeypatch.setattr(umsdb.mysql.connector, 'connect', serve_tables)
+
+def read(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        return f.read()
+
+def test_export_csv(fake_mysql, monkeypatch, tmp_path):
+    serve(fake_mysql, monkeypatch)
+    manifest = export_tables(DB_CONFIG, ['t_user', 't_empty'], str(tmp_path), workers=2)
+    assert not manifest['failed']
+    assert [(f['name'], f['rows']) for f in manifest['files']] == [('t_user', 2), ('t_empty', 0)]
+    with open(str(tmp_path / 'manifest.json'), encoding='utf-8') as f:
+        assert json.load(f)['rows'] == 2
+
+    # 空表也有表头
+    assert read(str(tmp_path / 't_empty.csv')) == 'id,name\n'
+
+    # 导出的文件可以被导入时的解析器还原
+    text = read(str(tmp_path / 't_user.csv'))
+    header, body = text.split('\n', 1)
+    names = header.split(',')
+    rows, rejects, error = _parse_block(body.encode('utf-8'), 'csv', names, names,
+                                        ('utf-8', ',', '"', ''))
+    assert not rejects
+    assert rows == [['1', '张三', 'a,"b"\nc', 'AAE='], ['2', 'li', None, None]]
+
+def test_export_jsonl_gzip(fake_mysql, monkeypatch, tmp_path):
+    serve(fake_mysql, monkeypatch)
+    manifest = export_tables(DB_CONFIG, ['t_user', 't_empty'], str(tmp_path), fmt='jsonl',
+                             compress='gzip')
+    assert [f['file'] for f in manifest['files']] == ['t_user.jsonl.gz', 't_empty.jsonl.gz']
+    lines = read(str(tmp_path / 't_user.jsonl.gz')).splitlines()
+    assert json.loads(lines[0]) == {'id': 1, 'name': '张三', 'memo': 'a,"b"\nc', 'data': 'AAE='}
+    assert read(str(tmp_path / 't_empty.jsonl.gz')) == ''
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
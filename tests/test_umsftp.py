@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+import umsftp
+
+@pytest.fixture
+def server(tmp_path):
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    root = tmp_path / 'remote'
+    root.mkdir()
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('test', 'test', str(root), perm='elradfmwMT')
+    handler = type('TestHandler', (FTPHandler,), {'authorizer': authorizer})
+    ftpd = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=ftpd.serve_forever, kwargs={'timeout': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield root, {'host': '127.0.0.1', 'port': ftpd.address[1], 'username': 'test', 'password': 'test'}
+    ftpd.close_all()
+    # 等服务线程退出，否则它关闭IOLoop时会影响下一个测试的服务器
+    thread.join()
+
+def test_resume_download_empty_file(server, tmp_path):
+    root, config = server
+    (root / 'empty.txt').write_bytes(b'')
+    local = str(tmp_path / 'empty.txt')
+    result = umsftp.download_many(config, [(local, '/empty.txt')], workers=1, resume=True)
+    assert result.ok
+    assert os.path.getsize(local) == 0
+
+def test_resume_upload_empty_file(server, tmp_path):
+    root, config = server
+    local = tmp_path / 'empty.txt'
+    local.write_bytes(b'')
+    result = umsftp.upload_many(config, [(str(local), '/empty.txt')], workers=1, resume=True)
+    assert result.ok
+    assert (root / 'empty.txt').exists()
+
+def test_resume_download_partial(server, tmp_path):
+    root, config = server
+    data = os.urandom(100000)
+    (root / 'data.bin').write_bytes(data)
+    local = tmp_path / 'data.bin'
+    local.write_bytes(data[:30000])
+    ftp = umsftp.ftp_connect(config)
+    umsftp.download(ftp, str(local), '/data.bin', resume=True, block_size=4096)
+    assert local.read_bytes() == data
+
+def test_local_error_keeps_connection(server, tmp_path):
+    root, config = server
+    with umsftp.FtpPool(config, max_size=1) as pool:
+        with pool.session() as session:
+            ftp = session.ftp
+        # 本地文件不存在不是连接的问题，不重试，连接也不丢弃
+        result = umsftp.upload_many(pool, [(str(tmp_path / 'missing.txt'), '/missing.txt')],
+                                    workers=1, retries=2, retry_delay=5)
+        assert isinstance(result.failed[0][2], FileNotFoundError)
+        assert result.elapsed < 5
+        with pool.session() as session:
+            assert session.ftp is ftp
+
+def test_reconnect_errors():
+    assert not issubclass(FileNotFoundError, umsftp.RECONNECT_ERRORS)
+    assert not issubclass(PermissionError, umsftp.RECONNECT_ERRORS)
+    assert issubclass(ConnectionResetError, umsftp.RECONNECT_ERRORS)
+    assert issubclass(TimeoutError, umsftp.RECONNECT_ERRORS)
+
+def test_download_many(server, tmp_path):
+    root, config = server
+    files = {'f{}.bin'.format(i): os.urandom(1000 * (i + 1)) for i in range(6)}
+    for name, data in files.items():
+        (root / name).write_bytes(data)
+    pairs = [(str(tmp_path / name), '/' + name) for name in files] + [(str(tmp_path / 'x'), '/missing')]
+    calls = []
+    result = umsftp.download_many(config, pairs, workers=3, retries=0,
+                                  progress=lambda done, total, r: calls.append((done, total)))
+    assert not result.ok
+    assert [(local, remote) for local, remote, _ in result.failed] == [pairs[-1]]
+    assert sorted(r[1] for r in result.succeeded) == sorted('/' + name for name in files)
+    assert result.bytes == sum(len(data) for data in files.values())
+    assert calls == [(i, 7) for i in range(1, 8)]
+    for name, data in files.items():
+        assert (tmp_path / name).read_bytes() == data
+
+def test_upload_many_with_pool(server, tmp_path):
+    root, config = server
+    pairs = []
+    for i in range(5):
+        local = tmp_path / 'u{}.txt'.format(i)
+        local.write_bytes(str(i).encode() * 100)
+        pairs.append((str(local), '/u{}.txt'.format(i)))
+    with umsftp.FtpPool(config, max_size=2) as pool:
+        result = umsftp.upload_many(pool, pairs, workers=2)
+    assert result.ok and len(result.succeeded) == 5 and result.bytes == 500
+    assert 'succeeded=5' in repr(result)
+    for local, remote in pairs:
+        assert (root / remote[1:]).read_bytes() == open(local, 'rb').read()
+
+def test_connect_options(server, tmp_path):
+    root, config = server
+    ftp = umsftp.ftp_connect(config)
+    assert ftp.debugging == 0 and ftp.block_size == umsftp.BLOCK_SIZE and not ftp.sock_buf
+    ftp.quit()
+
+    data = os.urandom(50000)
+    (root / 'data.bin').write_bytes(data)
+    ftp = umsftp.ftp_connect(dict(config, block_size='4096', sock_buf='65536'))
+    assert ftp.block_size == 4096 and ftp.sock_buf == 65536
+    umsftp.download(ftp, str(tmp_path / 'data.bin'), '/data.bin')
+    assert (tmp_path / 'data.bin').read_bytes() == data
+
+def test_mirror_incremental(server, tmp_path):
+    root, config = server
+    (root / 'sub' / 'deep').mkdir(parents=True)
+    (root / 'a.txt').write_bytes(b'a')
+    (root / 'sub' / 'b.txt').write_bytes(b'bb')
+    (root / 'sub' / 'deep' / 'c.txt').write_bytes(b'ccc')
+    local = tmp_path / 'local'
+
+    result = umsftp.mirror(config, '/', str(local), workers=2)
+    assert result.ok and len(result.succeeded) == 3
+    assert (local / 'sub' / 'deep' / 'c.txt').read_bytes() == b'ccc'
+
+    # 没有变化时不下载
+    assert umsftp.mirror(config, '/', str(local), workers=2).succeeded == []
+
+    (root / 'sub' / 'b.txt').write_bytes(b'changed')
+    (root / 'a.txt').unlink()
+    result = umsftp.mirror(config, '/', str(local), workers=2, delete=True)
+    assert [r[1] for r in result.succeeded] == ['/sub/b.txt']
+    assert result.deleted == ['a.txt']
+    assert (local / 'sub' / 'b.txt').read_bytes() == b'changed'
+    assert not (local / 'a.txt').exists()
+
+def test_mirror_upload_incremental(server, tmp_path):
+    root, config = server
+    local = tmp_path / 'local'
+    (local / 'x' / 'y').mkdir(parents=True)
+    (local / 'a.txt').write_bytes(b'a')
+    (local / 'x' / 'y' / 'b.txt').write_bytes(b'bb')
+    (root / 'old.txt').write_bytes(b'old')
+
+    result = umsftp.mirror_upload(config, str(local), '/', workers=2, delete=True)
+    assert result.ok and len(result.succeeded) == 2 and result.deleted == ['old.txt']
+    assert (root / 'x' / 'y' / 'b.txt').read_bytes() == b'bb'
+    assert not (root / 'old.txt').exists()
+    assert not (root / umsftp.MIRROR_UP_STATE).exists()
+
+    assert umsftp.mirror_upload(config, str(local), '/', workers=2).succeeded == []
+
+    # 远程文件被改动，大小不一致时重新上传
+    (root / 'a.txt').write_bytes(b'remote change')
+    result = umsftp.mirror_upload(config, str(local), '/', workers=2)
+    assert [r[1] for r in result.succeeded] == ['/a.txt']
+    assert (root / 'a.txt').read_bytes() == b'a'
+
+class ListingFTP(object):
+
+    def __init__(self, entries=None, lines=None):
+        self.entries = entries
+        self.lines = lines
+
+    def mlsd(self, path, facts=None):
+        if self.entries is None:
+            raise umsftp.ftplib.error_perm('502 Command not implemented.')
+        return iter(self.entries)
+
+    def retrlines(self, cmd, callback):
+        for line in self.lines:
+            callback(line)
+
+def test_list_dir_rejects_unsafe_names():
+    entries = [('.', {'type': 'cdir'}), ('..', {'type': 'pdir'}), ('ok.txt', {'type': 'file', 'size': '1'}),
+               ('../evil', {'type': 'file', 'size': '1'}), ('a\\..\\b', {'type': 'file', 'size': '1'}),
+               ('..', {'type': 'dir'}), ('sub', {'type': 'dir'})]
+    assert umsftp._list_dir(ListingFTP(entries), '/') == [('ok.txt', False, 1, None), ('sub', True, None, None)]
+
+    lines = ['-rw-r--r--   1 o g   5 Jan 01 12:00 ok.txt', '-rw-r--r--   1 o g   5 Jan 01 12:00 ../../evil',
+             'drwxr-xr-x   2 o g   0 Jan 01 12:00 ..', 'drwxr-xr-x   2 o g   0 Jan 01 12:00 x/y']
+    assert umsftp._list_dir(ListingFTP(lines=lines), '/') == [('ok.txt', False, 5, 'Jan 01 12:00')]
+
+def test_local_path_stays_under_dir(tmp_path):
+    local = tmp_path / 'local'
+    local.mkdir()
+    assert umsftp._local_path(str(local), 'a/b.txt') == os.path.join(str(local), 'a', 'b.txt')
+    with pytest.raises(umsftp.UmsException):
+        umsftp._local_path(str(local), '../evil.txt')
+
+def test_mirror_does_not_follow_symlink_out(server, tmp_path):
+    root, config = server
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'evil.txt').write_bytes(b'evil')
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    local = tmp_path / 'local'
+    local.mkdir()
+    os.symlink(str(outside), str(local / 'sub'))
+    with pytest.raises(umsftp.UmsException):
+        umsftp.mirror(config, '/', str(local), workers=1)
+    assert list(outside.iterdir()) == []
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import time
+
+from umsdb import UmsDBPool
+from umsimport import _blocks, _parse_block, _read_header, load_file
+
+DB_CONFIG = {'host': '127.0.0.1', 'port': 3306, 'username': 'root', 'password': '', 'database': 'test'}
+OPTIONS = ('utf-8', ',', '"', '')
+
+def test_blocks_cut_at_record_boundaries():
+    data = b'1,"a\nb"\n2,c\n3,"d\n\ne"\n4,f'
+    for size in range(1, len(data) + 1):
+        blocks = list(_blocks(io.BytesIO(data), size, b'"'))
+        assert b''.join(blocks) == data
+        # 每块都以完整的记录结束，引号内的换行不会被截断
+        for block in blocks[:-1]:
+            assert block.endswith(b'\n') and block.count(b'"') % 2 == 0
+
+def test_parse_block_csv():
+    block = '1,张三,\n2,"x,y"\nbad\n3,"unterminated\n'.encode('utf-8')
+    rows, rejects, error = _parse_block(block, 'csv', ['id', 'name', 'memo'], ['id', 'name', 'memo'],
+                                        OPTIONS)
+    assert rows == [['1', '张三', None]]
+    assert rejects == ['2,"x,y"\n', 'bad\n', '3,"unterminated\n']
+    assert 'expect 3 fields' in error
+
+def test_parse_block_mapping_and_decode_error():
+    block = b'1,a\n2,\xff\n'
+    mapping = [1, lambda r: int(r[0]) * 10]
+    rows, rejects, error = _parse_block(block, 'csv', None, mapping, OPTIONS)
+    assert rows == [['a', 10]]
+    assert len(rejects) == 1 and error == 'decode error'
+
+def test_parse_block_jsonl():
+    block = b'{"id": 1, "name": "a"}\n\nnot json\n{"id": 2}\n'
+    rows, rejects, error = _parse_block(block, 'jsonl', None, ['id', 'name'], OPTIONS)
+    assert rows == [[1, 'a']]
+    assert rejects == ['not json\n', '{"id": 2}\n']
+
+def test_read_header():
+    f = io.BytesIO('\ufeffid, name\n1,a\n'.encode('utf-8'))
+    assert _read_header(f, 'utf-8', ',', '"') == (['id', 'name'], 12)
+    assert f.read() == b'1,a\n'
+
+def test_load_file(fake_mysql, tmp_path):
+    path = tmp_path / 'in.csv'
+    lines = ['id,name'] + ['{},"n\n{}"'.format(i, i) for i in range(50)] + ['bad']
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    stats = load_file(str(path), 't', db_config=DB_CONFIG, workers=2, writers=2, block_size=64,
+                      chunk_size=7)
+    assert stats['rows'] == 50 and stats['rejected'] == 1
+    assert stats['bytes'] == path.stat().st_size
+    assert (tmp_path / 'in.csv.reject').read_text(encoding='utf-8') == 'bad\n'
+
+    inserted = []
+    for conn in fake_mysql:
+        for sql, params in conn.log:
+            if sql.startswith('INSERT'):
+                assert sql == 'INSERT INTO t (`id`,`name`) VALUES (%s,%s)'
+                inserted.extend(params)
+    assert sorted(inserted, key=lambda r: int(r[0])) == [[str(i), 'n\n{}'.format(i)] for i in range(50)]
+
+def test_load_file_clamps_writers_to_pool(fake_mysql, tmp_path, monkeypatch):
+    path = tmp_path / 'in.csv'
+    path.write_text('id\n' + ''.join('{}\n'.format(i) for i in range(20)), encoding='utf-8')
+    pool = UmsDBPool('127.0.0.1', 3306, 'root', '', 'test', min_size=0, max_size=1, wait_timeout=0.2)
+    with pool.connection() as db:
+        # 写入比等待连接的超时慢，多出的写入线程拿不到连接
+        monkeypatch.setattr(type(db.conn), 'fail', lambda conn: time.sleep(0.05))
+    try:
+        stats = load_file(str(path), 't', db_config=pool, writers=4, block_size=16, chunk_size=1)
+    finally:
+        pool.close()
+    assert stats['rows'] == 20
+    assert len(fake_mysql) == 1
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from umsdb import UmsDB
+from umsmetrics import Histogram, UmsMetrics, sql_shape
+
+def test_sql_shape():
+    assert sql_shape("SELECT * FROM t WHERE id = 1 AND name = 'a\\'b'") == \
+        'SELECT * FROM t WHERE id = ? AND name = ?'
+    assert sql_shape('INSERT INTO t (`a`,`b`) VALUES (%s,%s),(%s,%s)') == 'INSERT INTO t (`a`,`b`) VALUES (?,?)'
+    assert sql_shape('SELECT * FROM t2 WHERE id IN (1, 2,3)') == 'SELECT * FROM t2 WHERE id IN (?)'
+    assert sql_shape('UPDATE t SET `a`=%(a)s WHERE  id=%s') == 'UPDATE t SET `a`=? WHERE id=?'
+
+def test_histogram():
+    h = Histogram(buckets=[1, 10, 100])
+    for v in [0.5, 5, 5, 50, 500]:
+        h.observe(v)
+    assert h.percentile(50) == 10
+    assert h.percentile(100) == 500
+    snap = h.snapshot()
+    assert snap['count'] == 5 and snap['max'] == 500
+
+def test_metrics_and_hooks(fake_mysql):
+    calls = []
+
+    class Hook(object):
+        def before_execute(self, sql, params):
+            calls.append('before')
+
+        def after_execute(self, sql, params, elapsed, rowcount, error):
+            calls.append(('after', rowcount, error))
+
+    metrics = UmsMetrics()
+    metrics.add_hook(Hook())
+    db = UmsDB('127.0.0.1', 3306, 'root', '', 'test', metrics=metrics)
+    db.connect()
+    fake_mysql[0].rows = lambda sql, params: [{'id': 1}, {'id': 2}]
+    db.findList('t', where='id > 1')
+    db.findList('t', where='id > 2')
+    stats = db.stats()
+    assert [(q['sql'], q['count'], q['rows']) for q in stats['queries']] == [
+        ('SELECT * FROM t WHERE id > ?', 2, 4)]
+    assert calls == ['before', ('after', 2, None)] * 2
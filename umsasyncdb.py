@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+基于aiomysql的异步版本UmsDB，接口和UmsDB保持一致，所有方法都需要await
+
+需要 pip install aiomysql
+
+    db = AsyncUmsDB(host, port, username, password, database, max_size=10)
+    await db.connect()
+    rows = await db.findList('t_test', where='id > 1')
+
+    async with db.transaction() as tx:
+        await tx.insert('t_test', {'title': 'title'})
+        await tx.update('t_test', 'id=1', {'title': 'title'})
+
+    await db.close()
+
+没有开启事务时，每个调用从连接池借出一个连接，执行完立即归还，
+因此成百上千个并发的查询可以共用少量的连接。
+"""
+
+import contextlib
+import copy
+import json
+import logging
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from umsdb import SET_CHARSET_SQL, UmsSQLBuilder, _chunked
+from umslogger import logger
+from umsexception import UmsException
+
+class AsyncUmsDB(UmsSQLBuilder):
+
+    def __init__(self, host, port, username, password, database,
+                charset='utf8', table_prefix='', min_size=1, max_size=10, idle_timeout=300):
+        '''构造函数
+
+        Args:
+            @param host              : 数据库的地址，IP
+            @param port              : 端口
+            @param username          : 用户
+            @param password          : 密码
+            @param database          : 数据名
+            @param charset           : 字符编码
+            @param table_prefix      : 数表的前缀
+            @param min_size          : 连接池最少保持的连接数
+            @param max_size          : 连接池最多允许的连接数
+            @param idle_timeout      : 连接回收时间，单位秒
+
+        Returns: void
+        '''
+        self.host = host
+        self.username = username
+        self.password = password
+        self.database = database
+        self.port = int(port)
+        self.charset = charset
+        self.table_prefix = table_prefix
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        self.idle_timeout = int(idle_timeout)
+        self.sql = ''
+        self.pool = None
+        # 事务中绑定的连接，为None时每次调用从连接池借用
+        self._conn = None
+        self.cursor_class = aiomysql.DictCursor if aiomysql is not None else None
+
+    @classmethod
+    def from_pool(cls, pool, charset='utf8', table_prefix=''):
+        """使用已经创建好的连接池，连接池需要兼容aiomysql.Pool的acquire接口
+        """
+        db = cls(None, 0, None, None, None, charset=charset, table_prefix=table_prefix)
+        db.pool = pool
+        return db
+
+    async def connect(self):
+        if self.pool is None:
+            if aiomysql is None:
+                raise UmsException("AsyncUmsDB need aiomysql, pip install aiomysql")
+            try:
+                self.pool = await aiomysql.create_pool(
+                    host=self.host,
+                    port=self.port,
+                    user=self.username,
+                    password=self.password,
+                    db=self.database,
+                    minsize=self.min_size,
+                    maxsize=self.max_size,
+                    pool_recycle=self.idle_timeout,
+                    # 和UmsDB每次调用后提交一致；否则查询之后连接停留在事务中，
+                    # 归还时会被连接池关闭，后续的查询也只能看到旧的快照
+                    autocommit=True,
+                    init_command=SET_CHARSET_SQL.format(self.charset) if self.charset else None)
+            except Exception:
+                logger.exception("connection error")
+                raise UmsException("connection error")
+        return self.pool
+
+    async def close(self):
+        """关闭连接池
+        """
+        if self.pool is None:
+            return
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.pool = None
+        logger.info("connection pool closed")
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    @contextlib.asynccontextmanager
+    async def _cursor(self):
+        """借出连接和字典游标，事务中使用事务绑定的连接
+        """
+        if self._conn is not None:
+            async with self._conn.cursor(self.cursor_class) as cursor:
+                yield self._conn, cursor
+            return
+
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(self.cursor_class) as cursor:
+                yield conn, cursor
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """开启事务，返回绑定了同一个连接的AsyncUmsDB，正常退出提交，异常回滚
+
+        async with db.transaction() as tx:
+            await tx.insert(...)
+        """
+        if self._conn is not None:
+            raise UmsException("transaction already started")
+
+        async with self.pool.acquire() as conn:
+            await conn.begin()
+            tx = copy.copy(self)
+            tx._conn = conn
+            try:
+                yield tx
+            except BaseException:
+                await conn.rollback()
+                logger.info("trasaction rollback")
+                raise
+            else:
+                await conn.commit()
+                logger.info("trasaction commited")
+
+    async def _commit(self, conn):
+        # 事务中由transaction统一提交
+        if self._conn is None:
+            await conn.commit()
+
+    async def _executeSQL(self, cursor, sql, params=None):
+        self.sql = sql
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('execute sql=[{}]'.format(sql))
+            if params:
+                logger.debug('params=[{}]'.format(json.dumps(params, ensure_ascii=False, default=str)))
+
+        if params:
+            t = type(params)
+            if t == dict or t == tuple:
+                return await cursor.execute(sql, params)
+            elif t == list:
+                return await cursor.executemany(sql, params)
+            else:
+                raise UmsException("illegal parameter type")
+
+        return await cursor.execute(sql)
+
+    async def findOneEx(self, table='', where=None, field=None, order=None, sql=None):
+        '''查找一条记录，返回的是一个对象，没有数据时返回None
+        '''
+        result = await self.findOne(table, where, field, order, sql)
+        if len(result) <= 0:
+            logger.warning('result is empty')
+            return None
+        return result[0]
+
+    async def findOne(self, table='', where=None, field=None, order=None, sql=None):
+        '''查找一条记录，这里返回的仍然是一个数组
+        '''
+        return await self._find(table, where, field, order, 1, sql)
+
+    async def findList(self, table='', where=None, field=None, order=None, limit=None, sql=None):
+        '''查找多条记录
+        '''
+        return await self._find(table, where, field, order, limit, sql)
+
+    async def _find(self, table='', where=None, field=None, order=None, limit=1, sql=None):
+        sql = self._buildSelect(table, where, field, order, limit, sql)
+        async with self._cursor() as (conn, cursor):
+            await self._executeSQL(cursor, sql)
+            return list(await cursor.fetchall())
+
+    async def insertSelective(self, table, params):
+        return await self.insert(table, params, True)
+
+    async def insert(self, table, params, selective=False):
+        '''插入
+
+        Returns: 本次插入的自增Id值
+        '''
+        sql, params = self._buildInsert(table, params, selective)
+        async with self._cursor() as (conn, cursor):
+            await self._executeSQL(cursor, sql, params)
+            await self._commit(conn)
+            return cursor.lastrowid
+
+    async def insertBatchEx(self, table, data, auto_commit=False, chunk_size=1000):
+        '''批量插入，data为list[dict]，列名以第一条数据为准，auto_commit同insertBatch，默认和UmsDB一样为False
+
+        Returns: 影响的行数
+        '''
+        cols, rows = self._dictRows(data)
+        if not cols:
+            return 0
+        return await self.insertBatch(table, cols, rows, auto_commit, chunk_size)
+
+    async def insertBatch(self, table, cols, vals, auto_commit=True, chunk_size=1000):
+        '''批量插入，按chunk_size条分片，auto_commit为True时每片提交一次；
+        为False时不在事务中则整批作为一个事务，全部写入后提交，出错回滚
+
+        Returns: 影响的行数
+        '''
+        if type(cols) != list:
+            raise UmsException("error cols,need list[list]")
+
+        sql = self._insertSQL(table, cols)
+        total = 0
+        async with self._cursor() as (conn, cursor):
+            # 连接池的连接是autocommit的，不在事务中时需要显式开启事务
+            own_tx = not auto_commit and self._conn is None
+            if own_tx:
+                await conn.begin()
+            try:
+                for chunk in _chunked(vals, chunk_size):
+                    await self._executeSQL(cursor, sql, chunk)
+                    total += cursor.rowcount
+                    if auto_commit:
+                        await self._commit(conn)
+            except BaseException:
+                if own_tx:
+                    await conn.rollback()
+                raise
+            if own_tx:
+                await conn.commit()
+        return total
+
+    async def updateSelective(self, table, where, params):
+        return await self.update(table, where, params, True)
+
+    async def update(self, table, where, params, selective=False):
+        '''条件更新表
+
+        Returns: 影响的行数
+        '''
+        sql, params = self._buildUpdate(table, where, params, selective)
+        async with self._cursor() as (conn, cursor):
+            await self._executeSQL(cursor, sql, params)
+            await self._commit(conn)
+            return cursor.rowcount
+
+    async def delete(self, table, where):
+        '''删除，where为空则删除全部
+
+        Returns: 删除了多少条记录
+        '''
+        sql = self._buildDelete(table, where)
+        async with self._cursor() as (conn, cursor):
+            await self._executeSQL(cursor, sql)
+            await self._commit(conn)
+            return cursor.rowcount
+
+    async def count(self, table='', where=None, sql=None):
+        '''根据条件或指定的SQL统计数据的条数
+        '''
+        sql = self._buildCount(table, where, sql)
+        async with self._cursor() as (conn, cursor):
+            await self._executeSQL(cursor, sql)
+            rs = await cursor.fetchone()
+        return rs['NUM'] if rs is not None else 0
+
+    def getSQL(self):
+        """获取最近一次执行的SQL，并发调用时仅供参考
+        """
+        return self.sql
+
+
+if __name__ == '__main__':
+
+    import asyncio
+    from umsconfig import globalConfig
+
+    async def main():
+        db = AsyncUmsDB(globalConfig.get('DATABASE', 'db.host'),
+                        globalConfig.get('DATABASE', 'db.port'),
+                        globalConfig.get('DATABASE', 'db.username'),
+                        globalConfig.getRaw('DATABASE', 'db.password'),
+                        globalConfig.get('DATABASE', 'db.database'))
+        async with db:
+            counts = await asyncio.gather(*[db.count('t_test', 'id > {}'.format(i)) for i in range(100)])
+            logger.info(counts)
+
+            async with db.transaction() as tx:
+                result = await tx.insertSelective('t_test', {'title': 'title', 'message': 'message'})
+                logger.info(result)
+
+    asyncio.run(main())
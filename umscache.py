@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+查询结果缓存，LRU淘汰 + 按表设置过期时间
+
+    cache = QueryCache(maxsize=1024, ttl=60, table_ttl={'t_dict': 600})
+    db = UmsDB(host, port, username, password, database, cache=cache)
+
+同一个UmsDB对某张表执行insert/update/delete等写操作，提交或回滚后该表的缓存全部失效；
+其他进程或其他连接对表的修改感知不到，只能等过期，所以只适合变化很少的参数表、字典表。
+缓存返回的记录和缓存中的是同一个对象，不要修改。
+"""
+
+import collections
+import threading
+import time
+
+class QueryCache(object):
+
+    def __init__(self, maxsize=1024, ttl=60, table_ttl=None):
+        """构造函数
+
+        Args:
+            @param maxsize   : 最多缓存多少条查询结果，超过后淘汰最久未使用的
+            @param ttl       : 默认的过期时间，单位秒
+            @param table_ttl : 按表设置过期时间，dict，例：{'t_dict': 600}，过期时间<=0的表不缓存
+
+        Returns: void
+        """
+        self.maxsize = int(maxsize)
+        self.ttl = ttl
+        self.table_ttl = dict(table_ttl or {})
+        self.hits = 0
+        self.misses = 0
+        # key -> (table, 过期时间, 结果)，按使用顺序排列，最右边是最近使用的
+        self._data = collections.OrderedDict()
+        # table -> 该表的所有key，用于按表失效
+        self._tables = collections.defaultdict(set)
+        # 每次失效时版本号加一，查询开始前取版本号，写入缓存时版本号变了说明期间表被修改过，结果不缓存
+        self._versions = collections.defaultdict(int)
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _key(self, sql, params):
+        if params is None:
+            return sql
+        if isinstance(params, dict):
+            return (sql, tuple(sorted(params.items())))
+        return (sql, tuple(params))
+
+    def get(self, table, sql, params=None):
+        """查询缓存
+
+        Returns: 缓存的结果，未命中或已过期返回None
+        """
+        key = self._key(sql, params)
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[1] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def version(self, table):
+        """表的当前版本号，查询数据库之前获取，写入缓存时传给put
+        """
+        with self._lock:
+            return (self._epoch, self._versions[table])
+
+    def put(self, table, sql, value, params=None, version=None):
+        """写入缓存，version和表的当前版本号不一致时不写入
+        """
+        ttl = self.table_ttl.get(table, self.ttl)
+        if not ttl or ttl <= 0 or self.maxsize <= 0:
+            return
+
+        key = self._key(sql, params)
+        with self._lock:
+            if version is not None and version != (self._epoch, self._versions[table]):
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (table, time.time() + ttl, value)
+            self._tables[table].add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, table=None):
+        """使某张表的缓存失效，table为None时清空全部
+        """
+        with self._lock:
+            if table is None:
+                self._data.clear()
+                self._tables.clear()
+                self._epoch += 1
+                return
+            self._versions[table] += 1
+            for key in self._tables.pop(table, ()):
+                self._data.pop(key, None)
+
+    def _remove(self, key):
+        table = self._data.pop(key)[0]
+        keys = self._tables.get(table)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tables[table]
+
+    def stats(self):
+        """命中统计
+
+        Returns: dict
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
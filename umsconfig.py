@@ -38,11 +38,12 @@ class UmsConfig(object):
         self._configRaw = configparser.RawConfigParser()
         self._configRaw.read(self._path, encoding='utf-8-sig')
 
-    def get(self, section, name):
-        return self._config.get(section, name)
+    def get(self, section, name, **kwargs):
+        # kwargs透传给configparser，例如fallback=默认值
+        return self._config.get(section, name, **kwargs)
 
-    def getRaw(self, section, name):
-        return self._configRaw.get(section, name)
+    def getRaw(self, section, name, **kwargs):
+        return self._configRaw.get(section, name, **kwargs)
 
 
 globalConfig = UmsConfig()
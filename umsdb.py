@@ -7,20 +7,413 @@
 基于mysql.connector进行简单封装
 """
 
+import array
+import collections
+import concurrent.futures
+import contextlib
 import json
+import logging
 import mysql.connector
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
 import traceback
 
+from mysql.connector import errorcode
+from mysql.connector.constants import FieldType
+
 from umslogger import logger
 from umsexception import UmsException
 
-class UmsDB(object):
+# 字符串一行太长写不下
+# 通过括号进行连接，每行字符串都由引号引起来
+SET_CHARSET_SQL = ("SET "
+                   "character_set_connection='{0}', "
+                   "character_set_results='{0}', "
+                   "character_set_client=binary")
+
+# 连接空闲超时被服务端断开（MySQL 8.0.24+），较旧的mysql.connector的errorcode中没有这个常量
+ER_CLIENT_INTERACTION_TIMEOUT = getattr(errorcode, 'ER_CLIENT_INTERACTION_TIMEOUT', 4031)
+
+# 连接断开类的错误
+CONNECTION_ERRNOS = (
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    ER_CLIENT_INTERACTION_TIMEOUT,
+)
+
+# 可以重试的错误：死锁、锁等待超时以及连接断开
+RETRYABLE_ERRNOS = (
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+) + CONNECTION_ERRNOS
+
+# 只读语句，重放不会有副作用
+_READ_SQL_RE = re.compile(r'\s*\(?\s*(SELECT|SHOW|SET|DESC|DESCRIBE|EXPLAIN)\b', re.I)
+
+def _is_read(sql):
+    return _READ_SQL_RE.match(sql) is not None
+
+
+class RetryPolicy(object):
+    """出错重试策略：指数退避 + 随机抖动
+
+    UmsDB只会在安全的时候重试：没有未提交的写操作（单条语句本身就是整个事务），
+    批量接口则回滚后重放整个未提交的事务。
+    """
+
+    def __init__(self, retries=3, base_delay=0.1, max_delay=5, jitter=0.5, errnos=None):
+        """构造函数
+
+        Args:
+            @param retries    : 最多重试次数，0表示不重试
+            @param base_delay : 第一次重试前等待的时间，单位秒，之后每次翻倍
+            @param max_delay  : 最长等待时间，单位秒
+            @param jitter     : 抖动比例，实际等待时间在 [delay*(1-jitter), delay] 之间随机
+            @param errnos     : 可以重试的错误码，默认为RETRYABLE_ERRNOS
+
+        Returns: void
+        """
+        self.retries = int(retries)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.jitter = float(jitter)
+        self.errnos = tuple(errnos) if errnos is not None else RETRYABLE_ERRNOS
+
+    def retryable(self, err):
+        return getattr(err, 'errno', None) in self.errnos
+
+    def delay(self, attempt):
+        """第attempt次重试前需要等待的时间，attempt从1开始
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+def _estimate_size(row):
+    """估算一行数据在SQL中占用的字节数，只用于分片，不需要精确
+    """
+    size = 2
+    for v in row:
+        if isinstance(v, (str, bytes, bytearray)):
+            size += len(v) + 3
+        else:
+            size += 12
+    return size
+
+def _chunked(rows, chunk_size, chunk_bytes=0):
+    """把rows按条数和估算的字节数切分成多个list
+    """
+    chunk = []
+    size = 0
+    for row in rows:
+        if chunk_bytes:
+            row_size = _estimate_size(row)
+            if chunk and size + row_size > chunk_bytes:
+                yield chunk
+                chunk = []
+                size = 0
+            size += row_size
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+# findColumns中数值类型的列对应的array类型
+_ARRAY_TYPECODES = {
+    FieldType.TINY: 'q',
+    FieldType.SHORT: 'q',
+    FieldType.INT24: 'q',
+    FieldType.LONG: 'q',
+    FieldType.LONGLONG: 'q',
+    FieldType.YEAR: 'q',
+    FieldType.FLOAT: 'd',
+    FieldType.DOUBLE: 'd',
+}
+
+# 服务端或客户端不允许LOAD DATA LOCAL INFILE
+LOCAL_INFILE_ERRNOS = (
+    errorcode.ER_NOT_ALLOWED_COMMAND,
+    errorcode.ER_CLIENT_LOCAL_FILES_DISABLED,
+    errorcode.CR_LOAD_DATA_LOCAL_INFILE_REJECTED,
+)
+
+# LOAD DATA默认格式下需要转义的字符
+_LOAD_ESCAPE_RE = re.compile(b'[\\\\\t\n\r\x00]')
+_LOAD_ESCAPE = {b'\\': b'\\\\', b'\t': b'\\t', b'\n': b'\\n', b'\r': b'\\r', b'\x00': b'\\0'}
+_LOAD_UNESCAPE_RE = re.compile(b'\\\\(.)', re.S)
+_LOAD_UNESCAPE = {b'\\': b'\\', b't': b'\t', b'n': b'\n', b'r': b'\r', b'0': b'\x00',
+                  b'b': b'\b', b'Z': b'\x1a'}
+
+def _load_escape(value):
+    """把一个值转为LOAD DATA默认格式（制表符分隔、反斜杠转义）的字节串
+    """
+    if value is None:
+        return b'\\N'
+    if isinstance(value, bool):
+        return b'1' if value else b'0'
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value)
+    else:
+        value = str(value).encode('utf-8')
+    if _LOAD_ESCAPE_RE.search(value):
+        value = _LOAD_ESCAPE_RE.sub(lambda m: _LOAD_ESCAPE[m.group(0)], value)
+    return value
+
+def _load_unescape(value):
+    if value == b'\\N':
+        return None
+    if b'\\' in value:
+        value = _LOAD_UNESCAPE_RE.sub(lambda m: _LOAD_UNESCAPE.get(m.group(1), m.group(1)), value)
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value
+
+def _read_load_file(path, ignore_lines=0):
+    """逐行读取LOAD DATA默认格式的文件，bulkLoad退回insertBatch时使用
+    """
+    with open(path, 'rb', buffering=1048576) as fp:
+        for i, line in enumerate(fp):
+            if i < ignore_lines:
+                continue
+            line = line.rstrip(b'\n')
+            yield [_load_unescape(v) for v in line.split(b'\t')]
+
+def _open_connection(host, port, username, password, database, charset=None, **kwargs):
+    """建立一个数据库连接，并设置连接的字符编码
+
+    UmsDB和UmsDBPool共用，保证两种方式建立的连接会话状态一致
+    """
+    conn = mysql.connector.connect(
+        host=host,
+        user=username,
+        password=password,
+        database=database,
+        port=int(port),
+        **kwargs)
+
+    if charset is not None:
+        cursor = conn.cursor()
+        cursor.execute(SET_CHARSET_SQL.format(charset))
+        cursor.close()
+    return conn
+
+
+class UmsSQLBuilder(object):
+    """SQL拼接，和数据库连接无关，UmsDB和AsyncUmsDB共用
+    """
+
+    # 拼接好的SQL，key为(操作, 表名, 列名...)
+    _sqlMemo = None
+
+    def _memoSQL(self, key, build):
+        """同样形状的SQL只拼接一次，返回的是同一个字符串对象
+        """
+        memo = self._sqlMemo
+        if memo is None:
+            memo = self._sqlMemo = {}
+        sql = memo.get(key)
+        if sql is None:
+            if len(memo) >= 1024:
+                memo.clear()
+            sql = memo[key] = build()
+        return sql
+
+    def table(self, table):
+        """可以增加前缀等操作
+        """
+        return table
+
+    def _buildSelect(self, table='', where=None, field=None, order=None, limit=None, sql=None):
+        """根据条件拼接查询SQL，sql不为空时直接返回sql
+        """
+        if sql:
+            return sql
+
+        # 等价于其他语言的三目运算符
+        # where = where == null ? '1=1' : where
+        where = where if where else '1=1'
+        field = field if field else '*'
+        order = order if order else ''
+        limit = ('limit %s' % str(limit)) if limit else ''
+
+        if type(field) == list:
+            field = '`%s`' % ("`,`".join(field))
+        sql = "SELECT %s FROM %s WHERE %s %s %s" % (field, self.table(table), where, order, limit)
+        return sql
+
+    def _buildCount(self, table='', where=None, sql=None):
+        if not sql:
+            where = where if where else '1=1'
+            sql = "SELECT COUNT(*) AS NUM FROM %s WHERE %s" % (self.table(table), where)
+        return sql
+
+    def _fields(self, params, selective=False):
+        """取出要写入的列名，selective为True时去除值为空的字段
+
+        Returns: (params, field)
+        """
+        field = []
+
+        t = type(params)
+        if t == dict:
+            if selective: 
+                params = dict((k,v) for k,v in params.items() if v)
+            field = list(params.keys())
+        elif t == list:
+            field = params[0]
+            if not isinstance(field, dict):
+                raise UmsException("error params,need list[dict]")
+            field = list(field.keys())
+        else:
+            raise UmsException("error params,need dict")
+
+        if not field or not isinstance(field, list):
+            raise UmsException("error params,need dict")
+        return params, field
+
+    def _buildInsert(self, table, params, selective=False):
+        """拼接单条插入的SQL，params为list[dict]时为批量插入
+
+        Returns: (sql, params)
+        """
+        params, field = self._fields(params, selective)
+
+        def build():
+            values = '%({})s'.format(")s,%(".join(field))
+            cols = '`%s`' % "`,`".join(field)
+            return "INSERT INTO %s (%s) VALUES (%s)" % (self.table(table), cols, values)
+
+        return self._memoSQL(('insert', table) + tuple(field), build), params
+
+    def _buildPreparedInsert(self, table, params, selective=False):
+        """拼接预编译的单条插入SQL，参数按列的顺序转为tuple
+
+        Returns: (sql, params)
+        """
+        params, field = self._fields(params, selective)
+        sql = self._memoSQL(('pinsert', table) + tuple(field),
+                            lambda: self._insertSQL(table, field))
+        return sql, tuple([params[k] for k in field])
+
+    def _insertSQL(self, table, cols, rows=1):
+        """拼接批量插入的SQL，rows为VALUES后面占位符的组数
+        """
+        def build():
+            field = '`%s`' % "`,`".join(cols)
+
+            placeholder = "(%s"
+            for i in range(len(cols) - 1):
+                 placeholder += ",%s"
+            placeholder += ")"
+
+            return "INSERT INTO %s (%s) VALUES %s" % (
+                self.table(table), field, ",".join([placeholder] * rows))
+
+        return self._memoSQL(('batch', table, rows) + tuple(cols), build)
+
+    def _buildUpdate(self, table, where, params, selective=False, prepared=False):
+        """拼接条件更新的SQL，prepared为True时使用%s占位，参数按列的顺序转为tuple
+
+        Returns: (sql, params)
+        """
+        params, field = self._fields(params, selective)
+
+        # where为空则更新全部
+        where = where if where else '1=1'
+
+        def build():
+            t = []
+            for item in field:
+                if prepared:
+                    t.append('`{}`=%s'.format(item))
+                else:
+                    t.append('`{}`=%({})s'.format(item, item))
+
+            return "UPDATE %s SET %s WHERE %s" % (self.table(table), ",".join(t), where)
+
+        sql = self._memoSQL(('update', table, prepared, where) + tuple(field), build)
+        if prepared:
+            return sql, tuple([params[k] for k in field])
+        return sql, params
+
+    def _buildDelete(self, table, where):
+        where = where if where else '1=1'
+        return "DELETE FROM %s WHERE %s" % (self.table(table), where)
+
+    def _updateCaseSQL(self, table, key_col, merged):
+        """生成updateBatch一个分片的SQL和参数，没有需要更新的列时返回(None, None)
+        """
+        cols = []
+        for item in merged.values():
+            for c in item:
+                if c != key_col and c not in cols:
+                    cols.append(c)
+        if not cols:
+            return None, None
+
+        sets = []
+        params = []
+        for c in cols:
+            whens = []
+            for key, item in merged.items():
+                if c in item:
+                    whens.append("WHEN %s THEN %s")
+                    params.append(key)
+                    params.append(item[c])
+            sets.append("`{0}` = CASE `{1}` {2} ELSE `{0}` END".format(c, key_col, " ".join(whens)))
+
+        params.extend(merged.keys())
+        sql = "UPDATE %s SET %s WHERE `%s` IN (%s)" % (
+            self.table(table), ", ".join(sets), key_col, ",".join(["%s"] * len(merged)))
+        return sql, tuple(params)
+
+    def _dictRows(self, data):
+        """把list[dict]（或生成器）转为列名和按列取值的生成器，列名以第一条数据为准
+
+        Returns: (cols, rows)，数据为空时cols为空数组
+        """
+        if isinstance(data, (str, bytes, dict)) or not hasattr(data, '__iter__'):
+            raise UmsException("error data,need list[dict]")
+
+        it = iter(data)
+        first = next(it, None)
+        if first is None:
+            return [], iter(())
+        if type(first) != dict:
+            raise UmsException("error data element,need list[dict]")
+        cols = list(first.keys())
+
+        def rows():
+            yield list(first.values())
+            for item in it:
+                if type(item) != dict:
+                    raise UmsException("error data element,need list[dict]")
+                yield list(item.values())
+
+        return cols, rows()
+
+
+class UmsDB(UmsSQLBuilder):
     sql    = ''
     conn   = None
     cursor = None
+    pool   = None
 
     def __init__(self, host, port, username, password, database,
-                charset='utf8', table_prefix='', raise_on_warnings=True):
+                charset='utf8', table_prefix='', raise_on_warnings=True, allow_local_infile=False,
+                slow_query_ms=None, log_params_rows=5, cache=None, prepared=False, stmt_cache_size=64,
+                metrics=None, retry=None):
         '''构造函数
 
         Args:
@@ -32,6 +425,14 @@ class UmsDB(object):
             @param charset           : 字符编码
             @param table_prefix      : 数表的前缀
             @param raise_on_warnings : 是否显示警告
+            @param allow_local_infile: 是否允许LOAD DATA LOCAL INFILE，bulkLoad需要
+            @param slow_query_ms     : 慢SQL阈值，单位毫秒，执行超过该时间的SQL以WARNING级别记录，None为不统计
+            @param log_params_rows   : DEBUG日志中批量参数最多打印多少行
+            @param cache             : 查询结果缓存，umscache.QueryCache，None为不缓存
+            @param prepared          : insert/update/insertBatch是否使用服务端预编译语句
+            @param stmt_cache_size   : 每个连接最多保留多少条预编译语句
+            @param metrics           : 执行统计，umsmetrics.UmsMetrics，None为不统计
+            @param retry             : 出错重试策略，RetryPolicy，默认重试3次，RetryPolicy(0)为不重试
 
         Returns: void
         '''
@@ -43,32 +444,100 @@ class UmsDB(object):
         self.charset = charset
         self.table_prefix = table_prefix
         self.raise_on_warnings = bool(raise_on_warnings)
+        self.allow_local_infile = bool(allow_local_infile)
+        self.slow_query_ms = slow_query_ms
+        self.log_params_rows = int(log_params_rows)
+        self.cache = cache
+        self.prepared = bool(prepared)
+        self.stmt_cache_size = int(stmt_cache_size)
+        # 预编译语句缓存，sql -> 预编译游标，只对当前连接有效，连接池的连接由UmsDBPool保存
+        self._stmtCache = collections.OrderedDict()
+        self._lastCursor = None
+        # 最近一次findIter结果的列名
+        self._iterColumns = []
+        self.metrics = metrics
+        self.retry = retry if retry is not None else RetryPolicy()
+        # 当前事务中是否有未提交的写操作，以及是否手动开启了事务，有则不能透明重试
+        self._dirty = False
+        self._inTrans = False
+        # 当前事务中写过的表，提交或回滚后使这些表的查询缓存失效
+        self._written = set()
+        # 每个实例独占自己的连接和游标，不要在多个线程之间共享同一个UmsDB
+        self.sql = ''
+        self.conn = None
+        self.cursor = None
+        self.pool = None
+
+    @classmethod
+    def from_pool(cls, pool):
+        """创建一个从连接池借用连接的UmsDB
+
+        connect()时从连接池借出连接，close()时归还给连接池，
+        推荐使用 with pool.connection() as db 的方式
+
+        Args:
+            @param pool : UmsDBPool
+
+        Returns: UmsDB
+        """
+        db = cls(pool.host, pool.port, pool.username, pool.password, pool.database,
+                 charset=pool.charset, table_prefix=pool.table_prefix,
+                 raise_on_warnings=pool.raise_on_warnings,
+                 allow_local_infile=pool.allow_local_infile,
+                 slow_query_ms=pool.slow_query_ms,
+                 log_params_rows=pool.log_params_rows,
+                 cache=pool.cache,
+                 prepared=pool.prepared,
+                 stmt_cache_size=pool.stmt_cache_size,
+                 metrics=pool.metrics,
+                 retry=pool.retry)
+        db.pool = pool
+        return db
 
     def connect(self, force=False):
         if self.conn is None or force is True:
+            if self.conn is not None and self.metrics is not None:
+                self.metrics.record_reconnect()
             try:
-                self.conn = mysql.connector.connect(
-                    host=self.host,
-                    user=self.username,
-                    password=self.password,
-                    database=self.database,
-                    port=self.port,
-                    raise_on_warnings=self.raise_on_warnings)
+                if self.pool is not None:
+                    if self.conn is not None:
+                        # 强制重连时，旧的连接直接丢弃
+                        self.pool.release(self.conn, discard=True)
+                        self.conn = None
+                    self.conn = self.pool.acquire()
+                else:
+                    if self.conn is not None:
+                        try:
+                            self.conn.close()
+                        except Exception:
+                            pass
+                    self.conn = _open_connection(
+                        self.host, self.port, self.username, self.password, self.database,
+                        charset=self.charset,
+                        raise_on_warnings=self.raise_on_warnings,
+                        allow_local_infile=self.allow_local_infile)
 
                 self.cursor = self.conn.cursor(dictionary=True, buffered=True)
-                if self.charset is not None:
-                    # 字符串一行太长写不下
-                    # 通过括号进行连接，每行字符串都由引号引起来
-                    self.executeSQL(("SET "
-                                "character_set_connection='{}', "
-                                "character_set_results='{}', "
-                                "character_set_client=binary").format(self.charset, self.charset))
+                # 预编译语句属于连接，连接池的连接在多次借出之间保留，独立的连接重连后全部失效
+                self._stmtCache = (self.pool._stmtCacheFor(self.conn) if self.pool is not None
+                                   else collections.OrderedDict())
+                # 事务属于旧的连接，重连后失效
+                self._dirty = False
+                self._inTrans = False
+                self._flushInvalidate()
             except Exception as err:
                 logger.error("connection error: {}".format(traceback.format_exc()))
                 raise UmsException("connection error")
 
         return self.conn
 
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
     def findOneEx(self, table='', where=None, field=None, order=None, sql=None):
         '''查找一条记录，返回的是一个对象，对findOne的一个优化
 
@@ -134,17 +603,15 @@ class UmsDB(object):
 
         Returns:
         '''
-        if not sql:
-            # 等价于其他语言的三目运算符
-            # where = where == null ? '1=1' : where
-            where = where if where else '1=1'
-            field = field if field else '*'
-            order = order if order else ''
-            limit = ('limit %s' % str(limit)) if limit else ''
+        sql = self._buildSelect(table, where, field, order, limit, sql)
+        cache = self._queryCache(table)
+        if cache is not None:
+            result = cache.get(table, sql)
+            if result is not None:
+                self.sql = sql
+                return result
+            version = cache.version(table)
 
-            if type(field) == list:
-                field = '`%s`' % ("`,`".join(field))
-            sql = "SELECT %s FROM %s WHERE %s %s %s" % (field, self.table(table), where, order, limit)
         self.executeSQL(sql)
 
         # fetchone返回的是一个dict，上面的findOneEx会有问题
@@ -154,7 +621,323 @@ class UmsDB(object):
         # else:
         #     return self.cursor.fetchall()
 
-        return self.cursor.fetchall()
+        result = self.cursor.fetchall()
+        if cache is not None:
+            cache.put(table, sql, result, version=version)
+        return result
+
+    def findIter(self, table='', where=None, field=None, order=None, limit=None, sql=None,
+                 size=1000, chunked=False):
+        '''流式查询多条记录，返回一个生成器
+
+        使用非缓冲游标，每次只从服务器读取size条，不论结果集多大，内存占用都是固定的。
+        注意：迭代结束（或生成器被关闭）之前，当前连接不能执行其他SQL
+
+        Args:
+            @param table     : 表名
+            @param where     : 查询条件
+            @param field     : 要查询的列
+            @param order     : 排序，例：ORDER BY create_time DESC
+            @param limit     : 本次最多查询多少条
+            @param sql       : 完整的SQL，前面的where、field、order均不在生效
+            @param size      : 每次fetchmany读取的条数
+            @param chunked   : True则每次返回size条组成的list，False则逐条返回
+
+        Returns: generator
+        '''
+        sql = self._buildSelect(table, where, field, order, limit, sql)
+        cursor = self.conn.cursor(dictionary=True, buffered=False)
+        try:
+            self.executeSQL(sql, cursor=cursor)
+            self._iterColumns = [d[0] for d in cursor.description or ()]
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                if chunked:
+                    yield rows
+                else:
+                    yield from rows
+        finally:
+            self._closeStream(cursor)
+
+    def _closeStream(self, cursor):
+        """关闭非缓冲游标，未读完的结果需要先读掉，否则连接无法继续使用
+        """
+        try:
+            if self.conn.unread_result:
+                self.conn.consume_results()
+        finally:
+            cursor.close()
+
+    def findColumns(self, table='', where=None, field=None, order=None, limit=None, sql=None,
+                    fetch_format='columns', numpy=False, size=10000):
+        '''按列返回查询结果，适合报表统计等分析类的查询
+
+        findList每行都是一个dict，每行都重复保存列名，内存占用最大；这里使用非字典、非缓冲的游标，
+        fetch_format='columns'时返回 {列名: 列数据}，整数、浮点数列为array（numpy为True时为numpy数组），
+        含有NULL或其他类型的列为list；fetch_format='tuples'时返回 (列名数组, 元组数组)，所有行共用一份列名。
+
+        Args:
+            @param table        : 表名
+            @param where        : 查询条件
+            @param field        : 要查询的列
+            @param order        : 排序，例：ORDER BY create_time DESC
+            @param limit        : 本次最多查询多少条
+            @param sql          : 完整的SQL，前面的where、field、order均不在生效
+            @param fetch_format : columns或tuples
+            @param numpy        : 数值列是否转为numpy数组，需要 pip install numpy
+            @param size         : 每次fetchmany读取的条数
+
+        Returns: dict或(list, list)
+        '''
+        if fetch_format not in ('columns', 'tuples'):
+            raise UmsException("error fetch_format,need columns or tuples")
+        if numpy:
+            try:
+                import numpy as np
+            except ImportError:
+                raise UmsException("numpy=True need numpy, pip install numpy")
+
+        sql = self._buildSelect(table, where, field, order, limit, sql)
+        cursor = self.conn.cursor(buffered=False)
+        try:
+            self.executeSQL(sql, cursor=cursor)
+            names = [d[0] for d in cursor.description]
+            if fetch_format == 'tuples':
+                rows = []
+                while True:
+                    chunk = cursor.fetchmany(size)
+                    if not chunk:
+                        break
+                    rows.extend(chunk)
+                return names, rows
+
+            data = []
+            for d in cursor.description:
+                typecode = _ARRAY_TYPECODES.get(d[1])
+                data.append(array.array(typecode) if typecode else [])
+
+            while True:
+                chunk = cursor.fetchmany(size)
+                if not chunk:
+                    break
+                for i, col in enumerate(zip(*chunk)):
+                    values = data[i]
+                    if type(values) == list:
+                        values.extend(col)
+                        continue
+                    n = len(values)
+                    try:
+                        values.extend(col)
+                    except (TypeError, OverflowError):
+                        # 含有NULL或超出范围，这一列退回list
+                        del values[n:]
+                        values = data[i] = values.tolist()
+                        values.extend(col)
+        finally:
+            self._closeStream(cursor)
+
+        result = {}
+        for name, values in zip(names, data):
+            if numpy and type(values) != list:
+                values = np.frombuffer(values, dtype=np.int64 if values.typecode == 'q' else np.float64)
+            result[name] = values
+        return result
+
+    def scan(self, table, key='id', where=None, field=None, batch=10000, start=None, end=None,
+             where_params=None):
+        '''按主键分页遍历整张表，返回一个生成器
+
+        每次 WHERE key > 上一批最后的key ORDER BY key LIMIT batch，
+        无论翻到第几页都走索引，不会像 LIMIT offset, n 一样越翻越慢。
+        每批数据读完后才返回，遍历过程中当前连接可以执行其他SQL。
+
+        Args:
+            @param table        : 表名
+            @param key          : 遍历使用的列，需要有唯一索引，一般是自增主键
+            @param where        : 额外的查询条件，值用%s占位，由where_params传入；不能包含字面的%s
+            @param field        : 要查询的列，需要包含key
+            @param batch        : 每批读取的条数
+            @param start        : key的起始值（不包含），None表示从头开始
+            @param end          : key的结束值（包含），None表示到表尾
+            @param where_params : where中%s占位符的值，tuple
+
+        Returns: generator
+        '''
+        for rows in self._scanBatches(table, key, where, field, batch, start, end, where_params):
+            yield from rows
+
+    def _scanBatches(self, table, key='id', where=None, field=None, batch=10000, start=None, end=None,
+                     where_params=None):
+        if type(field) == list and key not in field:
+            field = field + [key]
+        field = field if field else '*'
+        if type(field) == list:
+            field = '`%s`' % ("`,`".join(field))
+        where = where if where else '1=1'
+
+        last = start
+        while True:
+            cond = []
+            # 每一页都绑定参数执行，where中的%在每一页的处理方式都一样
+            params = list(where_params or ())
+            if last is not None:
+                cond.append('`{}` > %s'.format(key))
+                params.append(last)
+            if end is not None:
+                cond.append('`{}` <= %s'.format(key))
+                params.append(end)
+            cond = ''.join([' AND ' + c for c in cond])
+
+            sql = "SELECT %s FROM %s WHERE (%s)%s ORDER BY `%s` LIMIT %d" % (
+                field, self.table(table), where, cond, key, int(batch))
+            self.executeSQL(sql, tuple(params))
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+            if key not in rows[-1]:
+                raise UmsException("error field,need key column {}".format(key))
+
+            yield rows
+            if len(rows) < batch:
+                break
+            last = rows[-1][key]
+
+    def parallelScan(self, table, key='id', where=None, field=None, batch=10000, workers=4,
+                     callback=None, pool=None, where_params=None):
+        '''把key的取值范围切成workers段，每段用一个独立的连接并发scan
+
+        key必须是整数类型。callback为None时返回一个生成器，合并所有分段的数据（不保证顺序）；
+        否则在各个工作线程中调用 callback(分段序号, rows)，每批调用一次，返回总条数。
+
+        Args:
+            @param table        : 表名
+            @param key          : 遍历使用的整数列，需要有唯一索引
+            @param where        : 额外的查询条件，同scan
+            @param field        : 要查询的列，需要包含key
+            @param batch        : 每批读取的条数
+            @param workers      : 并发数，不超过连接池的max_size（当前连接借自同一个池时再减一），
+                                  池中的连接被其他线程占用时，工作线程会等待，最多等待wait_timeout秒
+            @param callback     : 每批数据的回调函数，需要线程安全
+            @param pool         : 使用的连接池，默认为当前的连接池，没有或者没有多余的连接则临时创建一个
+            @param where_params : where中%s占位符的值，tuple
+
+        Returns: generator或总条数
+        '''
+        workers = max(1, int(workers))
+        own_pool = None
+        if pool is None:
+            pool = self.pool
+        if pool is not None:
+            # 每个分段占用一个连接，当前连接如果借自同一个池，它也占着一个
+            spare = pool.max_size - (1 if pool is self.pool and self.conn is not None else 0)
+            if spare < 1:
+                pool = None
+            else:
+                workers = min(workers, spare)
+        slices = self._scanSlices(table, key, where, workers, where_params)
+        if pool is None:
+            own_pool = pool = UmsDBPool(self.host, self.port, self.username, self.password,
+                                        self.database, charset=self.charset,
+                                        table_prefix=self.table_prefix,
+                                        raise_on_warnings=self.raise_on_warnings,
+                                        min_size=0, max_size=max(len(slices), 1))
+
+        if callback is not None:
+            try:
+                return self._parallelCallback(pool, slices, table, key, where, field, batch, callback,
+                                              where_params)
+            finally:
+                if own_pool is not None:
+                    own_pool.close()
+        return self._parallelMerge(pool, slices, table, key, where, field, batch, own_pool,
+                                   where_params)
+
+    def _scanSlices(self, table, key, where, workers, where_params=None):
+        """按key的最小值和最大值平均切分，返回[(start, end)]，start不包含，end包含
+        """
+        sql = "SELECT MIN(`%s`) AS lo, MAX(`%s`) AS hi FROM %s WHERE %s" % (
+            key, key, self.table(table), where if where else '1=1')
+        self.executeSQL(sql, tuple(where_params or ()))
+        rs = self.cursor.fetchone()
+        if rs is None or rs['lo'] is None:
+            return []
+        lo, hi = rs['lo'], rs['hi']
+        if not isinstance(lo, int) or not isinstance(hi, int):
+            raise UmsException("parallelScan need integer key")
+
+        workers = max(1, min(int(workers), hi - lo + 1))
+        step = (hi - lo + 1) // workers
+        slices = []
+        start = lo - 1
+        for i in range(workers):
+            end = hi if i == workers - 1 else start + step
+            slices.append((start, end))
+            start = end
+        return slices
+
+    def _parallelCallback(self, pool, slices, table, key, where, field, batch, callback,
+                          where_params=None):
+        def work(no, start, end):
+            count = 0
+            with pool.connection() as db:
+                for rows in db._scanBatches(table, key, where, field, batch, start, end, where_params):
+                    callback(no, rows)
+                    count += len(rows)
+            return count
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(slices), 1)) as executor:
+            futures = [executor.submit(work, i, start, end) for i, (start, end) in enumerate(slices)]
+            return sum([f.result() for f in futures])
+
+    def _parallelMerge(self, pool, slices, table, key, where, field, batch, own_pool=None,
+                       where_params=None):
+        # 队列有界，消费慢时工作线程阻塞，内存不会无限增长
+        q = queue.Queue(maxsize=max(len(slices), 1) * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def work(start, end):
+            try:
+                with pool.connection() as db:
+                    for rows in db._scanBatches(table, key, where, field, batch, start, end,
+                                                where_params):
+                        if not put(rows):
+                            return
+            except Exception as err:
+                put(err)
+            finally:
+                put(done)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(slices), 1))
+        try:
+            for start, end in slices:
+                executor.submit(work, start, end)
+            finished = 0
+            while finished < len(slices):
+                item = q.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            # 提前退出或出错时通知工作线程停止
+            stop.set()
+            executor.shutdown(wait=True)
+            if own_pool is not None:
+                own_pool.close()
 
 
     def insertSelective(self, table, params):
@@ -178,72 +961,63 @@ class UmsDB(object):
 
         Returns: 本次插入的自增Id值
         '''
-        field = []
-
-        t = type(params)
-        if t == dict:
-            if selective: 
-                params = dict((k,v) for k,v in params.items() if v)
-            field = list(params.keys())
-        elif t == list:
-            field = params[0]
-            if not isinstance(field, dict):
-                raise UmsException("error params,need list[dict]")
-            field = list(field.keys())
+        if self.prepared and type(params) == dict:
+            sql, params = self._buildPreparedInsert(table, params, selective)
+            prepared = True
         else:
-            raise UmsException("error params,need dict")
+            sql, params = self._buildInsert(table, params, selective)
+            prepared = False
+        self._invalidate(table)
+        self.executeSQL(sql, params, prepared=prepared)
+        self._commit()
 
-        if not field or not isinstance(field, list):
-            raise UmsException("error params,need dict")
-        
-        values = '%({})s'.format(")s,%(".join(field))
-        field = '`%s`' % "`,`".join(field)
-        sql = "INSERT INTO %s (%s) VALUES (%s)" % (self.table(table), field, values)
-        
-        self.executeSQL(sql, params)
-        self.conn.commit()
+        return self._lastCursor.lastrowid
 
-        return self.cursor.lastrowid
 
 
-    def insertBatchEx(self, table, data):
+    def insertBatchEx(self, table, data, auto_commit=False, **kwargs):
         """ 批量插入数据，当数据较多时，单条插入会非常耗时
             这里需要手动的开启事务
 
         Args:
             table: 表名
-            data:  要写入数据库的数据，这里是一个数组格式
-                   数组内部是一个字典类型，key为数据库字段名，value为值
+            data:  要写入数据库的数据，可以是数组或生成器
+                   元素是一个字典类型，key为数据库字段名，value为值
+            auto_commit: 是否自动提交，默认不提交
+            kwargs: 分片相关的参数，参见insertBatch
 
         Returns: 影响的行数
         """
 
-        t = type(data)
-        if t != list:
-            raise UmsException("error data,need list[list]")
-
-        cols = []
-        vals = []
-        for item in data:
-            if type(item) != dict:
-                raise UmsException("error data element,need list[list]")
-
-            if not cols:
-                cols = list(item.keys())
+        cols, rows = self._dictRows(data)
+        if not cols:
+            return 0
+        return self.insertBatch(table, cols, rows, auto_commit=auto_commit, **kwargs)
 
-            vals.append(list(item.values()))
-        
-        return self.insertBatch(table, cols, vals, auto_commit=False)
+    def insertBatch(self, table, cols, vals, auto_commit=True, chunk_size=1000,
+                    chunk_bytes=4194304, commit_every=1, retries=None, progress=None):
+        """批量插入数据，当数据较多时，单条插入会非常耗时
 
+        数据按chunk_size条或chunk_bytes字节（估算值）分片，每片一次executemany，
+        内存占用只和分片大小有关，vals可以是生成器。
 
-    def insertBatch(self, table, cols, vals, auto_commit=True):
-        """批量插入数据，当数据较多时，单条插入会非常耗时
+        auto_commit为True时，每commit_every片提交一次；遇到死锁、连接断开等错误，
+        回滚后重放所有未提交的分片，最多重试retries次。
+        调用前连接上已有未提交的写操作或startTrans开启的事务时，回滚会丢掉调用方的数据，
+        第一次提交之前出错直接抛出，不重试。
+        auto_commit为False时事务由调用方控制，出错直接抛出。
 
         Args:
             table: 表名
             cols: 表列，数组
-            vals: 每列对应的值，数组，数组的元素还是一个数组
+            vals: 每列对应的值，数组或生成器，元素还是一个数组
             auto_commit: 事务是否自动提交，一般而言，分批插入可能会自己启动事务
+            chunk_size: 每片最多多少条
+            chunk_bytes: 每片最多多少字节，需小于服务端的max_allowed_packet，0表示不限制
+            commit_every: 每多少片提交一次
+            retries: 单片最多重试次数，默认为retry策略的次数
+            progress: 进度回调 progress(分片序号, 已写入条数, 已提交条数)，
+                      中断后可以根据已提交条数跳过已入库的数据重新执行
 
         Returns: 影响的行数
         """
@@ -252,79 +1026,309 @@ class UmsDB(object):
         if t != list:
             raise UmsException("error cols,need list[list]")
 
-        t = type(vals)
-        if t != list:
+        if isinstance(vals, (str, bytes, dict)) or not hasattr(vals, '__iter__'):
             raise UmsException("error vals,need list[list]")
 
-        field = '`%s`' % "`,`".join(cols)
+        sql = self._insertSQL(table, cols)
+        self._invalidate(table)
 
-        placeholder = "(%s"
-        for i in range(len(cols) - 1):
-             placeholder += ",%s"
-        placeholder += ")"
-        
-        sql = "INSERT INTO %s (%s) VALUES %s" % (self.table(table), field, placeholder)
-        self.executeSQL(sql, vals)
-        if auto_commit:
-            self.conn.commit()
+        statement = None
+        # 预编译语句最多65535个占位符
+        if self.prepared and cols and chunk_size * len(cols) <= 65535:
+            def statement(chunk):
+                # 每种行数都是一条不同的预编译语句，只有满chunk_size条的分片预编译，
+                # 最后一片或按chunk_bytes截断的分片走普通的executemany，避免挤占预编译语句缓存
+                if len(chunk) != chunk_size:
+                    return sql, chunk, False
+                params = []
+                for row in chunk:
+                    params.extend(row)
+                return self._insertSQL(table, cols, len(chunk)), tuple(params), True
 
-        return self.cursor.rowcount
+        return self._executeBatch(sql, vals, auto_commit, chunk_size, chunk_bytes,
+                                  commit_every, retries, progress, statement)
 
+    def upsertBatch(self, table, rows, key_cols, update_cols=None, **kwargs):
+        """批量插入或更新（INSERT ... ON DUPLICATE KEY UPDATE），分片提交
 
-    def updateSelective(self, table, where, params):
-        """条件更新表，去除字典中值为空的字段
+        依赖表上的主键或唯一索引判断记录是否存在。MySQL 8.0.19以上使用行别名
+        VALUES (...) AS `new` ON DUPLICATE KEY UPDATE `c`=`new`.`c`，
+        更早的MySQL和MariaDB使用`c`=VALUES(`c`)
 
         Args:
-            @param table     : 表名
-            @param where     : 更新条件
-            @param params    : 要更新的字段和值，dict结构
+            table: 表名
+            rows: 要写入的数据，list[dict]或生成器，列名以第一条数据为准
+            key_cols: 主键或唯一索引的列，数组，这些列不会被更新
+            update_cols: 记录已存在时要更新的列，默认为除key_cols以外的所有列
+            kwargs: 分片相关的参数，参见insertBatch
+
+        Returns: 影响的行数，MySQL中插入计1，更新计2，值未变化计0
+        """
+        cols, vals = self._dictRows(rows)
+        if not cols:
+            return 0
+
+        key_cols = key_cols or []
+        if update_cols is None:
+            update_cols = [c for c in cols if c not in key_cols]
+        if not update_cols:
+            raise UmsException("error update_cols,need at least one column")
+
+        if self._rowAlias():
+            update = ",".join(['`{0}`=`new`.`{0}`'.format(c) for c in update_cols])
+            sql = "%s AS `new` ON DUPLICATE KEY UPDATE %s" % (self._insertSQL(table, cols), update)
+        else:
+            update = ",".join(['`{0}`=VALUES(`{0}`)'.format(c) for c in update_cols])
+            sql = "%s ON DUPLICATE KEY UPDATE %s" % (self._insertSQL(table, cols), update)
+        self._invalidate(table)
+        return self._executeBatch(sql, vals, **kwargs)
+
+    def _rowAlias(self):
+        """服务端是否支持INSERT ... AS `new`的行别名（MySQL 8.0.19以上，MariaDB不支持）
+
+        MySQL 8.0.20起VALUES()已废弃并产生1287警告，raise_on_warnings时会抛出异常
+        """
+        if 'mariadb' in (self.conn.get_server_info() or '').lower():
+            return False
+        return tuple(self.conn.get_server_version() or ()) >= (8, 0, 19)
+
+    def updateBatch(self, table, key_col, rows, chunk_size=500, retries=None, progress=None):
+        """按主键批量更新，多条记录合并为一条UPDATE ... CASE语句，每片提交一次
+
+        UPDATE t SET `c` = CASE `id` WHEN 1 THEN 'a' WHEN 2 THEN 'b' ELSE `c` END
+        WHERE `id` IN (1,2)
+
+        Args:
+            table: 表名
+            key_col: 主键列名
+            rows: 要更新的数据，list[dict]或生成器，每条都必须包含key_col，
+                  其余的key为要更新的列，不同的记录可以更新不同的列；同一主键出现多次时合并，后面的覆盖前面的
+            chunk_size: 每条UPDATE语句包含的记录数
+            retries: 单片最多重试次数，默认为retry策略的次数
+            progress: 进度回调 progress(分片序号, 已处理条数)，已处理条数包括没有需要更新的列而跳过的记录
+
+        出错重试的规则同insertBatch，调用前有未提交的写操作时第一片出错直接抛出
 
         Returns: 影响的行数
         """
-        return self.update(table, where, params, True)
+        if isinstance(rows, (str, bytes, dict)) or not hasattr(rows, '__iter__'):
+            raise UmsException("error rows,need list[dict]")
+
+        self._invalidate(table)
+        total = 0
+        committed = 0
+        chunk_no = 0
+        # 同_executeBatch，第一次提交之前连接上有调用方未提交的写操作时不重试
+        owned = not self._openTrans()
+        for chunk in _chunked(rows, chunk_size):
+            merged = collections.OrderedDict()
+            for item in chunk:
+                if type(item) != dict or key_col not in item:
+                    raise UmsException("error rows element,need dict with key {}".format(key_col))
+                merged.setdefault(item[key_col], {}).update(item)
+
+            # 没有需要更新的列时不执行，但和upsertBatch一样计入分片序号和已处理条数
+            chunk_no += 1
+            sql, params = self._updateCaseSQL(table, key_col, merged)
+            if sql is not None:
+                total += self._executeChunk(sql, params, [] if owned else None, retries)
+                self._commit()
+                owned = True
+            committed += len(chunk)
+            if progress is not None:
+                progress(chunk_no, committed)
+
+        return total
+
+    def _executeBatch(self, sql, rows, auto_commit=True, chunk_size=1000, chunk_bytes=4194304,
+                      commit_every=1, retries=None, progress=None, statement=None):
+        """分片执行executemany，供批量写入的接口共用
+
+        statement(chunk)可以把一个分片转为(sql, params, prepared)，例如多行的预编译语句
 
-    def update(self, table, where, params, selective=False):
-        """条件更新表
+        Returns: 影响的行数
+        """
+        total = 0
+        sent = 0
+        committed = 0
+        # 已执行但未提交的分片，出错重试时需要重放
+        pending = []
+        # 调用前连接上已有未提交的写操作或显式事务时，回滚会连带丢掉调用方的数据，
+        # 第一次提交之前不重试；提交之后的事务完全属于本次批量写入，可以回滚重放
+        owned = auto_commit and not self._openTrans()
+        chunk_no = 0
+        for chunk in _chunked(rows, chunk_size, chunk_bytes):
+            chunk_no += 1
+            item = statement(chunk) if statement is not None else (sql, chunk, False)
+            total += self._executeChunk(item[0], item[1], pending if owned else None,
+                                        retries, item[2])
+            sent += len(chunk)
+
+            if auto_commit:
+                pending.append(item)
+                if len(pending) >= commit_every:
+                    self._commit()
+                    pending = []
+                    committed = sent
+                    owned = True
+
+            if progress is not None:
+                progress(chunk_no, sent, committed)
+
+        if auto_commit and pending:
+            self._commit()
+            if progress is not None and committed != sent:
+                progress(chunk_no, sent, sent)
+
+        return total
+
+    def _executeChunk(self, sql, chunk, pending, retries, prepared=False):
+        """执行一个分片，pending为本事务中已执行但未提交的(sql, params, prepared)，None表示不允许重试
+
+        Returns: 本片影响的行数
+        """
+        policy = self.retry
+        retries = policy.retries if retries is None else retries
+        attempt = 0
+        replay = []
+        while True:
+            try:
+                for item in replay:
+                    self._executeSQL(item[0], item[1], prepared=item[2])
+                self._executeSQL(sql, chunk, prepared=prepared)
+                return self._lastCursor.rowcount
+            except mysql.connector.Error as err:
+                attempt += 1
+                if pending is None or attempt > retries or not policy.retryable(err):
+                    raise
+
+                logger.warning("batch chunk failed, retry {}/{}: {}".format(attempt, retries, err))
+                time.sleep(policy.delay(attempt))
+                self._recover(err)
+                # 事务已经回滚，之前未提交的分片需要重新执行
+                replay = pending
+
+    def _recover(self, err):
+        """出错后恢复连接状态：连接断开则重连，否则回滚当前事务
+        """
+        if err.errno in CONNECTION_ERRNOS:
+            self.connect(force=True)
+        else:
+            self.conn.rollback()
+            self._dirty = False
+            self._inTrans = False
+            self._flushInvalidate()
+
+    def _commit(self):
+        """内部使用的提交，不打印日志
+        """
+        self.conn.commit()
+        self._dirty = False
+        self._inTrans = False
+        self._flushInvalidate()
+
+
+    def bulkLoad(self, table, rows_or_file, cols, auto_commit=True, ignore_lines=0,
+                 charset='utf8mb4', tmp_dir=None, fallback=True, **kwargs):
+        """通过LOAD DATA LOCAL INFILE批量导入，比INSERT快一个数量级
+
+        rows_or_file为数据时，先逐行写入临时文件（制表符分隔，反斜杠转义，NULL写为\\N），
+        再交给服务端导入；为文件路径时，文件需要是同样的格式（即SELECT ... INTO OUTFILE的默认格式）。
+        服务端或客户端不允许LOCAL INFILE时，fallback为True则退回到分片的insertBatch。
+        需要在构造函数中设置allow_local_infile=True。
 
         Args:
-            @param table     : 表名
-            @param where     : 更新条件，为空则更新全部
-            @param params    : 要更新的字段和值，dict结构
-            @param selective : 是否去除值为空的字段
+            table: 表名
+            rows_or_file: 数据（数组或生成器，元素还是一个数组）或者文件路径
+            cols: 表列，数组
+            auto_commit: 导入后是否提交
+            ignore_lines: 文件开头跳过的行数，例如表头
+            charset: 文件的字符编码，临时文件固定为utf8mb4
+            tmp_dir: 临时文件所在目录，默认为系统临时目录
+            fallback: 不允许LOCAL INFILE时是否退回insertBatch
+            kwargs: 退回insertBatch时的分片参数
 
         Returns: 影响的行数
         """
-        field = []
-        t = type(params)
-        if t == dict:
-            if selective:
-                params = dict((k,v) for k,v in params.items() if v)
-            field = list(params.keys())
-        elif t == list:
-            field = params[0]
-            if not isinstance(field, dict):
-                raise UmsException("error params,need list[dict]")
-            field = list(field.keys())
+        t = type(cols)
+        if t != list or not cols:
+            raise UmsException("error cols,need list[list]")
+
+        self._invalidate(table)
+        tmp = None
+        if isinstance(rows_or_file, str):
+            path = rows_or_file
         else:
-            raise UmsException("error params,need dict")
+            fd, tmp = tempfile.mkstemp(prefix='ums_load_', suffix='.txt', dir=tmp_dir)
+            with open(fd, 'wb', buffering=1048576) as fp:
+                for row in rows_or_file:
+                    fp.write(b'\t'.join([_load_escape(v) for v in row]))
+                    fp.write(b'\n')
+            path = tmp
+            charset = 'utf8mb4'
+            ignore_lines = 0
+
+        try:
+            field = '`%s`' % "`,`".join(cols)
+            sql = ("LOAD DATA LOCAL INFILE %(path)s INTO TABLE {} CHARACTER SET {} "
+                   "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                   "IGNORE {} LINES ({})").format(self.table(table), charset, int(ignore_lines), field)
+            try:
+                self.executeSQL(sql, {'path': path})
+            except mysql.connector.Error as err:
+                if not fallback or err.errno not in LOCAL_INFILE_ERRNOS:
+                    raise
+                logger.warning("LOAD DATA LOCAL INFILE is not allowed, fallback to insertBatch: {}".format(err))
+                return self.insertBatch(table, cols, _read_load_file(path, ignore_lines),
+                                        auto_commit=auto_commit, **kwargs)
+
+            if auto_commit:
+                self._commit()
+            return self.cursor.rowcount
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+
+
+    def updateSelective(self, table, where, params, where_params=None):
+        """条件更新表，去除字典中值为空的字段
 
-        if not field or not isinstance(field, list):
-            raise UmsException("error params,need dict")
+        Args:
+            @param table        : 表名
+            @param where        : 更新条件
+            @param params       : 要更新的字段和值，dict结构
+            @param where_params : 更新条件中%s占位符的值，同update
 
-        # where为空则更新全部
-        where = where if where else '1=1'
+        Returns: 影响的行数
+        """
+        return self.update(table, where, params, True, where_params)
+
+    def update(self, table, where, params, selective=False, where_params=None):
+        """条件更新表
 
-        t = []
-        for item in field:
-            t.append('`{}`=%({})s'.format(item, item))
+        Args:
+            @param table        : 表名
+            @param where        : 更新条件，为空则更新全部
+            @param params       : 要更新的字段和值，dict结构
+            @param selective    : 是否去除值为空的字段
+            @param where_params : 更新条件中%s占位符的值，tuple，例：update(t, 'id=%s', {...}, where_params=(1,))；
+                                  开启prepared时，只有where为空或者使用了where_params才预编译，
+                                  否则每个不同的where都是一条不同的语句
 
-        sql = "UPDATE %s SET %s WHERE %s" % (self.table(table), ",".join(t), where)
-        self.executeSQL(sql, params)
-        self.conn.commit()
+        Returns: 影响的行数
+        """
+        positional = where_params is not None and type(params) == dict
+        prepared = self.prepared and type(params) == dict and (positional or not where)
+        sql, params = self._buildUpdate(table, where, params, selective, positional or prepared)
+        if positional:
+            params = params + tuple(where_params)
+        self._invalidate(table)
+        self.executeSQL(sql, params, prepared=prepared)
+        self._commit()
 
         # 影响的行数
         # 实践证明：如果传入的参数值和数据库的值一致，这里会返回0
-        return self.cursor.rowcount
+        return self._lastCursor.rowcount
 
     def count(self, table='', where=None, sql=None):
         '''根据条件或指定的SQL统计数据的条数
@@ -337,32 +1341,169 @@ class UmsDB(object):
         Returns: 条数
         '''
         count = 0
-        if not sql:
-            where = where if where else '1=1'
-            sql = "SELECT COUNT(*) AS NUM FROM %s WHERE %s" % (self.table(table), where)
+        sql = self._buildCount(table, where, sql)
+        cache = self._queryCache(table)
+        if cache is not None:
+            result = cache.get(table, sql)
+            if result is not None:
+                self.sql = sql
+                return result
+            version = cache.version(table)
+
         self.executeSQL(sql)
 
         rs = self.cursor.fetchone()
         if rs is not None:
             count = rs['NUM']
+        if cache is not None:
+            cache.put(table, sql, count, version=version)
         return count
 
-    def executeSQL(self, sql, params=None):
+    def _queryCache(self, table):
+        """查询时使用的缓存
+
+        只有指定了表名的查询才能在写表时失效，才可以缓存；
+        当前事务中写过的表，读到的是未提交的数据，不读也不写缓存
+        """
+        if self.cache is None or not table or table in self._written:
+            return None
+        return self.cache
+
+    def _invalidate(self, table):
+        """记录写了哪张表，提交或回滚之后才使该表的查询缓存失效
+
+        写之前就失效的话，提交之前其他连接的查询又会把旧的数据缓存起来
+        """
+        if self.cache is not None:
+            self._written.add(table)
+
+    def _flushInvalidate(self):
+        """事务结束（提交、回滚或连接断开）后，使本事务中写过的表的缓存失效
+        """
+        if not self._written:
+            return
+        tables, self._written = self._written, set()
+        if self.cache is not None:
+            for table in tables:
+                self.cache.invalidate(table)
+
+    def _openTrans(self):
+        """当前连接上是否有未提交的写操作或startTrans开启的事务，此时回滚重试会丢掉调用方的数据
+        """
+        return self._dirty or self._inTrans
+
+    def executeSQL(self, sql, params=None, cursor=None, prepared=False):
+        """执行SQL
+
+        遇到死锁、锁等待超时、连接断开等可重试的错误时，如果当前事务中没有未提交的写操作，
+        则按retry策略等待后重连（或回滚）并重新执行；否则直接抛出，由调用方决定如何处理。
+        指定了cursor（例如流式查询）时不重试。
+        """
+        policy = self.retry
+        # 执行之前的事务状态，执行失败的这条语句本身不算
+        unsafe = cursor is not None or self._openTrans()
+        attempt = 0
+        while True:
+            try:
+                return self._executeSQL(sql, params, cursor, prepared)
+            except mysql.connector.Error as err:
+                attempt += 1
+                if unsafe or attempt > policy.retries or not policy.retryable(err):
+                    raise
+
+                logger.warning("execute sql failed, retry {}/{}: {}".format(attempt, policy.retries, err))
+                time.sleep(policy.delay(attempt))
+                self._recover(err)
+
+    def _executeSQL(self, sql, params=None, cursor=None, prepared=False):
+        """执行一次SQL，记录日志和统计，不重试
+        """
+        if prepared:
+            cursor = self._preparedCursor(sql)
+        cursor = self.cursor if cursor is None else cursor
+        self._lastCursor = cursor
         self.sql = sql
-        logger.debug('execute sql=[{}]'.format(sql))
+        # 未开启DEBUG时不做任何格式化和序列化
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('execute sql=[{}]'.format(sql))
+            if params:
+                logger.debug('params=[{}]'.format(self._dumpParams(params)))
+
+        if not self._dirty and not _is_read(sql):
+            self._dirty = True
+
+        metrics = self.metrics
+        if metrics is None and self.slow_query_ms is None:
+            return self._execute(cursor, sql, params)
+
+        if metrics is not None:
+            metrics.before_execute(sql, params)
+        error = None
+        start = time.perf_counter()
+        try:
+            return self._execute(cursor, sql, params)
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if metrics is not None:
+                metrics.after_execute(sql, params, elapsed, cursor.rowcount, error)
+            if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+                logger.warning('slow sql {:.1f}ms sql=[{}]'.format(elapsed * 1000, sql))
+
+    def stats(self):
+        """执行统计的快照，未设置metrics时返回空dict
+        """
+        if self.metrics is None:
+            return {}
+        return self.metrics.stats()
 
+    def _execute(self, cursor, sql, params):
         if params:
-            dump = json.dumps(params, ensure_ascii=False)
-            logger.debug('params=[{}]'.format(dump))
             t = type(params)
-            if t == dict:
-                return self.cursor.execute(sql, params)
+            if t == dict or t == tuple:
+                return cursor.execute(sql, params)
             elif t == list:
-                return self.cursor.executemany(sql, params)
+                return cursor.executemany(sql, params)
             else:
                 raise UmsException("illegal parameter type")
 
-        return self.cursor.execute(sql, params)
+        return cursor.execute(sql, params)
+
+    def _preparedCursor(self, sql):
+        """获取sql对应的预编译游标，同一条sql只在服务端prepare一次
+
+        mysql.connector的预编译游标只保留最后一条语句，所以每条sql各用一个游标，
+        超过stmt_cache_size时关闭最久未使用的
+        """
+        cursor = self._stmtCache.get(sql)
+        if cursor is not None:
+            self._stmtCache.move_to_end(sql)
+            return cursor
+
+        cursor = self.conn.cursor(prepared=True)
+        self._stmtCache[sql] = cursor
+        while len(self._stmtCache) > self.stmt_cache_size:
+            _, old = self._stmtCache.popitem(last=False)
+            old.close()
+        return cursor
+
+    def _clearStmtCache(self):
+        while self._stmtCache:
+            _, cursor = self._stmtCache.popitem()
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _dumpParams(self, params):
+        """参数序列化用于日志，批量参数只打印前log_params_rows行和总行数
+        """
+        if type(params) == list and len(params) > self.log_params_rows:
+            dump = json.dumps(params[:self.log_params_rows], ensure_ascii=False, default=str)
+            return '{} ... total {} rows'.format(dump, len(params))
+        return json.dumps(params, ensure_ascii=False, default=str)
 
 
     def delete(self, table, where):
@@ -370,47 +1511,318 @@ class UmsDB(object):
 
         Returns: 删除了多少条记录
         """
-        where = where if where else '1=1'
-        sql = "DELETE FROM %s WHERE %s" % (self.table(table), where)
+        sql = self._buildDelete(table, where)
+        self._invalidate(table)
         self.executeSQL(sql)
-        self.conn.commit()
+        self._commit()
         return self.cursor.rowcount
 
-    def table(self, table):
-        """可以增加前缀等操作
-        """
-        return table
-
     def getSQL(self):
         """获取当前在执行的SQL
         """
         return self.sql
 
+    def getIterColumns(self):
+        """获取最近一次findIter结果的列名，结果为空时也可以取到
+        """
+        return list(self._iterColumns)
+
     def close(self):
-        """关闭连接
+        """关闭连接，如果连接是从连接池借用的，则归还给连接池
         """
-        self.cursor.close()
-        self.conn.close()
-        logger.info("connection closed")
+        if self.conn is None:
+            return
+
+        if self.pool is None:
+            self._clearStmtCache()
+        # 连接池的连接归还后，预编译语句留给下一个借用者
+        self._stmtCache = collections.OrderedDict()
+        if self.cursor is not None:
+            self.cursor.close()
+        if self.pool is not None:
+            self.pool.release(self.conn)
+            logger.debug("connection released")
+        else:
+            self.conn.close()
+            logger.info("connection closed")
+        self.conn = None
+        self.cursor = None
+        # 未提交的写操作随连接关闭（或归还连接池时回滚）而丢弃
+        self._flushInvalidate()
 
     def startTrans(self):
         """开启事务
         """
         self.conn.start_transaction()
+        self._inTrans = True
 
     def commit(self):
         """提交事务
         """
-        self.conn.commit()
+        self._commit()
         logger.info("trasaction commited")
 
     def rollback(self):
         """回退事务
         """
         self.conn.rollback()
+        self._dirty = False
+        self._inTrans = False
+        self._flushInvalidate()
         logger.info("trasaction rollback")
 
 
+class UmsDBPool(object):
+    """线程安全的数据库连接池
+
+    每个线程通过 with pool.connection() as db 借出一个独占的UmsDB，
+    退出with时连接自动归还；省去每次任务都要重新建立TCP连接和认证的开销。
+
+    - 池中的连接数量在 [min_size, max_size] 之间
+    - 空闲超过idle_timeout秒的连接会被回收（保留min_size个）
+    - 借出连接时先ping一下，连接已失效则重新建立
+    """
+
+    def __init__(self, host, port, username, password, database,
+                charset='utf8', table_prefix='', raise_on_warnings=True, allow_local_infile=False,
+                min_size=1, max_size=10, idle_timeout=300, wait_timeout=30, metrics=None,
+                retry=None, slow_query_ms=None, log_params_rows=5, cache=None, prepared=False,
+                stmt_cache_size=64):
+        """构造函数
+
+        Args:
+            @param host              : 数据库的地址，IP
+            @param port              : 端口
+            @param username          : 用户
+            @param password          : 密码
+            @param database          : 数据名
+            @param charset           : 字符编码
+            @param table_prefix      : 数表的前缀
+            @param raise_on_warnings : 是否显示警告
+            @param allow_local_infile: 是否允许LOAD DATA LOCAL INFILE
+            @param min_size          : 最少保持的连接数
+            @param max_size          : 最多允许的连接数
+            @param idle_timeout      : 空闲连接回收时间，单位秒
+            @param wait_timeout      : 连接池耗尽时，等待可用连接的最长时间，单位秒
+            @param metrics           : 执行统计，umsmetrics.UmsMetrics，借出的UmsDB也使用它
+            @param retry             : 借出的UmsDB使用的重试策略，RetryPolicy
+            @param slow_query_ms     : 借出的UmsDB的慢SQL阈值，同UmsDB
+            @param log_params_rows   : 借出的UmsDB在DEBUG日志中批量参数最多打印多少行
+            @param cache             : 借出的UmsDB共用的查询结果缓存，umscache.QueryCache
+            @param prepared          : 借出的UmsDB是否使用服务端预编译语句
+            @param stmt_cache_size   : 每个连接最多保留多少条预编译语句，归还连接后继续保留
+
+        Returns: void
+        """
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.database = database
+        self.charset = charset
+        self.table_prefix = table_prefix
+        self.raise_on_warnings = bool(raise_on_warnings)
+        self.allow_local_infile = bool(allow_local_infile)
+
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        self.idle_timeout = float(idle_timeout)
+        self.wait_timeout = float(wait_timeout)
+        self.metrics = metrics
+        self.retry = retry
+        self.slow_query_ms = slow_query_ms
+        self.log_params_rows = int(log_params_rows)
+        self.cache = cache
+        self.prepared = bool(prepared)
+        self.stmt_cache_size = int(stmt_cache_size)
+        if self.max_size <= 0 or self.min_size < 0 or self.min_size > self.max_size:
+            raise UmsException("error pool size, need 0 <= min_size <= max_size")
+
+        # 空闲连接，元素为(conn, 归还时间)，右边是最近归还的
+        self._idle = collections.deque()
+        # 已创建（包括借出和空闲）的连接数
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        # 每个连接的预编译语句缓存，id(conn) -> OrderedDict，连接关闭时一起关闭
+        self._stmtCaches = {}
+
+        for i in range(self.min_size):
+            self._idle.append((self._create(), time.time()))
+            self._size += 1
+
+    @classmethod
+    def from_config(cls, config=None, section='DATABASE'):
+        """根据配置文件创建连接池
+
+        Args:
+            @param config  : UmsConfig，默认为globalConfig
+            @param section : 配置所在的section
+
+        Returns: UmsDBPool
+        """
+        if config is None:
+            from umsconfig import globalConfig
+            config = globalConfig
+
+        return cls(config.get(section, 'db.host'),
+                   config.get(section, 'db.port'),
+                   config.get(section, 'db.username'),
+                   config.getRaw(section, 'db.password'),
+                   config.get(section, 'db.database'),
+                   min_size=config.get(section, 'db.pool.min_size', fallback=1),
+                   max_size=config.get(section, 'db.pool.max_size', fallback=10),
+                   idle_timeout=config.get(section, 'db.pool.idle_timeout', fallback=300),
+                   wait_timeout=config.get(section, 'db.pool.wait_timeout', fallback=30))
+
+    def _create(self):
+        return _open_connection(self.host, self.port, self.username, self.password,
+                                self.database, charset=self.charset,
+                                raise_on_warnings=self.raise_on_warnings,
+                                allow_local_infile=self.allow_local_infile)
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        with self._cond:
+            stmts = self._stmtCaches.pop(id(conn), None)
+        for cursor in (stmts or {}).values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _stmtCacheFor(self, conn):
+        """连接的预编译语句缓存，借出同一个连接的UmsDB共用
+        """
+        with self._cond:
+            return self._stmtCaches.setdefault(id(conn), collections.OrderedDict())
+
+    def _evict(self):
+        """回收空闲超时的连接，调用方需持有锁
+        """
+        if self.idle_timeout <= 0:
+            return
+        expire = time.time() - self.idle_timeout
+        while self._idle and self._size > self.min_size and self._idle[0][1] < expire:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def acquire(self, timeout=None):
+        """从连接池借出一个连接，使用完毕后必须调用release归还
+
+        Args:
+            @param timeout : 等待可用连接的最长时间，默认为wait_timeout
+
+        Returns: mysql.connector的连接
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        start = time.time()
+        deadline = start + timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise UmsException("pool closed")
+
+                self._evict()
+                if self._idle:
+                    # 优先使用最近归还的连接
+                    conn, _ = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise UmsException("get connection from pool timeout")
+                self._cond.wait(remaining)
+
+        if self.metrics is not None:
+            self.metrics.record_pool_wait(time.time() - start)
+
+        if conn is not None and self._healthy(conn):
+            return conn
+
+        # 新建连接，或者替换掉已经失效的连接，名额已经在上面占好了
+        if conn is not None:
+            logger.warning("pooled connection is broken, reconnecting")
+            self._close_quietly(conn)
+            if self.metrics is not None:
+                self.metrics.record_reconnect()
+        try:
+            return self._create()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """归还连接
+
+        Args:
+            @param conn    : acquire借出的连接
+            @param discard : 是否直接丢弃该连接（例如连接已经出错）
+
+        Returns: void
+        """
+        if not discard:
+            try:
+                # 清理未读取的结果和未提交的事务，避免影响下一个使用者
+                if conn.unread_result:
+                    conn.consume_results()
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """借出一个UmsDB，退出with时自动归还连接
+
+        with pool.connection() as db:
+            db.findList('t_test')
+        """
+        db = UmsDB.from_pool(self)
+        db.connect()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def close(self):
+        """关闭连接池中的空闲连接，借出的连接在归还时关闭
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+        logger.info("connection pool closed")
+
+
 if __name__ == '__main__':
 
     from umsconfig import globalConfig
@@ -7,13 +7,40 @@
 上传和下载FTP文件进行简单封装
 """
 
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import json
 import os
+import posixpath
+import socket
 import sys 
 import ftplib
+import threading
+import time
 
 from umsconfig import globalConfig
 from umslogger import logger
+from umsexception import UmsException
+
+# 默认的传输块大小，每块调用一次回调，块太小时Python的开销会成为瓶颈
+BLOCK_SIZE = 1048576
+
+
+class _FTP(ftplib.FTP):
+    """可以设置数据连接socket缓冲区大小的FTP
+    """
+
+    sock_buf = None
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super().ntransfercmd(cmd, rest)
+        if self.sock_buf:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.sock_buf)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sock_buf)
+        return conn, size
+
 
 def ftp_connect(ftp_config):
     """建立FTP链接
@@ -23,6 +50,9 @@ def ftp_connect(ftp_config):
         port: 主机端口
         username: 用户名
         password: 密码
+        debug: 可选，调试级别，默认0不输出，2显示详细信息
+        block_size: 可选，传输块大小，默认BLOCK_SIZE
+        sock_buf: 可选，数据连接的socket收发缓冲区大小，默认使用系统的设置
 
     Returns:
         A ftp connection handler
@@ -35,20 +65,40 @@ def ftp_connect(ftp_config):
     password = ftp_config['password']
 
     # 创建ftp对象实例 
-    ftp = ftplib.FTP()
-    # 打开调试级别2，显示详细信息
-    ftp.set_debuglevel(2)
+    ftp = _FTP()
+    ftp.block_size = int(ftp_config.get('block_size') or BLOCK_SIZE)
+    ftp.sock_buf = int(ftp_config.get('sock_buf') or 0)
+    # 调试级别2会把每条命令和响应都打印出来，默认关闭
+    ftp.set_debuglevel(int(ftp_config.get('debug') or 0))
     ftp.connect(host, port, timeout=30)
     # 登录，如果匿名登录则用空串代替即可
     ftp.login(username, password)
     return ftp
 
-def download(ftp, local, remote):
+def remote_size(ftp, remote):
+    """查询远程文件的大小，文件不存在或服务器不支持SIZE命令时返回None
+    """
+    try:
+        # SIZE需要在二进制模式下才是准确的字节数
+        ftp.voidcmd('TYPE I')
+        return ftp.size(remote)
+    except ftplib.error_perm:
+        return None
+
+def _check_size(local, remote, expect, actual):
+    if expect is not None and actual is not None and expect != actual:
+        raise UmsException('文件大小不一致，local=[{}] remote=[{}] {} != {}'.format(
+            local, remote, expect, actual))
+
+def download(ftp, local, remote, quit=True, resume=False, block_size=None):
     """下载远程FTP文件到本地
 
     Args:
         local:  本地文件的绝对路径
         remote: 远程文件的绝对路径
+        quit:   下载完是否退出登录，复用连接时传False
+        resume: 是否断点续传，本地文件已存在时从本地文件的大小处继续下载，完成后校验大小
+        block_size: 传输块大小，默认使用ftp_connect时配置的大小
 
     Returns:
         void
@@ -56,25 +106,48 @@ def download(ftp, local, remote):
     """
 
     # 设置缓冲块大小
-    bufSize = 2048
-    # 以写模式在本地打开文件
-    fp = open(local, 'wb')
-    # 接收服务器上文件并写入本地文件
-    command = 'RETR {}'.format(remote)
-    logger.info('下载文件执行的命令=[{}]'.format(command))
-    ftp.retrbinary(command, fp.write, bufSize)
-    # 关闭调试
-    ftp.set_debuglevel(0)
-    fp.close()
-    # 退出ftp服务器
-    ftp.quit()
-
-def upload(ftp, local, remote):
+    bufSize = block_size or getattr(ftp, 'block_size', BLOCK_SIZE)
+    offset = 0
+    size = None
+    if resume:
+        size = remote_size(ftp, remote)
+        if size is not None and os.path.exists(local):
+            offset = os.path.getsize(local)
+            if offset > size:
+                # 本地文件比远程的还大，说明不是同一个文件，重新下载
+                offset = 0
+
+    # 零字节的文件offset也等于size，本地文件确实存在时才跳过
+    if size is not None and offset == size and os.path.exists(local):
+        logger.info('本地文件已完整，无需下载=[{}]'.format(local))
+    else:
+        # 续传时以追加模式打开，否则以写模式在本地打开文件；
+        # 每次收到的数据通常只有几十KB，写缓冲和块大小一致，攒满一块才写一次磁盘
+        fp = open(local, 'ab' if offset else 'wb', buffering=bufSize)
+        # 接收服务器上文件并写入本地文件
+        command = 'RETR {}'.format(remote)
+        logger.info('下载文件执行的命令=[{}] offset=[{}]'.format(command, offset))
+        try:
+            ftp.retrbinary(command, fp.write, bufSize, rest=offset or None)
+        finally:
+            fp.close()
+        if resume:
+            _check_size(local, remote, size, os.path.getsize(local))
+    if quit:
+        # 关闭调试
+        ftp.set_debuglevel(0)
+        # 退出ftp服务器
+        ftp.quit()
+
+def upload(ftp, local, remote, quit=True, resume=False, block_size=None):
     """上传本地文件到远程FTP目录
     
     Args:
         local:  本地文件的绝对路径
         remote: 远程文件的绝对路径
+        quit:   上传完是否退出登录，复用连接时传False
+        resume: 是否断点续传，远程文件已存在时用APPE从远程文件的大小处继续上传，完成后校验大小
+        block_size: 传输块大小，默认使用ftp_connect时配置的大小
 
     Returns:
         void
@@ -82,21 +155,612 @@ def upload(ftp, local, remote):
     """
 
     #设置缓冲块大小
-    bufSize = 2048
-    fp = open(local, 'rb')
-    #try:
-    #    today = datetime.datetime.now().strftime("%Y%m%d")
-    #    ftp.mkd(today)
-    #except:
-    #    print ("文件存在，无需再创建")
-    #上传文件
-    command = 'STOR {}'.format(remote)
-    logger.info('上传文件执行的命令=[{}]'.format(command))
-    ftp.storbinary(command, fp, bufSize)
-    #关闭调试
-    ftp.set_debuglevel(0)
-    fp.close()
-    ftp.quit()
+    bufSize = block_size or getattr(ftp, 'block_size', BLOCK_SIZE)
+    size = os.path.getsize(local)
+    offset = 0
+    exists = False
+    if resume:
+        offset = remote_size(ftp, remote)
+        exists = offset is not None
+        offset = offset or 0
+        if offset > size:
+            # 远程文件比本地的还大，说明不是同一个文件，重新上传
+            offset = 0
+
+    # 零字节的文件offset也等于size，远程文件确实存在时才跳过
+    if exists and offset == size:
+        logger.info('远程文件已完整，无需上传=[{}]'.format(remote))
+    else:
+        fp = open(local, 'rb')
+        #try:
+        #    today = datetime.datetime.now().strftime("%Y%m%d")
+        #    ftp.mkd(today)
+        #except:
+        #    print ("文件存在，无需再创建")
+        #上传文件，续传时跳过已上传的部分，追加到远程文件末尾
+        command = '{} {}'.format('APPE' if offset else 'STOR', remote)
+        logger.info('上传文件执行的命令=[{}] offset=[{}]'.format(command, offset))
+        try:
+            fp.seek(offset)
+            ftp.storbinary(command, fp, bufSize)
+        finally:
+            fp.close()
+        if resume:
+            _check_size(local, remote, size, remote_size(ftp, remote))
+    if quit:
+        #关闭调试
+        ftp.set_debuglevel(0)
+        ftp.quit()
+
+# 连接层面的错误，重新连接后可以重试；只包括socket的错误，本地文件的OSError不算
+RECONNECT_ERRORS = (ftplib.error_temp, ftplib.error_reply, EOFError, ConnectionError, socket.timeout)
+# 远程文件不存在、没有权限，或者本地文件打不开，重试也没用；这些错误发生在传输开始之前，连接本身是好的
+NO_RETRY_ERRORS = (ftplib.error_perm, FileNotFoundError, PermissionError, IsADirectoryError,
+                   NotADirectoryError)
+
+
+class FtpSession(object):
+    """可复用的FTP连接
+
+    连接建立并登录后一直保持，多次download/upload共用，省去每个文件的TCP连接和登录；
+    空闲超过keepalive秒后，再次使用前先发NOOP探测，连接已断开则自动重连。
+
+        with FtpSession(ftp_config) as session:
+            for local, remote in files:
+                session.download(local, remote)
+    """
+
+    def __init__(self, ftp_config, keepalive=60):
+        """构造函数
+
+        Args:
+            ftp_config: 连接配置，同ftp_connect
+            keepalive:  空闲多少秒后使用前需要NOOP探测
+
+        Returns:
+            void
+        """
+        self.ftp_config = ftp_config
+        self.keepalive = keepalive
+        self.ftp = None
+        self.last_used = 0
+
+    def connect(self, force=False):
+        """建立连接并登录，已连接时直接返回
+        """
+        if self.ftp is not None and not force:
+            return self.ftp
+        self.close()
+        self.ftp = ftp_connect(self.ftp_config)
+        self.last_used = time.time()
+        return self.ftp
+
+    def noop(self):
+        """发送NOOP探测连接，断开则重连
+
+        Returns:
+            ftplib.FTP
+        """
+        if self.ftp is None:
+            return self.connect()
+        try:
+            self.ftp.voidcmd('NOOP')
+            self.last_used = time.time()
+        except RECONNECT_ERRORS:
+            logger.info('FTP连接已断开，重新连接')
+            self.connect(force=True)
+        return self.ftp
+
+    def _ready(self):
+        if self.ftp is None:
+            return self.connect()
+        if time.time() - self.last_used >= self.keepalive:
+            return self.noop()
+        return self.ftp
+
+    def _transfer(self, func, local, remote, resume=False):
+        # 第一次失败时重连再试一次，传输本身是从头开始的，重试是安全的
+        for attempt in range(2):
+            ftp = self._ready()
+            try:
+                result = func(ftp, local, remote, quit=False, resume=resume)
+                self.last_used = time.time()
+                return result
+            except RECONNECT_ERRORS as err:
+                if attempt > 0:
+                    raise
+                logger.warning('FTP传输失败，重新连接后重试：{}'.format(err))
+                self.connect(force=True)
+
+    def download(self, local, remote, resume=False):
+        """下载远程FTP文件到本地，连接保持不退出，resume同download
+        """
+        return self._transfer(download, local, remote, resume)
+
+    def upload(self, local, remote, resume=False):
+        """上传本地文件到远程FTP目录，连接保持不退出，resume同upload
+        """
+        return self._transfer(upload, local, remote, resume)
+
+    def close(self):
+        """退出登录并关闭连接
+        """
+        if self.ftp is None:
+            return
+        ftp, self.ftp = self.ftp, None
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class FtpPool(object):
+    """线程安全的FTP连接池
+
+        pool = FtpPool(ftp_config, max_size=4)
+        with pool.session() as session:
+            session.download(local, remote)
+        pool.close()
+
+    - 连接在第一次借出时才建立，最多max_size个
+    - 归还的连接保持登录状态，下次借出时空闲超过keepalive秒则先NOOP探测
+    - 出错的连接归还时传discard=True直接关闭
+    """
+
+    def __init__(self, ftp_config, max_size=4, keepalive=60, wait_timeout=30):
+        """构造函数
+
+        Args:
+            ftp_config:   连接配置，同ftp_connect
+            max_size:     最多允许的连接数
+            keepalive:    空闲多少秒后使用前需要NOOP探测
+            wait_timeout: 连接都被借出时，等待可用连接的最长时间，单位秒
+
+        Returns:
+            void
+        """
+        self.ftp_config = ftp_config
+        self.max_size = int(max_size)
+        self.keepalive = keepalive
+        self.wait_timeout = float(wait_timeout)
+        if self.max_size <= 0:
+            raise UmsException('error pool size, need max_size > 0')
+
+        self._idle = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        """借出一个FtpSession，用完需要release
+
+        Returns:
+            FtpSession
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise UmsException('ftp pool closed')
+                if self._idle:
+                    session = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    session = None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise UmsException('get ftp session from pool timeout')
+                self._cond.wait(remaining)
+
+        if session is None:
+            session = FtpSession(self.ftp_config, self.keepalive)
+        try:
+            session._ready()
+        except Exception:
+            self.release(session, discard=True)
+            raise
+        return session
+
+    def release(self, session, discard=False):
+        """归还FtpSession，discard为True时关闭连接
+        """
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                session.close()
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def session(self):
+        """借出一个FtpSession，退出with时自动归还，出现异常时丢弃该连接（NO_RETRY_ERRORS除外）
+        """
+        session = self.acquire()
+        try:
+            yield session
+        except NO_RETRY_ERRORS:
+            self.release(session)
+            raise
+        except BaseException:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+
+    def close(self):
+        """关闭空闲的连接，借出的连接在归还时关闭
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.popleft().close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class TransferResult(object):
+    """批量传输的结果
+
+    succeeded: 成功的文件，元素为 (local, remote, 字节数, 耗时秒)
+    failed:    失败的文件，元素为 (local, remote, 异常)
+    deleted:   mirror时删除的多余文件
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.deleted = []
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    @property
+    def throughput(self):
+        """平均吞吐量，单位字节/秒
+        """
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return 'TransferResult(succeeded={}, failed={}, bytes={}, elapsed={:.3f}s, {:.2f}MB/s)'.format(
+            len(self.succeeded), len(self.failed), self.bytes, self.elapsed,
+            self.throughput / 1048576)
+
+
+def _transfer_many(direction, ftp_config, pairs, workers, retries, retry_delay, progress, resume):
+    own_pool = None
+    if isinstance(ftp_config, FtpPool):
+        pool = ftp_config
+    else:
+        pool = own_pool = FtpPool(ftp_config, max_size=workers)
+
+    pairs = list(pairs)
+    result = TransferResult()
+    lock = threading.Lock()
+    start = time.time()
+
+    def work(local, remote):
+        begin = time.time()
+        for attempt in range(retries + 1):
+            try:
+                with pool.session() as session:
+                    if direction == 'download':
+                        session.download(local, remote, resume)
+                    else:
+                        session.upload(local, remote, resume)
+                break
+            except NO_RETRY_ERRORS:
+                raise
+            except Exception as err:
+                if attempt >= retries:
+                    raise
+                logger.warning('{} [{}] 第{}次失败，{}秒后重试：{}'.format(
+                    direction, remote, attempt + 1, retry_delay, err))
+                time.sleep(retry_delay)
+        return os.path.getsize(local), time.time() - begin
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(work, local, remote): (local, remote) for local, remote in pairs}
+            for future in concurrent.futures.as_completed(futures):
+                local, remote = futures[future]
+                with lock:
+                    try:
+                        size, elapsed = future.result()
+                        result.succeeded.append((local, remote, size, elapsed))
+                        result.bytes += size
+                    except Exception as err:
+                        logger.error('{} [{}] 失败：{}'.format(direction, remote, err))
+                        result.failed.append((local, remote, err))
+                    result.elapsed = time.time() - start
+                    if progress is not None:
+                        progress(len(result.succeeded) + len(result.failed), len(pairs), result)
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+
+    result.elapsed = time.time() - start
+    logger.info('{} finished: {}'.format(direction, result))
+    return result
+
+def download_many(ftp_config, pairs, workers=4, retries=2, retry_delay=1, progress=None,
+                  resume=False):
+    """并发下载多个文件，最多同时使用workers个FTP连接
+
+    Args:
+        ftp_config:  连接配置，同ftp_connect，也可以是FtpPool
+        pairs:       要下载的文件，元素为 (local, remote)
+        workers:     并发数
+        retries:     每个文件失败后最多重试几次，NO_RETRY_ERRORS中的错误不重试
+        retry_delay: 重试前等待的秒数
+        progress:    进度回调 progress(已完成数, 总数, TransferResult)，每完成一个文件调用一次
+        resume:      是否断点续传，重试时从上次中断的位置继续
+
+    Returns:
+        TransferResult
+    """
+    return _transfer_many('download', ftp_config, pairs, workers, retries, retry_delay, progress,
+                          resume)
+
+def upload_many(ftp_config, pairs, workers=4, retries=2, retry_delay=1, progress=None,
+                resume=False):
+    """并发上传多个文件，参数同download_many
+
+    Returns:
+        TransferResult
+    """
+    return _transfer_many('upload', ftp_config, pairs, workers, retries, retry_delay, progress,
+                          resume)
+
+
+# mirror的状态文件，保存上次同步成功时文件的大小和修改时间
+MIRROR_STATE = '.umsftp_mirror.json'
+MIRROR_UP_STATE = '.umsftp_mirror_up.json'
+
+def _safe_name(name):
+    # 服务器返回的文件名不能跳出所在的目录
+    if name in ('', '.', '..') or '/' in name or '\\' in name:
+        logger.warning('忽略不安全的远程文件名=[{}]'.format(name))
+        return False
+    return True
+
+def _local_path(local_dir, rel):
+    """相对路径转为local_dir下的本地路径，解析符号链接后不在local_dir下时抛出异常
+    """
+    path = os.path.join(local_dir, *rel.split('/'))
+    root = os.path.realpath(local_dir)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise UmsException('本地路径超出了目录 [{}]：{}'.format(local_dir, rel))
+    return path
+
+def _list_dir(ftp, path):
+    """列出远程目录，返回[(name, 是否目录, size, modify)]，优先MLSD，服务器不支持时使用LIST
+
+    含有路径分隔符或者为 . / .. 的文件名被忽略
+    """
+    try:
+        entries = []
+        for name, facts in ftp.mlsd(path, facts=['type', 'size', 'modify']):
+            kind = facts.get('type', '').lower()
+            if kind in ('dir', 'file') and not _safe_name(name):
+                continue
+            if kind == 'dir':
+                entries.append((name, True, None, None))
+            elif kind == 'file':
+                entries.append((name, False, int(facts.get('size', 0)), facts.get('modify')))
+        return entries
+    except ftplib.error_perm as err:
+        if not str(err).startswith(('500', '501', '502', '504')):
+            raise
+
+    lines = []
+    ftp.retrlines('LIST {}'.format(path), lines.append)
+    entries = []
+    for line in lines:
+        # -rw-r--r--   1 owner group   1234 Jan 01 12:00 name
+        parts = line.split(None, 8)
+        if len(parts) < 9 or parts[8] in ('.', '..') or not _safe_name(parts[8]):
+            continue
+        if parts[0].startswith('d'):
+            entries.append((parts[8], True, None, None))
+        elif parts[0].startswith('-'):
+            # LIST的时间格式不统一，只作为是否变化的依据
+            entries.append((parts[8], False, int(parts[4]), ' '.join(parts[5:8])))
+    return entries
+
+def list_tree(ftp, remote_dir):
+    """递归列出远程目录下的所有文件
+
+    Returns:
+        dict，相对路径 -> {'size': 字节数, 'modify': 修改时间}
+    """
+    files = {}
+    dirs = ['']
+    while dirs:
+        rel = dirs.pop()
+        for name, is_dir, size, modify in _list_dir(ftp, posixpath.join(remote_dir, rel)):
+            path = posixpath.join(rel, name) if rel else name
+            if is_dir:
+                dirs.append(path)
+            else:
+                files[path] = {'size': size, 'modify': modify}
+    return files
+
+def _local_tree(local_dir, skip):
+    files = {}
+    for root, dirs, names in os.walk(local_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            if rel in skip:
+                continue
+            st = os.stat(path)
+            files[rel] = {'size': st.st_size, 'modify': int(st.st_mtime)}
+    return files
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_state(path, state):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def _mirror_pool(ftp_config, workers):
+    if isinstance(ftp_config, FtpPool):
+        return ftp_config, None
+    pool = FtpPool(ftp_config, max_size=workers)
+    return pool, pool
+
+def mirror(ftp_config, remote_dir, local_dir, workers=4, delete=False, state_file=None,
+           retries=2, progress=None):
+    """把远程目录增量同步到本地
+
+    和上次同步成功时记录的大小、修改时间比较，只下载新增或变化了的文件。
+
+    Args:
+        ftp_config: 连接配置，同ftp_connect，也可以是FtpPool
+        remote_dir: 远程目录
+        local_dir:  本地目录，不存在则创建
+        workers:    并发数
+        delete:     是否删除本地多余的文件（远程已经不存在的）
+        state_file: 状态文件的路径，默认为 local_dir/.umsftp_mirror.json
+        retries:    每个文件失败后最多重试几次
+        progress:   进度回调，同download_many
+
+    Returns:
+        TransferResult
+    """
+    state_file = state_file or os.path.join(local_dir, MIRROR_STATE)
+    os.makedirs(local_dir, exist_ok=True)
+    state = _load_state(state_file)
+    pool, own_pool = _mirror_pool(ftp_config, workers)
+    try:
+        with pool.session() as session:
+            remote_files = list_tree(session.ftp, remote_dir)
+        skip = {os.path.relpath(p, local_dir).replace(os.sep, '/') for p in (state_file, state_file + '.tmp')}
+        local_files = _local_tree(local_dir, skip)
+
+        pairs = []
+        for rel, info in sorted(remote_files.items()):
+            local = local_files.get(rel)
+            if local is not None and local['size'] == info['size'] and state.get(rel) == info:
+                continue
+            path = _local_path(local_dir, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pairs.append((path, posixpath.join(remote_dir, rel)))
+        logger.info('mirror [{}] -> [{}]，远程{}个文件，需要下载{}个'.format(
+            remote_dir, local_dir, len(remote_files), len(pairs)))
+
+        result = download_many(pool, pairs, workers=workers, retries=retries, progress=progress)
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+
+    # 只记录下载成功和本来就是最新的文件，失败的下次重新下载
+    failed = {os.path.relpath(local, local_dir).replace(os.sep, '/') for local, _, _ in result.failed}
+    state = {rel: info for rel, info in remote_files.items() if rel not in failed}
+
+    if delete:
+        for rel in sorted(set(local_files) - set(remote_files)):
+            os.remove(_local_path(local_dir, rel))
+            result.deleted.append(rel)
+            logger.info('删除本地多余的文件=[{}]'.format(rel))
+
+    _save_state(state_file, state)
+    return result
+
+def _ensure_remote_dirs(ftp, remote_dir, rels):
+    dirs = sorted({posixpath.dirname(rel) for rel in rels if posixpath.dirname(rel)})
+    created = set()
+    for rel in dirs:
+        parts = rel.split('/')
+        for i in range(1, len(parts) + 1):
+            sub = '/'.join(parts[:i])
+            if sub in created:
+                continue
+            try:
+                ftp.mkd(posixpath.join(remote_dir, sub))
+            except ftplib.error_perm:
+                # 目录已存在
+                pass
+            created.add(sub)
+
+def mirror_upload(ftp_config, local_dir, remote_dir, workers=4, delete=False, state_file=None,
+                  retries=2, progress=None):
+    """把本地目录增量同步到远程，和mirror方向相反
+
+    和上次同步成功时记录的本地文件大小、修改时间比较，只上传新增或变化了的文件，
+    远程文件不存在或大小不一致时也会重新上传。
+
+    Args:
+        ftp_config: 连接配置，同ftp_connect，也可以是FtpPool
+        local_dir:  本地目录
+        remote_dir: 远程目录，需要已经存在
+        workers:    并发数
+        delete:     是否删除远程多余的文件（本地已经不存在的）
+        state_file: 状态文件的路径，默认为 local_dir/.umsftp_mirror_up.json
+        retries:    每个文件失败后最多重试几次
+        progress:   进度回调，同upload_many
+
+    Returns:
+        TransferResult
+    """
+    state_file = state_file or os.path.join(local_dir, MIRROR_UP_STATE)
+    state = _load_state(state_file)
+    skip = {os.path.relpath(p, local_dir).replace(os.sep, '/') for p in (state_file, state_file + '.tmp')}
+    local_files = _local_tree(local_dir, skip)
+    pool, own_pool = _mirror_pool(ftp_config, workers)
+    try:
+        with pool.session() as session:
+            remote_files = list_tree(session.ftp, remote_dir)
+            pairs = []
+            for rel, info in sorted(local_files.items()):
+                remote = remote_files.get(rel)
+                if remote is not None and remote['size'] == info['size'] and state.get(rel) == info:
+                    continue
+                pairs.append((os.path.join(local_dir, *rel.split('/')), posixpath.join(remote_dir, rel)))
+            _ensure_remote_dirs(session.ftp, remote_dir,
+                                [posixpath.relpath(remote, remote_dir) for _, remote in pairs])
+        logger.info('mirror [{}] -> [{}]，本地{}个文件，需要上传{}个'.format(
+            local_dir, remote_dir, len(local_files), len(pairs)))
+
+        result = upload_many(pool, pairs, workers=workers, retries=retries, progress=progress)
+
+        if delete:
+            with pool.session() as session:
+                for rel in sorted(set(remote_files) - set(local_files)):
+                    session.ftp.delete(posixpath.join(remote_dir, rel))
+                    result.deleted.append(rel)
+                    logger.info('删除远程多余的文件=[{}]'.format(rel))
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+
+    failed = {os.path.relpath(local, local_dir).replace(os.sep, '/') for local, _, _ in result.failed}
+    _save_state(state_file, {rel: info for rel, info in local_files.items() if rel not in failed})
+    return result
 
 
 if __name__ == "__main__":
@@ -111,6 +775,8 @@ if __name__ == "__main__":
     ftp_config['port'] = globalConfig.get('FTP', 'ftp.port')
     ftp_config['username'] = globalConfig.get('FTP', 'ftp.username')
     ftp_config['password'] = globalConfig.get('FTP', 'ftp.password')
+    ftp_config['debug'] = globalConfig.get('FTP', 'ftp.debug', fallback=0)
+    ftp_config['block_size'] = globalConfig.get('FTP', 'ftp.block_size', fallback=BLOCK_SIZE)
 
     home = os.path.expanduser("~")
     date = sys.argv[1]
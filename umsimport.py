@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+把CSV/JSONL文件流水线式地导入数据库
+
+    stats = load_file('t_user.csv', 't_user', {'id': 'id', 'name': 'name'}, pool,
+                      workers=4, writers=4)
+
+文件按block_size大块读取，每块交给解析线程（或进程）池解析、转换，
+解析结果进入有界队列，由writers个写入线程各自从连接池借一个连接，调用insertBatch分片写入。
+读文件、解析和数据库往返同时进行；写入跟不上时队列满，读文件自动暂停，内存占用有上限。
+
+解析或转换失败的行写入拒绝文件（默认 path + '.reject'），不影响其他行；
+写库失败则整个导入中止并抛出异常，已提交的数据不会回滚。
+"""
+
+import collections
+import concurrent.futures
+import csv
+import io
+import json
+import queue
+import threading
+import time
+
+from umsdb import UmsDBPool
+from umslogger import logger
+from umsexception import UmsException
+
+FORMATS = ('csv', 'jsonl')
+EXECUTORS = ('thread', 'process')
+
+def _blocks(f, block_size, quotechar):
+    """按块读取文件，每块在完整的记录边界处截断，剩下的部分拼到下一块
+
+    CSV字段中可以包含换行，截断处之前的引号个数为偶数时才是记录边界
+    """
+    rest = b''
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        block = rest + data
+        pos = block.rfind(b'\n')
+        if quotechar:
+            while pos >= 0 and block.count(quotechar, 0, pos) % 2:
+                pos = block.rfind(b'\n', 0, pos)
+        if pos < 0:
+            rest = block
+            continue
+        rest = block[pos + 1:]
+        yield block[:pos + 1]
+    if rest:
+        yield rest
+
+def _decode(block, encoding):
+    """解码一块数据，返回[(文本, 是否解码失败)]，整块失败时逐行解码，只有坏的行被拒绝
+    """
+    try:
+        return [(block.decode(encoding), False)]
+    except UnicodeDecodeError:
+        result = []
+        for line in block.splitlines(True):
+            try:
+                result.append((line.decode(encoding), False))
+            except UnicodeDecodeError:
+                result.append((line.decode(encoding, 'replace'), True))
+        return result
+
+def _record(fields, header):
+    if header is None:
+        return fields
+    if len(fields) != len(header):
+        raise ValueError("expect {} fields, got {}".format(len(header), len(fields)))
+    return dict(zip(header, fields))
+
+def _convert(record, mapping, null):
+    row = []
+    for src in mapping:
+        value = src(record) if callable(src) else record[src]
+        row.append(None if null is not None and value == null else value)
+    return row
+
+def _parse_block(block, fmt, header, mapping, options):
+    """解析并转换一块数据，在解析线程或进程中运行
+
+    Returns: (rows, 拒绝的原始行, 第一个错误)
+    """
+    encoding, delimiter, quotechar, null = options
+    rows = []
+    rejects = []
+    error = None
+    for text, bad in _decode(block, encoding):
+        if bad:
+            rejects.append(text)
+            error = error or 'decode error'
+            continue
+
+        if fmt == 'csv':
+            lines = io.StringIO(text, newline='')
+            reader = csv.reader(lines, delimiter=delimiter, quotechar=quotechar)
+            start = 0
+            while True:
+                try:
+                    fields = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as err:
+                    raw = text[start:lines.tell()]
+                    start = lines.tell()
+                    rejects.append(raw)
+                    error = error or str(err)
+                    continue
+                raw_end = lines.tell()
+                if not fields:
+                    start = raw_end
+                    continue
+                try:
+                    rows.append(_convert(_record(fields, header), mapping, null))
+                except Exception as err:
+                    rejects.append(text[start:raw_end])
+                    error = error or repr(err)
+                start = raw_end
+        else:
+            for line in text.splitlines(True):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(_convert(json.loads(line), mapping, None))
+                except Exception as err:
+                    rejects.append(line)
+                    error = error or repr(err)
+    return rows, rejects, error
+
+def _read_header(f, encoding, delimiter, quotechar):
+    """读取CSV的首行作为列名，返回(列名, 首行的字节数)
+    """
+    line = f.readline()
+    names = next(csv.reader([line.decode(encoding).lstrip('\ufeff')],
+                            delimiter=delimiter, quotechar=quotechar), [])
+    return [name.strip() for name in names], len(line)
+
+
+class _Writers(object):
+    """写入线程组，从有界队列中取数据写库
+    """
+
+    def __init__(self, pool, table, cols, count, queue_size, insert_kwargs):
+        self.pool = pool
+        self.table = table
+        self.cols = cols
+        self.insert_kwargs = insert_kwargs
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.error = None
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name='umsimport-writer-{}'.format(i))
+                         for i in range(count)]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def _run(self):
+        try:
+            with self.pool.connection() as db:
+                while True:
+                    rows = self.queue.get()
+                    if rows is None:
+                        return
+                    if self.stop.is_set():
+                        continue
+                    n = db.insertBatch(self.table, self.cols, rows, **self.insert_kwargs)
+                    with self._lock:
+                        self.rows += n
+        except Exception as err:
+            logger.error("import writer failed: {}".format(err))
+            with self._lock:
+                self.error = self.error or err
+            self.stop.set()
+            # 把队列里剩下的取完，避免读文件的线程阻塞在put上
+            while self.queue.get() is not None:
+                pass
+
+    def put(self, rows):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(rows, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise self.error
+
+    def close(self):
+        for t in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+        if self.error is not None:
+            raise self.error
+
+
+def load_file(path, table, mapping=None, db_config=None, fmt='csv', header=True,
+              encoding='utf-8', delimiter=',', quotechar='"', null='', workers=4, writers=4,
+              executor='thread', block_size=4194304, queue_size=8, chunk_size=1000,
+              reject_path=None, progress=None):
+    """流水线式地导入文件
+
+    Args:
+        @param path        : 要导入的文件
+        @param table       : 表名
+        @param mapping     : 表列 -> 数据来源，dict，来源可以是CSV的列名（header=False时为下标）、
+                             JSON的key，或者函数 f(record) 返回该列的值，record为dict（header=False时为list），
+                             None则使用CSV的首行作为表列，JSONL不能为None
+        @param db_config   : UmsDBPool，或UmsDB构造参数组成的dict，None则读取配置文件的DATABASE
+        @param fmt         : 文件格式，csv或jsonl
+        @param header      : CSV的首行是否为列名
+        @param encoding    : 文件编码
+        @param delimiter   : CSV的分隔符
+        @param quotechar   : CSV的引号
+        @param null        : CSV中等于该值的字段写为NULL，None则不转换
+        @param workers     : 解析的并发数
+        @param writers     : 写库的线程数，也是同时占用的连接数，db_config为UmsDBPool时不超过它的max_size
+        @param executor    : 解析使用thread或process，process时mapping中的函数需要可以pickle
+        @param block_size  : 每次读文件的字节数
+        @param queue_size  : 解析结果队列的长度，队列满时暂停读文件
+        @param chunk_size  : 每次insert的条数，参见insertBatch
+        @param reject_path : 拒绝文件的路径，默认为 path + '.reject'，没有拒绝的行则不生成
+        @param progress    : 进度回调 progress(stats)，每写入一块调用一次
+
+    Returns: 统计，dict，rows/rejected/bytes/elapsed/rows_per_sec/mb_per_sec
+    """
+    if fmt not in FORMATS:
+        raise UmsException("error fmt, need csv or jsonl")
+    if executor not in EXECUTORS:
+        raise UmsException("error executor, need thread or process")
+    if fmt == 'jsonl' and not mapping:
+        raise UmsException("jsonl need mapping")
+
+    reject_path = reject_path or path + '.reject'
+    stats = {'rows': 0, 'rejected': 0, 'bytes': 0, 'elapsed': 0.0,
+             'rows_per_sec': 0.0, 'mb_per_sec': 0.0}
+    start = time.time()
+
+    def update(n, size):
+        stats['bytes'] += size
+        stats['rejected'] += n
+        stats['elapsed'] = elapsed = time.time() - start
+        if elapsed > 0:
+            stats['rows_per_sec'] = round(stats['rows'] / elapsed, 1)
+            stats['mb_per_sec'] = round(stats['bytes'] / 1048576 / elapsed, 3)
+
+    writers = max(1, int(writers))
+    own_pool = None
+    if isinstance(db_config, UmsDBPool):
+        pool = db_config
+        # 每个写入线程在整个导入期间占用一个连接，超过池的大小时多出的线程会等待超时
+        if writers > pool.max_size:
+            logger.warning("writers [{}] exceeds pool max_size, use [{}]".format(writers, pool.max_size))
+            writers = pool.max_size
+    elif db_config is None:
+        pool = own_pool = UmsDBPool.from_config()
+    else:
+        pool = own_pool = UmsDBPool(**dict(db_config, min_size=0, max_size=writers))
+
+    rejects = None
+    f = open(path, 'rb')
+    try:
+        names = None
+        if fmt == 'csv' and header:
+            names, size = _read_header(f, encoding, delimiter, quotechar)
+            stats['bytes'] += size
+        if mapping is None:
+            if names is None:
+                raise UmsException("csv without header need mapping")
+            mapping = dict(zip(names, names))
+        cols = list(mapping.keys())
+        options = (encoding, delimiter, quotechar, null)
+        args = (fmt, names, list(mapping.values()), options)
+        quote = quotechar.encode(encoding) if fmt == 'csv' and quotechar else None
+
+        pool_class = (concurrent.futures.ProcessPoolExecutor if executor == 'process'
+                      else concurrent.futures.ThreadPoolExecutor)
+        output = _Writers(pool, table, cols, writers, max(1, int(queue_size)),
+                          {'chunk_size': chunk_size})
+        try:
+            with pool_class(max_workers=max(1, int(workers))) as parsers:
+                # 提交解析的块数有上限，按提交顺序取结果，拒绝文件中的行保持原有的顺序
+                pending = collections.deque()
+
+                def drain(limit):
+                    nonlocal rejects
+                    while len(pending) > limit:
+                        future, size = pending.popleft()
+                        rows, bad, error = future.result()
+                        if bad:
+                            if rejects is None:
+                                rejects = open(reject_path, 'w', encoding=encoding, newline='')
+                                logger.warning("reject rows to [{}], first error: {}".format(
+                                    reject_path, error))
+                            rejects.writelines(bad)
+                        if rows:
+                            output.put(rows)
+                            stats['rows'] += len(rows)
+                        update(len(bad), size)
+                        if progress is not None:
+                            progress(dict(stats))
+
+                for block in _blocks(f, int(block_size), quote):
+                    if output.stop.is_set():
+                        break
+                    pending.append((parsers.submit(_parse_block, block, *args), len(block)))
+                    drain(max(1, int(workers)) * 2)
+                drain(0)
+        finally:
+            output.close()
+    finally:
+        f.close()
+        if rejects is not None:
+            rejects.close()
+        if own_pool is not None:
+            own_pool.close()
+
+    stats['rows'] = output.rows
+    update(0, 0)
+    logger.info("import [{}] into [{}] rows=[{}] rejected=[{}] elapsed=[{:.3f}s] "
+                "rows/s=[{}] MB/s=[{}]".format(path, table, stats['rows'], stats['rejected'],
+                                               stats['elapsed'], stats['rows_per_sec'],
+                                               stats['mb_per_sec']))
+    return stats
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    if len(sys.argv) != 3:
+        print("usage: python umsimport.py file.csv table")
+        sys.exit(1)
+
+    load_file(sys.argv[1], sys.argv[2])
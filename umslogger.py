@@ -16,10 +16,14 @@ LOG_FILENAME = 'logs/ums_{}.log'.format(today)
 if not os.path.exists(os.path.dirname(LOG_FILENAME)):
     os.makedirs(os.path.dirname(LOG_FILENAME))
 
+# 日志级别，可以通过环境变量UMS_LOG_LEVEL调整，例如INFO
+# 生产环境建议使用INFO，DEBUG级别会记录每一条SQL及其参数
+LOG_LEVEL = os.environ.get('UMS_LOG_LEVEL', 'DEBUG').upper()
+
 logger = logging.getLogger()
 
-def set_logger():
-    logger.setLevel(logging.DEBUG)
+def set_logger(level=LOG_LEVEL):
+    logger.setLevel(level)
     formatter = logging.Formatter('%(asctime)s-[%(process)d-%(threadName)s]-'
                                   '[%(pathname)s line:%(lineno)d]-%(levelname)s: %(message)s')
     console_handler = logging.StreamHandler()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# date: 2026-10-18
+
+"""
+SQL执行统计：按SQL形状统计次数、耗时分布（p50/p95/p99）、行数、发送字节数，
+以及连接池等待时间和重连次数
+
+    metrics = UmsMetrics()
+    db = UmsDB(host, port, username, password, database, metrics=metrics)
+    ...
+    logger.info(db.stats())
+
+可以通过add_hook注册自己的采集器（例如导出到Prometheus），
+hook需要实现 before_execute(sql, params) 和
+after_execute(sql, params, elapsed, rowcount, error) 两个方法，elapsed单位为秒。
+
+未设置metrics时UmsDB不做任何统计，没有额外开销。
+"""
+
+import bisect
+import functools
+import re
+import threading
+
+from umsdb import _estimate_size
+
+# 耗时分桶的上界，单位毫秒，0.1ms到60s按约1.5倍递增
+LATENCY_BUCKETS = [round(0.1 * 1.5 ** i, 3) for i in range(33)]
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"(?<![\w`])-?\d+(?:\.\d+)?(?![\w`])")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\?")
+_VALUES_RE = re.compile(r"(\(\?(?:\s*,\s*\?)*\))(?:\s*,\s*\(\?(?:\s*,\s*\?)*\))+")
+_IN_RE = re.compile(r"\bIN\s*\(\?(?:\s*,\s*\?)*\)", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+@functools.lru_cache(maxsize=4096)
+def sql_shape(sql):
+    """把SQL归一化为形状，字面量和占位符替换为?，多行VALUES和IN列表合并为一组
+
+    例：SELECT * FROM t WHERE id = 1 AND name = 'a' -> SELECT * FROM t WHERE id = ? AND name = ?
+    """
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _PARAM_RE.sub('?', shape)
+    shape = _VALUES_RE.sub(r'\1', shape)
+    shape = _IN_RE.sub('IN (?)', shape)
+    return _SPACE_RE.sub(' ', shape).strip()
+
+def params_size(params):
+    """估算参数的字节数
+    """
+    if not params:
+        return 0
+    if isinstance(params, dict):
+        return _estimate_size(params.values())
+    if isinstance(params, list):
+        return sum([_estimate_size(row) for row in params])
+    return _estimate_size(params)
+
+
+class Histogram(object):
+    """固定分桶的直方图，分位数取所在桶的上界，是近似值
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                # 最后一个桶没有上界，用最大值
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class _ShapeStats(object):
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.rows = 0
+        self.bytes_sent = 0
+
+
+class UmsMetrics(object):
+    """线程安全，可以被多个UmsDB和UmsDBPool共用
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes = {}
+        self._hooks = []
+        self.pool_wait = Histogram()
+        self.reconnects = 0
+
+    def add_hook(self, hook):
+        """注册采集器，hook需要实现before_execute和after_execute
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def before_execute(self, sql, params):
+        for hook in self._hooks:
+            hook.before_execute(sql, params)
+
+    def after_execute(self, sql, params, elapsed, rowcount, error=None):
+        """记录一次执行，elapsed单位为秒，rowcount为返回或影响的行数
+        """
+        shape = sql_shape(sql)
+        size = len(sql) + params_size(params)
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                stats = self._shapes[shape] = _ShapeStats()
+            stats.latency.observe(elapsed * 1000)
+            stats.bytes_sent += size
+            if error is not None:
+                stats.errors += 1
+            elif rowcount is not None and rowcount > 0:
+                stats.rows += rowcount
+
+        for hook in self._hooks:
+            hook.after_execute(sql, params, elapsed, rowcount, error)
+
+    def record_pool_wait(self, elapsed):
+        """记录从连接池借出连接的等待时间，单位秒
+        """
+        with self._lock:
+            self.pool_wait.observe(elapsed * 1000)
+
+    def record_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+
+    def stats(self):
+        """统计快照，耗时单位为毫秒，按总耗时倒序
+
+        Returns: dict
+        """
+        with self._lock:
+            shapes = []
+            for shape, s in self._shapes.items():
+                item = s.latency.snapshot()
+                item.update({
+                    'sql': shape,
+                    'total': s.latency.sum,
+                    'errors': s.errors,
+                    'rows': s.rows,
+                    'bytes_sent': s.bytes_sent,
+                })
+                shapes.append(item)
+            shapes.sort(key=lambda x: x['total'], reverse=True)
+
+            return {
+                'queries': shapes,
+                'pool_wait': self.pool_wait.snapshot(),
+                'reconnects': self.reconnects,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._shapes = {}
+            self.pool_wait = Histogram()
+            self.reconnects = 0